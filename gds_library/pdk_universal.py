@@ -1,62 +1,124 @@
-from functools import partial
+import os
 import json
-import gdsfactory as gf
-from gdsfactory.technology import (LayerLevel, LayerStack, LayerMap, LayerView, LayerViews)
-from gdsfactory.typings import Layer
 
-try:
-    with open('stack_universal.json', 'r') as file:
-        config = json.load(file)
-except FileNotFoundError:
-    raise Exception("Layer stack configuration file does not exist.")
+# layer stack configuration: $PDK_STACK_CONFIG, or stack_universal.json at the repository root
+CONFIG_FILE = os.environ.get('PDK_STACK_CONFIG',
+                             os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'stack_universal.json'))
 
 nm = 1e-3
-min_feat_size = config['min_feat_size']
 
-class MyLayerMap(LayerMap):
-    Si: Layer = tuple(config['Si_layer'])
-    SLAB: Layer = tuple(config['SLAB_layer'])
-    PORT: Layer = (1,10)
+_cache = {}
 
-LAYER = MyLayerMap()
+def load_config(config_file: str | None = None):
+    r""" layer stack configuration, read once.
 
-PORT_TYPE_TO_LAYER = dict(optical=(100,0))
+    Args:
+        config_file (str | None, optional): JSON file. Defaults to None, CONFIG_FILE.
+
+    Returns:
+        config (dict)
+    """
+    config_file = CONFIG_FILE if config_file is None else config_file
+    if config_file not in _cache:
+        try:
+            with open(config_file, 'r') as file:
+                _cache[config_file] = json.load(file)
+        except FileNotFoundError:
+            raise Exception(f"Layer stack configuration file {config_file} does not exist.")
+    return _cache[config_file]
+
+def _layers():
+    r""" layer map and views of the configuration, gdsfactory is imported on first use.
+    """
+    if 'layers' not in _cache:
+        from gdsfactory.technology import LayerMap, LayerView, LayerViews
+        from gdsfactory.typings import Layer
+        config = load_config()
+
+        class MyLayerMap(LayerMap):
+            Si: Layer = tuple(config['Si_layer'])
+            SLAB: Layer = tuple(config['SLAB_layer'])
+            PORT: Layer = (1,10)
+
+        LAYER = MyLayerMap()
 
-class MyLayerView(LayerViews):
-    Si: LayerView = LayerView()
-    SLAB: LayerView = LayerView()
-    PORT: LayerView = LayerView()
+        class MyLayerView(LayerViews):
+            Si: LayerView = LayerView()
+            SLAB: LayerView = LayerView()
+            PORT: LayerView = LayerView()
 
-LAYER_VIEWS = MyLayerView(layer_map=dict(LAYER))
+        _cache['layers'] = (LAYER, MyLayerView(layer_map=dict(LAYER)))
+    return _cache['layers']
+
+PORT_TYPE_TO_LAYER = dict(optical=(100,0))
 
 def get_layer_stack(
-        thickness_Si = config['Si_thickness'],
-        thickness_Si_clad = config['Si_clad_thickness'],
-        thickness_SLAB = config['SLAB_thickness'],
-        thickness_SLAB_clad = config['SLAB_clad_thickness']
-) -> LayerStack:
+        thickness_Si = None,
+        thickness_Si_clad = None,
+        thickness_SLAB = None,
+        thickness_SLAB_clad = None,
+):
+    r""" layer stack, thicknesses from the configuration unless given.
+    """
+    from gdsfactory.technology import LayerLevel, LayerStack
+    config = load_config()
+    LAYER, _ = _layers()
     return LayerStack(
         layers = dict(
             Si = LayerLevel(
                 layer = LAYER.Si,
-                thickness = thickness_Si,
+                thickness = config['Si_thickness'] if thickness_Si is None else thickness_Si,
                 zmin = 0,
             ),
             SLAB = LayerLevel(
                 layer = LAYER.SLAB,
-                thickness = thickness_SLAB,
+                thickness = config['SLAB_thickness'] if thickness_SLAB is None else thickness_SLAB,
                 zmin = 0,
             ),
         )
     )
 
-LAYER_STACK = get_layer_stack()
+def get_pdk():
+    r""" the PDK, built once.
+    """
+    if 'pdk' not in _cache:
+        import gdsfactory as gf
+        LAYER, LAYER_VIEWS = _layers()
+        _cache['pdk'] = gf.Pdk(
+            name = "universal - ZL",
+            layers = dict(LAYER),
+            layer_stack = get_layer_stack(),
+            layer_views = LAYER_VIEWS,
+        )
+    return _cache['pdk']
+
+def activate():
+    r""" build and activate the PDK; importing this module does neither.
 
-pdk = gf.Pdk(
-    name = "universal - ZL",
-    layers = dict(LAYER),
-    layer_stack = LAYER_STACK,
-    layer_views = LAYER_VIEWS,
-)
+    Returns:
+        pdk (gf.Pdk)
+    """
+    pdk = get_pdk()
+    if not _cache.get('active'):
+        pdk.activate()
+        _cache['active'] = True
+    return pdk
 
-pdk.activate()
\ No newline at end of file
+def __getattr__(name):
+    # configuration values and gdsfactory objects are built on first access
+    if name == 'config':
+        return load_config()
+    if name == 'min_feat_size':
+        return load_config()['min_feat_size']
+    if name == 'BOOLEAN_RULES':
+        # layer boolean rules, applied by the GDS importers when flag_boolean is set
+        return load_config().get('boolean_rules', [])
+    if name == 'LAYER':
+        return _layers()[0]
+    if name == 'LAYER_VIEWS':
+        return _layers()[1]
+    if name == 'LAYER_STACK':
+        return get_pdk().layer_stack
+    if name == 'pdk':
+        return get_pdk()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
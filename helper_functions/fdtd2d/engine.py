@@ -0,0 +1,192 @@
+import numpy as np
+
+# the engine works in normalized units: lengths in um, c = eps0 = mu0 = 1, time in um/c
+
+def lateral_modes(eps_line, dl, wavelength, num_modes: int = 1):
+    r""" 1D modes of a 2D cross-section, for the in-plane electric field (Hz) polarization.
+
+    Solves eps d/dl(1/eps dHz/dl) + k0^2 eps Hz = beta^2 Hz by finite differences.
+    The tangential electric field is E = beta/(k0 eps) Hz, modes are normalized to unit power.
+
+    Args:
+        eps_line (array): permittivity along the cross-section
+        dl (float): grid step (um)
+        wavelength (float): wavelength (um)
+        num_modes (int, optional): number of modes. Defaults to 1.
+
+    Returns:
+        n_eff (ndarray): effective indices, shape (num_modes,)
+        E (ndarray): tangential electric field profiles, shape (num_modes, N)
+        H (ndarray): Hz profiles, shape (num_modes, N)
+    """
+    k0 = 2*np.pi/wavelength
+    eps = np.asarray(eps_line, dtype=float)
+    num = eps.size
+
+    # inverse permittivity on the faces between cells, the outer faces take the edge values
+    inv_face = 1.0/np.concatenate(([eps[0]], 0.5*(eps[1:] + eps[:-1]), [eps[-1]]))
+    laplacian = (np.diag(-(inv_face[:-1] + inv_face[1:])) + np.diag(inv_face[1:-1], 1) + np.diag(inv_face[1:-1], -1))/dl**2
+
+    # symmetrized operator: sqrt(eps) (L + k0^2) sqrt(eps), similar to eps (L + k0^2)
+    root = np.sqrt(eps)
+    operator = root[:, None]*laplacian*root[None, :] + np.diag(k0**2*eps)
+    beta2, vectors = np.linalg.eigh(operator)
+    order = np.argsort(beta2)[::-1][:num_modes]
+
+    beta = np.sqrt(np.maximum(beta2[order], 0.0))
+    H = (root[:, None]*vectors[:, order]).T
+    E = beta[:, None]*H/(k0*eps[None, :])
+
+    power = 0.5*np.sum(E*H, axis=1)*dl
+    scale = 1.0/np.sqrt(np.where(power > 0, power, 1.0))
+    return beta/k0, E*scale[:, None], H*scale[:, None]
+
+def absorber_profile(num, cells, strength):
+    r""" graded (cubic) loss profile, zero inside and growing towards both ends over 'cells' cells.
+    """
+    depth = np.zeros(num)
+    if cells > 0:
+        ramp = (np.arange(cells, 0, -1) - 0.5)/cells
+        depth[:cells] = ramp
+        depth[num-cells:] = ramp[::-1]
+    return strength*depth**3
+
+def run_fdtd_2d(eps, dx, wavelength, fwidth, wavelengths, source, monitors,
+                absorber_cells: int = 40,
+                reflection: float = 1e-6,
+                courant: float = 0.99,
+                shutoff: float = 1e-5,
+                max_time: float | None = None,
+                verbose: bool = False):
+    r""" 2D FDTD on a uniform Yee grid for the Ex, Ey, Hz field components.
+
+    Args:
+        eps (ndarray): permittivity on the cell centers, shape (Nx, Ny)
+        dx (float): grid step (um), same in x and y
+        wavelength (float): center wavelength of the source pulse (um)
+        fwidth (float): frequency width of the Gaussian pulse (1/um)
+        wavelengths (array): wavelengths of the frequency-domain monitors (um)
+        source (dict): x-normal mode source, with 'index' (cell column) and 'profile' (Hz along y)
+        monitors (dict): name -> dict with 'axis' ('x' or 'y') and 'index' (face index along the axis)
+        absorber_cells (int, optional): thickness of the absorbing boundary in cells. Defaults to 40.
+        reflection (float, optional): target round-trip reflection of the absorber. Defaults to 1e-6.
+        courant (float, optional): Courant number. Defaults to 0.99.
+        shutoff (float, optional): stop when the field energy falls below this fraction of its peak. Defaults to 1e-5.
+        max_time (float | None, optional): maximum simulated time (um/c). Defaults to None, no limit.
+        verbose (bool, optional): print progress. Defaults to False.
+
+    Returns:
+        fields (dict): monitor name -> dict with 'E' and 'H', the tangential fields in the frequency domain, shape (n_wvl, N)
+        info (dict): time step, number of steps and simulated time
+    """
+    nx, ny = eps.shape
+    dt = courant*dx/np.sqrt(2.0)
+    omega = 2*np.pi/np.asarray(wavelengths)
+
+    # Gaussian pulse, same definition as the tidy3d GaussianPulse
+    omega0 = 2*np.pi/wavelength
+    tau = 1.0/(2*np.pi*fwidth)
+    t0 = 5.0*tau
+
+    # permittivity on the electric field positions
+    eps_x = 0.5*(eps[:, 1:] + eps[:, :-1])
+    eps_y = 0.5*(eps[1:, :] + eps[:-1, :])
+
+    # matched graded loss, the same rate for electric and magnetic fields
+    # a plane wave decays as exp(-n*loss*x), the cubic grading integrates to a quarter of the peak
+    n_min = np.sqrt(eps.min())
+    strength = 2*np.log(1.0/reflection)/(n_min*absorber_cells*dx)
+    loss = absorber_profile(nx, absorber_cells, strength)[:, None] + absorber_profile(ny, absorber_cells, strength)[None, :]
+    loss_x = 0.5*(loss[:, 1:] + loss[:, :-1])
+    loss_y = 0.5*(loss[1:, :] + loss[:-1, :])
+
+    ca_x = (1 - 0.5*loss_x*dt)/(1 + 0.5*loss_x*dt)
+    cb_x = dt/eps_x/(1 + 0.5*loss_x*dt)/dx
+    ca_y = (1 - 0.5*loss_y*dt)/(1 + 0.5*loss_y*dt)
+    cb_y = dt/eps_y/(1 + 0.5*loss_y*dt)/dx
+    da = (1 - 0.5*loss*dt)/(1 + 0.5*loss*dt)
+    db = dt/(1 + 0.5*loss*dt)/dx
+
+    Ex = np.zeros((nx, ny+1))
+    Ey = np.zeros((nx+1, ny))
+    Hz = np.zeros((nx, ny))
+
+    fields = {}
+    for name, monitor in monitors.items():
+        num = ny if monitor['axis'] == 'x' else nx
+        fields[name] = dict(E=np.zeros((omega.size, num), dtype=complex), H=np.zeros((omega.size, num), dtype=complex))
+
+    profile = np.asarray(source['profile'])
+    i_src = source['index']
+
+    energy_max = 0.0
+    step = 0
+    while True:
+        t = step*dt
+
+        # magnetic field at t + dt/2, then the soft source
+        Hz = da*Hz - db*((Ey[1:, :] - Ey[:-1, :]) - (Ex[:, 1:] - Ex[:, :-1]))
+        t_h = t + 0.5*dt
+        Hz[i_src, :] += np.exp(-((t_h - t0)/tau)**2)*np.sin(omega0*(t_h - t0))*profile
+
+        # electric field at t + dt, tangential components vanish on the outer boundary
+        Ex[:, 1:-1] = ca_x*Ex[:, 1:-1] + cb_x*(Hz[:, 1:] - Hz[:, :-1])
+        Ey[1:-1, :] = ca_y*Ey[1:-1, :] - cb_y*(Hz[1:, :] - Hz[:-1, :])
+        t_e = t + dt
+
+        # running discrete Fourier transform on the monitor lines
+        phase_h = np.exp(1j*omega*t_h)[:, None]*dt
+        phase_e = np.exp(1j*omega*t_e)[:, None]*dt
+        for name, monitor in monitors.items():
+            idx = monitor['index']
+            if monitor['axis'] == 'x':
+                E_line = Ey[idx, :]
+                H_line = 0.5*(Hz[max(idx-1, 0), :] + Hz[min(idx, nx-1), :])
+            else:
+                E_line = Ex[:, idx]
+                H_line = 0.5*(Hz[:, max(idx-1, 0)] + Hz[:, min(idx, ny-1)])
+            fields[name]['E'] += phase_e*E_line[None, :]
+            fields[name]['H'] += phase_h*H_line[None, :]
+
+        step += 1
+
+        # field decay check, once the pulse has been injected
+        if step % 50 == 0:
+            energy = np.sum(eps_x*Ex[:, 1:-1]**2) + np.sum(eps_y*Ey[1:-1, :]**2) + np.sum(Hz**2)
+            energy_max = max(energy_max, energy)
+            if verbose and step % 1000 == 0:
+                print(f'step {step}, t = {t_e:.1f} um/c, field decay {energy/max(energy_max, 1e-300):.2e}')
+            if t_e > 2*t0 and energy < shutoff*energy_max:
+                break
+            if max_time is not None and t_e > max_time:
+                print('\033[1;91mAttention: simulation stopped at max_time before the fields decayed.\033[0m')
+                break
+
+    info = dict(dt=dt, steps=step, time=step*dt)
+    return fields, info
+
+def mode_decomposition(E, H, mode_E, mode_H, dl, sign: float = 1.0):
+    r""" forward and backward mode amplitudes of frequency-domain fields on a line.
+
+    The mode (mode_E, mode_H) travels in the positive axis direction and carries unit power.
+
+    Args:
+        E (ndarray): tangential electric field, shape (n_wvl, N)
+        H (ndarray): Hz, shape (n_wvl, N)
+        mode_E (ndarray): mode electric field, shape (n_wvl, N)
+        mode_H (ndarray): mode Hz, shape (n_wvl, N)
+        dl (float): grid step (um)
+        sign (float, optional): +1 for x-normal lines (Sx = Ey Hz), -1 for y-normal lines (Sy = -Ex Hz). Defaults to 1.0.
+
+    Returns:
+        a_plus (ndarray): amplitude along the positive axis direction, shape (n_wvl,)
+        a_minus (ndarray): amplitude along the negative axis direction, shape (n_wvl,)
+    """
+    overlap_1 = sign*np.sum(E*np.conj(mode_H), axis=1)*dl
+    overlap_2 = sign*np.sum(np.conj(mode_E)*H, axis=1)*dl
+    return 0.25*(overlap_1 + overlap_2), 0.25*(overlap_1 - overlap_2)
+
+def net_flux(E, H, dl, sign: float = 1.0):
+    r""" time-averaged power through a line, along the positive axis direction.
+    """
+    return 0.5*np.real(sign*np.sum(E*np.conj(H), axis=1))*dl
@@ -0,0 +1,78 @@
+import numpy as np
+import gdsfactory as gf
+import gdstk
+
+from helper_functions.generic.gds_handling import get_layer_name_by_tuple
+from helper_functions.generic.layer_boolean import boolean_gds_cell, default_boolean_rules
+
+def rasterize_polygons(polygons, x, y):
+    r""" boolean map of the points of a rectilinear grid covered by a set of polygons.
+
+    Args:
+        polygons (list): arrays of polygon vertices (um)
+        x (array): grid x coordinates (um), ascending
+        y (array): grid y coordinates (um), ascending
+
+    Returns:
+        mask (ndarray): boolean array of shape (len(x), len(y))
+    """
+    from matplotlib.path import Path
+    mask = np.zeros((x.size, y.size), dtype=bool)
+    for points in polygons:
+        # only test the grid points inside the polygon bounding box
+        i0, i1 = np.searchsorted(x, [points[:, 0].min(), points[:, 0].max()])
+        j0, j1 = np.searchsorted(y, [points[:, 1].min(), points[:, 1].max()])
+        if i1 <= i0 or j1 <= j0:
+            continue
+        xx, yy = np.meshgrid(x[i0:i1], y[j0:j1], indexing='ij')
+        inside = Path(points).contains_points(np.column_stack((xx.ravel(), yy.ravel())))
+        mask[i0:i1, j0:j1] |= inside.reshape(xx.shape)
+    return mask
+
+def import_gds_to_grid(gds_file, x, y,
+                       cell_name: str | None = None,
+                       flag_boolean = 0,
+                       boolean_rules: list | None = None):
+    r""" rasterize each layer of the top cell on a 2D grid, using the layer stack of the active PDK.
+
+    Args:
+        gds_file (str): path to the GDS file
+        x (array): grid x coordinates (um)
+        y (array): grid y coordinates (um)
+        cell_name (str | None, optional): cell to import. Defaults to None, the top cell.
+        flag_boolean (int, optional): apply the layer boolean rules first. Defaults to 0.
+        boolean_rules (list | None, optional): boolean rules, defaults to the layer stack rules.
+
+    Returns:
+        masks (dict): layer name -> boolean map of shape (len(x), len(y))
+        layer_bounds (dict): layer name -> (zmin, zmax) in um
+    """
+    pdk = gf.get_active_pdk()
+    layers = pdk.get_layer_views().layer_map
+    layer_stack = pdk.get_layer_stack()
+
+    # without rules the layout is read as is
+    if flag_boolean and boolean_rules is None:
+        boolean_rules = default_boolean_rules()
+    if flag_boolean and boolean_rules:
+        gds_cell = boolean_gds_cell(gds_file, boolean_rules, layers, cell_name=cell_name)
+    else:
+        library = gdstk.read_gds(gds_file)
+        cells = {cell.name: cell for cell in library.cells}
+        gds_cell = cells[cell_name] if cell_name else library.top_level()[0]
+
+    polygons = {}
+    for polygon in gds_cell.get_polygons():
+        polygons.setdefault((polygon.layer, polygon.datatype), []).append(polygon.points)
+
+    masks = {}
+    layer_bounds = {}
+    for layer, points in polygons.items():
+        layer_name = get_layer_name_by_tuple(layer)
+        zmin = layer_stack.layers[layer_name].zmin
+        thickness = layer_stack.layers[layer_name].thickness
+
+        masks[layer_name] = rasterize_polygons(points, np.asarray(x), np.asarray(y))
+        layer_bounds[layer_name] = (zmin, zmin + thickness)
+
+    return masks, layer_bounds
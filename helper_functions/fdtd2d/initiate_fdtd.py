@@ -0,0 +1,206 @@
+from datetime import datetime
+import os
+import re
+import numpy as np
+import gdsfactory as gf
+
+from helper_functions.generic.misc import write_to_json
+from helper_functions.generic.materials import interpolate_nk
+from helper_functions.generic.simulation_spec import build_spec
+from helper_functions.fdtd2d.gds_handling import import_gds_to_grid
+from helper_functions.fdtd2d.materials import slab_effective_index, effective_index_map
+from helper_functions.fdtd2d.engine import run_fdtd_2d, lateral_modes, mode_decomposition, net_flux
+
+def fdtd_from_gds(parameters):
+    r""" run a 2.5D FDTD simulation of a device defined in a GDS, for fast screening.
+    The layer stack is collapsed vertically with the effective index method, and the
+    in-plane problem is solved by a local 2D FDTD engine. Only the TE-like (in-plane
+    electric field) polarization is modeled, and the effective indices are evaluated
+    at the center wavelength.
+
+    Args:
+        parameters (dict): simulation parameters
+
+    Returns:
+        results (dict): only if flag_run_simulation, same structure as the Lumerical results
+    """
+
+    # default parameters
+    p = dict(
+        wavelength = 1.55,
+        wav_span = 0.05,
+        wav_step = 0.01,
+
+        resolution = 12,
+
+        gds_file = 'mmi_1x2_450_VISPIC2.gds',
+        material_type = 'universal',
+        guiding_material = 'SiN',
+
+        file_name = 'test_'+str(datetime.now().strftime('%Y%m%d%H%M%S')),
+
+        mode_num = 5,
+        mode_idx = 0,   # counted from 0, as in Tidy3D
+
+        flag_extend = 1,
+        extension = 10,
+
+        flag_run_simulation = 0,
+        flag_boolean = 0,
+        flag_mode_preview = 0,
+
+        solver_z_min = -1,      # vertical range of the effective index solve
+        solver_z_max = 1,
+
+        subpixel = 3,           # sub-samples per cell for permittivity averaging
+        absorber = 1.5,         # absorbing boundary thickness (um)
+        pulse_fraction = 0.1,   # minimal pulse width relative to the center frequency
+        shutoff = 1e-5,
+
+        parametric = None,
+        spec_cache = None,
+    )
+
+    # update default setting with input
+    p.update(parameters)
+
+    # convert settings to local variables
+    for key, value in p.items():
+        globals()[key] = value
+
+    # save parameters to a JSON file
+    write_to_json(dict_name=p, json_name=file_name+'_fdtd.json')
+
+    # material indices at the center wavelength
+    n_core = interpolate_nk(os.path.join('materials_library', material_type+'_'+guiding_material), wavelength)[0]
+    n_clad = interpolate_nk(os.path.join('materials_library', material_type+'_SiO2'), wavelength)[0]
+
+    # layout work, shared with the 3D solvers
+    spec = build_spec(p, solver='fdtd2d', spec_cache=spec_cache)
+    write_to_json(dict_name=spec.to_dict(), json_name=file_name+'_spec.json')
+    sim_gds = spec.gds_file
+    ports = {port.name: port for port in spec.ports}
+    globals()['mode_num'] = spec.mode_num
+    solver_x_min, solver_y_min, _, solver_x_max, solver_y_max, _ = spec.domain
+
+    # grid step from the highest effective index of the stack
+    layer_stack = gf.get_active_pdk().get_layer_stack()
+    dz = 0.005
+    z = np.arange(solver_z_min, solver_z_max + 0.5*dz, dz)
+    n_profile = np.full(z.shape, n_clad)
+    for level in layer_stack.layers.values():
+        n_profile[(z >= level.zmin) & (z <= level.zmin + level.thickness)] = n_core
+    n_max = slab_effective_index(n_profile, dz, wavelength)
+    dx = wavelength/(n_max*resolution)
+
+    # cell centers, including the absorbing boundary
+    absorber_cells = int(np.ceil(absorber/dx))
+    x = np.arange(solver_x_min - absorber_cells*dx, solver_x_max + absorber_cells*dx, dx) + 0.5*dx
+    y = np.arange(solver_y_min - absorber_cells*dx, solver_y_max + absorber_cells*dx, dx) + 0.5*dx
+
+    # effective index on a sub-sampled grid, permittivity averaged back onto the cells
+    offsets = (np.arange(subpixel) + 0.5)/subpixel - 0.5
+    x_fine = (x[:, None] + offsets[None, :]*dx).ravel()
+    y_fine = (y[:, None] + offsets[None, :]*dx).ravel()
+    masks, layer_bounds = import_gds_to_grid(sim_gds, x_fine, y_fine, flag_boolean=flag_boolean)
+    n_eff = effective_index_map(masks, layer_bounds, n_core, n_clad, wavelength,
+                                z_min=solver_z_min, z_max=solver_z_max, dz=dz)
+    eps = (n_eff**2).reshape(x.size, subpixel, y.size, subpixel).mean(axis=(1, 3))
+
+    np.savez_compressed(file_name+'_eps.npz', x=x, y=y, eps=eps)
+
+    if not flag_run_simulation:
+        return
+
+    # wavelengths of the monitors
+    wavelengths = np.linspace(wavelength - 0.5*wav_span, wavelength + 0.5*wav_span, round(wav_span/wav_step)+1)
+    freq_start = 1/wavelengths[-1]
+    freq_stop = 1/wavelengths[0]
+    fwidth = max(freq_stop - freq_start, pulse_fraction/wavelength)
+
+    # mode source at the input port, light travels into the device along x
+    # modes are solved on a window of port width + 4 um across each port, as the port planes of the 3D solvers
+    into_device = 1.0 if ports['o1'].orientation == 180.0 else -1.0
+    i_src = int(np.searchsorted(x, ports['o1'].center[0]))
+    src_window = np.abs(y - ports['o1'].center[1]) <= 0.5*(ports['o1'].width + 4.0)
+    src_profile = np.zeros(y.size)
+    src_profile[src_window] = lateral_modes(eps[i_src, src_window], dx, wavelength, num_modes=mode_idx+1)[2][mode_idx]
+    source = dict(index=i_src, profile=src_profile)
+
+    # monitors: input port 0.5 um into the device, output ports at the port positions
+    monitors = {}
+    for port_name in ports:
+        if re.match(r'^o\d+$', port_name):
+            orientation = ports[port_name].orientation
+            center = ports[port_name].center
+            half_span = 0.5*(ports[port_name].width + 4.0)
+            if port_name == 'o1':
+                monitors[port_name] = dict(axis='x', index=int(np.searchsorted(x, center[0] + 0.5*into_device)),
+                                           window=np.abs(y - center[1]) <= half_span, outward=-into_device)
+            elif orientation in [0.0, 180.0]:
+                monitors[port_name] = dict(axis='x', index=int(np.searchsorted(x, center[0])),
+                                           window=np.abs(y - center[1]) <= half_span, outward=1.0 if orientation == 0.0 else -1.0)
+            elif orientation in [90.0, 270.0]:
+                monitors[port_name] = dict(axis='y', index=int(np.searchsorted(y, center[1])),
+                                           window=np.abs(x - center[0]) <= half_span, outward=1.0 if orientation == 90.0 else -1.0)
+
+    start_time = datetime.now()
+    print('Simulation started at '+str(start_time.strftime('%H:%M:%S')))
+
+    fields, info = run_fdtd_2d(eps, dx, wavelength, fwidth, wavelengths, source, monitors,
+                               absorber_cells=absorber_cells,
+                               shutoff=shutoff,
+                               max_time=16.0*(solver_x_max-solver_x_min)*2.0)
+
+    end_time = datetime.now()
+    print('Simulation finished at '+str(end_time.strftime('%H:%M:%S')))
+    dur = end_time - start_time
+    print('Duration '+str(dur.seconds)+' seconds')
+
+    # mode decomposition at every port, on the port window
+    amplitudes = {}
+    fluxes = {}
+    for port_name, monitor in monitors.items():
+        window = monitor['window']
+        if monitor['axis'] == 'x':
+            eps_line = eps[min(monitor['index'], x.size-1), window]
+            sign = 1.0
+        else:
+            eps_line = eps[window, min(monitor['index'], y.size-1)]
+            sign = -1.0
+        E_line = fields[port_name]['E'][:, window]
+        H_line = fields[port_name]['H'][:, window]
+
+        mode_E = np.zeros((mode_num, wavelengths.size, eps_line.size))
+        mode_H = np.zeros((mode_num, wavelengths.size, eps_line.size))
+        for i, wvl in enumerate(wavelengths):
+            _, E, H = lateral_modes(eps_line, dx, wvl, num_modes=mode_num)
+            mode_E[:, i, :] = sign*E
+            mode_H[:, i, :] = H
+
+        # amplitudes along +axis and -axis for every mode, shape (2, n_wvl, mode_num)
+        amps = np.array([mode_decomposition(E_line, H_line, mode_E[m], mode_H[m], dx, sign=sign)
+                         for m in range(mode_num)]).transpose(1, 2, 0)
+        amplitudes[port_name] = amps
+        fluxes[port_name] = net_flux(E_line, H_line, dx, sign=sign)
+
+    # injected power, in the injected mode going into the device
+    into = 0 if into_device > 0 else 1
+    power_in = np.abs(amplitudes['o1'][into, :, mode_idx])**2
+
+    results = {}
+    results['time(s)'] = dur.seconds
+
+    lam = (wavelengths*1e-6)[:, None]  # m, column vector as returned by Lumerical
+    for port_name, monitor in monitors.items():
+        out = 0 if monitor['outward'] > 0 else 1
+        # total transmission: net power leaving the device through the port
+        results[port_name+' T'] = {}
+        results[port_name+' T']['lambda'] = lam
+        results[port_name+' T']['T'] = monitor['outward']*fluxes[port_name]/power_in
+        # mode expansion
+        results[port_name+' T_net'] = {}
+        results[port_name+' T_net']['lambda'] = lam
+        results[port_name+' T_net']['T_net'] = np.abs(amplitudes[port_name][out])**2/power_in[:, None]
+
+    return results
@@ -0,0 +1,87 @@
+import numpy as np
+
+def cell_overlap(centers, step, lower, upper):
+    r""" fraction of each grid cell, centered on a uniform grid, inside an interval.
+
+    Point sampling decides a cell on a layer boundary by rounding error; the overlap does not
+    depend on where the grid starts.
+
+    Args:
+        centers (array): cell centers (um)
+        step (float): grid step (um)
+        lower (float): lower bound of the interval (um)
+        upper (float): upper bound of the interval (um)
+
+    Returns:
+        fraction (ndarray): 0 to 1, same shape as centers
+    """
+    centers = np.asarray(centers, dtype=float)
+    overlap = np.minimum(centers + 0.5*step, upper) - np.maximum(centers - 0.5*step, lower)
+    return np.clip(overlap/step, 0.0, 1.0)
+
+def slab_effective_index(n_profile, dz, wavelength, mode: int = 0):
+    r""" effective index of a 1D slab waveguide (TE, electric field parallel to the layers).
+
+    Solves d^2E/dz^2 + k0^2 n(z)^2 E = beta^2 E by finite differences, with E = 0 at both ends.
+
+    Args:
+        n_profile (array): refractive index on a uniform z grid
+        dz (float): grid step (um)
+        wavelength (float): wavelength (um)
+        mode (int, optional): mode order, 0 is the fundamental mode. Defaults to 0.
+
+    Returns:
+        n_eff (float): effective index, the cladding index if the mode is not guided
+    """
+    k0 = 2*np.pi/wavelength
+    n_profile = np.asarray(n_profile, dtype=float)
+    num = n_profile.size
+
+    operator = (np.diag(np.full(num, -2.0)) + np.diag(np.ones(num-1), 1) + np.diag(np.ones(num-1), -1))/dz**2
+    operator += np.diag((k0*n_profile)**2)
+    beta2 = np.sort(np.linalg.eigvalsh(operator))[::-1]
+
+    n_eff = np.sqrt(max(beta2[mode], 0.0))/k0
+    return max(n_eff, min(n_profile[0], n_profile[-1]))
+
+def effective_index_map(masks, layer_bounds, n_core, n_clad, wavelength,
+                        z_min: float = -1.0, z_max: float = 1.0, dz: float = 0.005):
+    r""" collapse the layer stack vertically with the effective index method.
+
+    Every combination of layers present at a pixel is solved once as a 1D slab.
+
+    Args:
+        masks (dict): layer -> boolean map of where the layer is present, all of the same shape
+        layer_bounds (dict): layer -> (zmin, zmax) in um
+        n_core (float): index of the guiding material
+        n_clad (float): index of the cladding (background) material
+        wavelength (float): wavelength (um)
+        z_min (float, optional): lower bound of the vertical slab solve (um). Defaults to -1.0.
+        z_max (float, optional): upper bound of the vertical slab solve (um). Defaults to 1.0.
+        dz (float, optional): vertical grid step (um). Defaults to 0.005.
+
+    Returns:
+        n_eff (ndarray): effective index map
+    """
+    layers = list(masks)
+    shape = next(iter(masks.values())).shape if masks else (1, 1)
+    z = np.arange(z_min, z_max + 0.5*dz, dz)
+
+    # encode the combination of present layers per pixel as a bit field
+    code = np.zeros(shape, dtype=np.int64)
+    for bit, layer in enumerate(layers):
+        code |= masks[layer].astype(np.int64) << bit
+
+    n_eff = np.full(shape, float(n_clad))
+    for combination in np.unique(code):
+        if combination == 0:
+            continue
+        # core fraction of each cell, the cells on a layer boundary get the averaged permittivity
+        fill = np.zeros(z.shape)
+        for bit, layer in enumerate(layers):
+            if combination >> bit & 1:
+                fill += cell_overlap(z, dz, *layer_bounds[layer])
+        n_profile = np.sqrt(n_clad**2 + np.clip(fill, 0.0, 1.0)*(n_core**2 - n_clad**2))
+        n_eff[code == combination] = slab_effective_index(n_profile, dz, wavelength)
+
+    return n_eff
@@ -0,0 +1,91 @@
+from datetime import datetime
+import gdsfactory as gf
+import json
+
+from helper_functions.generic.misc import write_to_json
+from helper_functions.generic.gds_handling import write_gds
+from helper_functions.generic.run_catalog import record_run
+from helper_functions.generic.parametric import parametric_component, parametric_gds
+from helper_functions.fdtd2d.initiate_fdtd import fdtd_from_gds
+
+def simulate_predefined_gds(parameters):
+    r""" initialize 2.5D FDTD of a given GDS, on the local CPU
+
+    Args:
+        parameters (dict): simulation parameters
+    """
+    # default settings
+    p = dict(
+
+        wavelength = 1.55,  # center wavelength (um)
+        wav_span = 0.05,    # wavelength span (um)
+        wav_step = 0.01,    # wavelength step (um)
+
+        resolution = 12,    # spatial resolution, number of cells per wavelength
+
+        predefined_gds = 'mmi_1x2_450_VISPIC2.gds', # default GDS file path
+
+        material_type = "universal",    # material name
+        guiding_material = 'SiN',       # core material
+
+        file_name = 'test_'+str(datetime.now().strftime('%Y%m%d%H%M%S')),   # output base name
+
+        mode_num = 5,   # number of modes to compute
+        mode_idx = 0,   # index of injected mode, counted from 0
+
+        flag_extend = 1,    # extend waveguide?
+        extension = 10,     # extension length (um)
+
+        flag_run_simulation = 0,    # run simulation?
+        flag_boolean = 0,           # apply boolean operation?
+        flag_mode_preview = 0,      # pick mode_num from a local eigenmode solve of the ports?
+
+        solver_z_min = -1,          # vertical range of the effective index solve (um)
+        solver_z_max = 1,
+
+        catalog_db = None,          # SQLite run catalog, None: runs are not indexed
+        parametric = None,          # gdsfactory function and settings (read_spec), generated instead of reading predefined_gds
+        spec_cache = None,          # directory of the simulation specs shared by the solvers, None: kept in memory only
+    )
+
+    # load user settings from config.json
+    f = open("config.json")
+    config = json.load(f)
+    p.update(config)
+
+    # update default setting with input
+    p.update(parameters)
+    start_time = datetime.now()
+
+    # define the output GDS file name
+    p['gds_file'] = p['file_name']+'.gds'
+
+    # parametric component: the generated GDS in the layout cache stands for predefined_gds
+    if p['parametric']:
+        p['predefined_gds'] = parametric_gds(p['parametric'])
+
+    # convert parameters to local variables
+    for key, value in p.items():
+        globals()[key] = value
+
+    # save parameters to a JSON file
+    write_to_json(dict_name=p, json_name=file_name+'.json')
+
+    # copy the predefined GDS to the output location
+    if parametric:
+        device = parametric_component(parametric)
+    else:
+        device = gf.import_gds(predefined_gds, read_metadata=True)
+    write_gds(device, gds_file)
+
+    results = fdtd_from_gds(parameters=p)
+
+    # keep the results next to the other outputs, the local engine has no project file
+    if results:
+        write_to_json(dict_name=results, json_name=file_name+'_results.json')
+
+        # index the finished run in the catalog
+        if catalog_db:
+            record_run(db_file=catalog_db, parameters=p, results=results, solver='fdtd2d', start_time=start_time)
+
+    return results
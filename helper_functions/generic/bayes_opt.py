@@ -0,0 +1,264 @@
+import os
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+from scipy.optimize import minimize
+from scipy.stats import norm, qmc
+
+from helper_functions.generic.misc import write_to_json
+from helper_functions.generic.results import port_transmission
+from helper_functions.generic.spectral import query
+from helper_functions.generic.run_catalog import query_runs
+from helper_functions.generic.compare_solvers import load_results
+from helper_functions.generic.parametric import read_spec, parametric_gds, parametric_component
+from helper_functions.generic.subband import run_workers
+
+def matern52(X1, X2, length_scales):
+    r""" Matern 5/2 correlation between two sets of points, one length scale per dimension.
+    """
+    d = np.sqrt(np.sum(((X1[:, None, :] - X2[None, :, :])/length_scales)**2, axis=-1))
+    return (1 + np.sqrt(5)*d + 5/3*d**2)*np.exp(-np.sqrt(5)*d)
+
+def _condition(model, X, y):
+    r""" Cholesky factor and weights of a GP on the points X, y with fixed hyperparameters.
+    """
+    K = model['signal']*matern52(X, X, model['length_scales']) + (model['noise'] + 1e-10)*np.eye(len(X))
+    factor = cho_factor(K, lower=True)
+    return dict(model, X=X, y=y, factor=factor, alpha=cho_solve(factor, y))
+
+def fit_gp(X, y, restarts: int = 4, seed: int = 0):
+    r""" Gaussian-process surrogate with a Matern 5/2 kernel, hyperparameters by maximum marginal likelihood.
+
+    Args:
+        X (ndarray): points in the unit cube, shape (n, dim)
+        y (ndarray): objective values, shape (n,)
+        restarts (int, optional): random restarts of the likelihood optimization. Defaults to 4.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        model (dict): hyperparameters and factorization, in standardized objective units
+    """
+    X = np.asarray(X, dtype=float)
+    y = np.asarray(y, dtype=float)
+    y_mean = y.mean()
+    y_std = y.std() if y.std() > 0 else 1.0
+    z = (y - y_mean)/y_std
+    dim = X.shape[1]
+
+    # log length scales, log signal variance, log noise variance
+    bounds = [(np.log(0.02), np.log(10.0))]*dim + [(np.log(0.05), np.log(20.0)), (np.log(1e-8), np.log(0.1))]
+    def nll(theta):
+        model = dict(length_scales=np.exp(theta[:dim]), signal=np.exp(theta[dim]), noise=np.exp(theta[dim+1]))
+        try:
+            model = _condition(model, X, z)
+        except np.linalg.LinAlgError:
+            return 1e10
+        return 0.5*z @ model['alpha'] + np.sum(np.log(np.diag(model['factor'][0])))
+
+    rng = np.random.default_rng(seed)
+    best = None
+    for k in range(restarts):
+        theta0 = np.array([np.log(0.3)]*dim + [0.0, np.log(1e-4)]) if k == 0 else np.array([rng.uniform(*b) for b in bounds])
+        result = minimize(nll, theta0, method='L-BFGS-B', bounds=bounds)
+        if best is None or result.fun < best.fun:
+            best = result
+    model = dict(length_scales=np.exp(best.x[:dim]), signal=np.exp(best.x[dim]), noise=np.exp(best.x[dim+1]),
+                 y_mean=y_mean, y_std=y_std)
+    return _condition(model, X, z)
+
+def predict(model, X):
+    r""" mean and standard deviation of the surrogate, in objective units.
+
+    Args:
+        model (dict): from fit_gp
+        X (ndarray): points in the unit cube, shape (m, dim)
+
+    Returns:
+        mean (ndarray): shape (m,)
+        std (ndarray): shape (m,)
+    """
+    X = np.atleast_2d(X)
+    k = model['signal']*matern52(X, model['X'], model['length_scales'])
+    mean = k @ model['alpha']
+    v = cho_solve(model['factor'], k.T)
+    var = np.maximum(model['signal'] - np.sum(k*v.T, axis=1), 1e-12)
+    return model['y_mean'] + model['y_std']*mean, model['y_std']*np.sqrt(var)
+
+def expected_improvement(mean, std, best, xi: float = 0.01):
+    r""" expected improvement below best, for a minimization.
+    """
+    improvement = best - mean - xi*abs(best)
+    u = improvement/std
+    return improvement*norm.cdf(u) + std*norm.pdf(u)
+
+def propose_batch(model, batch_size: int = 4, num_candidates: int = 2048, seed: int = 0):
+    r""" next points to run, by expected improvement, in batches for parallel solver slots.
+
+    Each point after the first is chosen as if the previous ones had returned the surrogate mean
+    (kriging believer), which spreads the batch without running anything.
+
+    Args:
+        model (dict): from fit_gp
+        batch_size (int, optional): points to propose. Defaults to 4.
+        num_candidates (int, optional): Sobol candidates scored per point. Defaults to 2048.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        X (ndarray): points in the unit cube, shape (batch_size, dim)
+    """
+    dim = model['X'].shape[1]
+    candidates = qmc.Sobol(d=dim, seed=seed).random(num_candidates)
+    best = model['y_mean'] + model['y_std']*np.min(model['y'])
+    batch = []
+    for _ in range(batch_size):
+        mean, std = predict(model, candidates)
+        ei = expected_improvement(mean, std, best)
+
+        # refine the best candidates with a local search
+        x_best, ei_best = candidates[np.argmax(ei)], np.max(ei)
+        for x0 in candidates[np.argsort(ei)[-3:]]:
+            result = minimize(lambda x: -expected_improvement(*predict(model, x[None, :]), best)[0],
+                              x0, method='L-BFGS-B', bounds=[(0.0, 1.0)]*dim)
+            if -result.fun > ei_best:
+                x_best, ei_best = result.x, -result.fun
+        batch.append(x_best)
+
+        # believe the surrogate at the chosen point
+        z = (predict(model, x_best[None, :])[0][0] - model['y_mean'])/model['y_std']
+        model = _condition(model, np.vstack([model['X'], x_best]), np.append(model['y'], z))
+    return np.array(batch)
+
+def splitting_ratio_objective(target: float = 0.5, ports = ('o3', 'o4'), wavelength: float | None = None):
+    r""" objective of a splitter: distance of the splitting ratio to the target at one wavelength.
+
+    Args:
+        target (float, optional): power fraction of the first port. Defaults to 0.5.
+        ports (tuple, optional): output ports. Defaults to ('o3', 'o4').
+        wavelength (float | None, optional): wavelength (um). Defaults to None, the center of the run.
+
+    Returns:
+        objective (function): results -> float, to minimize
+    """
+    def objective(results):
+        T = []
+        for port in ports:
+            w, T_port = port_transmission(results, port, mode_index=0)
+            T.append(query(w, T_port, 0.5*(w.min() + w.max()) if wavelength is None else wavelength))
+        return float(abs(T[0]/max(T[0] + T[1], 1e-12) - target))
+    return objective
+
+def warm_start(catalog_db, solver, spec, names, objective, parameters):
+    r""" objective values of previous runs of the same device, from the run catalog.
+
+    Only runs generated from the same component function, with the same other settings,
+    resolution and wavelength, are used.
+
+    Returns:
+        points (list): (settings dict, value) per run
+    """
+    if not catalog_db or not os.path.exists(catalog_db):
+        return []
+    runs = query_runs(catalog_db, solver=solver, device=spec['function_name'], expand_parameters=True)
+    prefix = 'parameters.parametric.settings.'
+    if runs.empty or any(prefix+name not in runs for name in names):
+        return []
+    keep = runs['parameters.parametric.function_name'] == spec['function_name']
+    for key, value in spec['settings'].items():
+        if key not in names and isinstance(value, (int, float, str)) and prefix+key in runs:
+            keep &= runs[prefix+key] == value
+    for key in ['resolution', 'wavelength']:
+        if key in parameters:
+            keep &= np.isclose(runs[key].astype(float), parameters[key])
+
+    points = []
+    for _, run in runs[keep].iterrows():
+        try:
+            value = objective(load_results(run['file_name'], solver))
+        except (FileNotFoundError, OSError, KeyError):
+            continue # results moved or incomplete
+        points.append(({name: float(run[prefix+name]) for name in names}, value))
+    return points
+
+def optimize_geometry(solver, parameters, yml_file, bounds, objective,
+                      num_runs: int = 12,
+                      batch_size: int = 4,
+                      num_initial: int | None = None,
+                      seed: int = 0,
+                      cache_dir: str = 'layout_cache'):
+    r""" Bayesian optimization of geometry settings, with as few simulations as possible.
+
+    A Gaussian-process surrogate is fitted to all finished runs, and each batch of batch_size runs,
+    one per parallel solver slot, is proposed by expected improvement. Previous runs of the same
+    device in the run catalog (parameters['catalog_db']) seed the surrogate, and new runs are added to it.
+
+    Example:
+        optimize_geometry('fdtd2d', p, 'gds_library/cells_from_gds/gdsfactory_generic_pdk/coupler.yml',
+                          bounds=dict(gap=(0.15, 0.4), length=(5.0, 20.0)),
+                          objective=splitting_ratio_objective(0.5, ports=('o3', 'o4')))
+
+    Args:
+        solver (str): 'lumerical', 'tidy3d' or 'fdtd2d'
+        parameters (dict): simulation parameters, as for simulate_predefined_gds
+        yml_file (str): YAML of the GDS library cell
+        bounds (dict): setting name -> (lower, upper)
+        objective (function): results -> float, to minimize
+        num_runs (int, optional): new simulations at most. Defaults to 12.
+        batch_size (int, optional): simulations run in parallel. Defaults to 4.
+        num_initial (int | None, optional): runs of the space-filling start, if the catalog has fewer. Defaults to None, batch_size.
+        seed (int, optional): random seed. Defaults to 0.
+        cache_dir (str, optional): directory of the generated GDS files. Defaults to 'layout_cache'.
+
+    Returns:
+        optimum (dict): 'settings' and 'value' of the best run, 'history' of all runs
+    """
+    names = list(bounds)
+    low = np.array([bounds[name][0] for name in names], dtype=float)
+    high = np.array([bounds[name][1] for name in names], dtype=float)
+    base_spec = read_spec(yml_file, cache_dir=cache_dir)
+
+    history = [dict(settings=settings, value=value, source='catalog') for settings, value in
+               warm_start(parameters.get('catalog_db'), solver, base_spec, names, objective, parameters)]
+    history = [point for point in history if all(low[i] <= point['settings'][name] <= high[i] for i, name in enumerate(names))]
+    print(f'{len(history)} previous runs of {base_spec["function_name"]} in the catalog.')
+
+    def evaluate(X, iteration):
+        run_parameters = []
+        for x in X:
+            settings = {name: float(round(value, 6)) for name, value in zip(names, low + x*(high - low))}
+            spec = read_spec(yml_file, cache_dir=cache_dir, **settings)
+            parametric_component(spec)
+            q = dict(parameters)
+            q['parametric'] = spec
+            q['predefined_gds'] = parametric_gds(spec)
+            q['file_name'] = parameters['file_name']+f'_bo{iteration}_'+'_'.join(f'{name}{value:g}' for name, value in settings.items())
+            if 'task_name' in q:
+                q['task_name'] = q['task_name']+f'_bo{iteration}_{len(run_parameters)}'
+            run_parameters.append(q)
+        run_workers('helper_functions.generic.parametric', solver, run_parameters, workers=batch_size, suffix='_bo.json')
+        for q in run_parameters:
+            value = objective(load_results(q['file_name'], solver))
+            history.append(dict(settings={name: q['parametric']['settings'][name] for name in names},
+                                value=value, source=q['file_name'], iteration=iteration))
+            print(f"Iteration {iteration}: {history[-1]['settings']} -> {value:.4g}")
+
+    iteration = 0
+    num_new = 0
+    num_initial = batch_size if num_initial is None else num_initial
+    if len(history) < num_initial:
+        # space-filling start
+        X = qmc.LatinHypercube(d=len(names), seed=seed).random(min(num_initial - len(history), num_runs))
+        evaluate(X, iteration)
+        num_new += len(X)
+
+    while num_new < num_runs:
+        iteration += 1
+        X = np.array([[(point['settings'][name] - low[i])/(high[i] - low[i]) for i, name in enumerate(names)] for point in history])
+        y = np.array([point['value'] for point in history])
+        model = fit_gp(X, y, seed=seed+iteration)
+        batch = propose_batch(model, batch_size=min(batch_size, num_runs - num_new), seed=seed+iteration)
+        evaluate(batch, iteration)
+        num_new += len(batch)
+
+    best = min(history, key=lambda point: point['value'])
+    optimum = dict(settings=best['settings'], value=best['value'], history=history)
+    write_to_json(dict_name=optimum, json_name=parameters['file_name']+'_bo.json')
+    return optimum
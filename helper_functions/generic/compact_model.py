@@ -0,0 +1,276 @@
+import json
+import itertools
+import numpy as np
+
+from helper_functions.generic.misc import write_to_json
+from helper_functions.generic.results import C_0, output_ports, port_amplitude, mode_count
+from helper_functions.generic.spectral import query
+
+def channel_names(channels):
+    r""" port names of the channels, 'o2@1' style when a port has more than its fundamental mode.
+    """
+    multimode = any(mode != 0 for _, mode in channels)
+    return [f'{port}@{mode}' if multimode else port for port, mode in channels]
+
+def s_parameters(results, input_port: str = 'o1', input_mode: int = 0, ports: list | None = None,
+                 num_modes: int = 1, wavelengths=None):
+    r""" scattering matrix of a run, one channel per port and mode.
+
+    Only the column of the injected channel is simulated; the row of it is filled by reciprocity
+    and the other entries are zero.
+
+    Args:
+        results: Lumerical-style results dict or Tidy3D SimulationData
+        input_port (str, optional): injecting port. Defaults to 'o1'.
+        input_mode (int, optional): injected mode, counted from 0. Defaults to 0.
+        ports (list | None, optional): output ports. Defaults to None, all of the run.
+        num_modes (int, optional): modes per output port, at most those of the run. Defaults to 1.
+        wavelengths (ndarray, optional): wavelengths (um). Defaults to None, those of the run.
+
+    Returns:
+        wavelengths (ndarray): wavelengths (um), ascending
+        S (ndarray): complex, shape (n_channels, n_channels, n_wvl)
+        channels (list): (port, mode) of every row, the injected channel first
+    """
+    ports = output_ports(results, input_port=input_port) if ports is None else ports
+    channels = [(input_port, input_mode)] + [(port, mode) for port in ports
+                                             for mode in range(min(num_modes, mode_count(results, port)))]
+    amplitudes = []
+    for port, mode in channels[1:]:
+        w, a = port_amplitude(results, port, mode_index=mode)
+        if wavelengths is None:
+            wavelengths = w
+        amplitudes.append(query(w, a, wavelengths))
+    wavelengths = np.asarray(wavelengths, dtype=float)
+
+    S = np.zeros((len(channels), len(channels), wavelengths.size), dtype=complex)
+    for k, a in enumerate(amplitudes, start=1):
+        S[k, 0] = a
+        S[0, k] = a
+    return wavelengths, S, channels
+
+def write_touchstone(file_name, wavelengths, S, channels, comments: list | None = None, reference: float = 50.0):
+    r""" write a scattering matrix to a Touchstone (v1) file, real and imaginary parts, frequencies in Hz.
+
+    Args:
+        file_name (str): output base name, the .sNp extension is added
+        wavelengths (ndarray): wavelengths (um)
+        S (ndarray): complex, shape (n_channels, n_channels, n_wvl)
+        channels (list): (port, mode) of every row
+        comments (list | None, optional): lines of the header. Defaults to None.
+        reference (float, optional): reference impedance of the option line. Defaults to 50.
+
+    Returns:
+        touchstone_file (str)
+    """
+    n = len(channels)
+    touchstone_file = file_name+f'.s{n}p'
+    freqs = C_0/np.asarray(wavelengths, dtype=float)
+    order = np.argsort(freqs)
+
+    lines = ['! '+line for line in (comments or [])]
+    lines += [f'! port {k+1}: {port} mode {mode}' for k, (port, mode) in enumerate(channels)]
+    lines.append(f'# HZ S RI R {reference:g}')
+    pair = lambda value: f'{value.real: .9e} {value.imag: .9e}'
+    for i in order:
+        if n == 2:
+            # two-port files are in column order: S11 S21 S12 S22
+            lines.append(f'{freqs[i]:.9e} '+' '.join(pair(S[r, c, i]) for c, r in itertools.product(range(2), range(2))))
+            continue
+        for row in range(n):
+            values = [pair(S[row, col, i]) for col in range(n)]
+            for start in range(0, n, 4):
+                prefix = f'{freqs[i]:.9e} ' if row == 0 and start == 0 else ' '*16
+                lines.append(prefix+' '.join(values[start:start+4]))
+
+    with open(touchstone_file, 'w') as f:
+        f.write('\n'.join(lines)+'\n')
+    return touchstone_file
+
+def export_run(file_name, solver, **kwargs):
+    r""" Touchstone file of a finished run, next to its results.
+
+    Example:
+        export_run('projects/FDTD_solvers/mmi2x2/Data/tidy3d/res8', 'tidy3d', num_modes=2)
+
+    Args:
+        file_name (str): output base name of the run
+        solver (str): 'lumerical', 'tidy3d' or 'fdtd2d'
+        **kwargs: of s_parameters
+
+    Returns:
+        touchstone_file (str)
+    """
+    from helper_functions.generic.compare_solvers import load_results
+    wavelengths, S, channels = s_parameters(load_results(file_name, solver), **kwargs)
+    comments = [f'{solver} run {file_name}'] + (['power only, the phases are zero'] if solver != 'tidy3d' else [])
+    return write_touchstone(file_name, wavelengths, S, channels, comments=comments)
+
+def _legendre(t, order):
+    # Legendre polynomials up to order by their recurrence, a list; faster than legvander on scalars
+    P = [t*0 + 1, t]
+    for n in range(1, order):
+        P.append(((2*n + 1)*t*P[n] - n*P[n-1])/(n + 1))
+    return P[:order+1]
+
+def _geometry_terms(g, exponents):
+    # monomials of the normalized geometry settings, shape (..., n_terms)
+    return np.prod(g[..., None, :]**exponents, axis=-1)
+
+def fit_compact_model(results_list, settings_list, names: list | None = None,
+                      input_port: str = 'o1', input_mode: int = 0, ports: list | None = None, num_modes: int = 1,
+                      wav_order: int = 4, geometry_order: int = 2, wavelengths=None):
+    r""" compact model of a device: polynomial in wavelength, with coefficients polynomial in the geometry settings.
+
+    Real amplitude and phase of every transmission are fitted by least squares to
+    sum_ij c_ij P_i(wavelength) g^e_j, P_i the Legendre polynomials over the band and g^e_j the monomials
+    of the settings up to geometry_order, both normalized to [-1, 1] over the runs.
+    The phase is taken modulo pi, the amplitude changing sign where the transmission crosses zero.
+    Its ambiguity between runs is resolved at the center wavelength from run to nearest run,
+    which assumes neighbouring runs differ by less than pi/2 there: sample long devices densely enough.
+
+    Args:
+        results_list (list): results of the runs
+        settings_list (list): geometry settings of every run, dicts
+        names (list | None, optional): settings of the model. Defaults to None, all of the first run.
+        input_port, input_mode, ports, num_modes: as for s_parameters
+        wav_order (int, optional): polynomial order in wavelength. Defaults to 4.
+        geometry_order (int, optional): total polynomial order in the settings. Defaults to 2.
+        wavelengths (ndarray, optional): wavelengths of the fit (um). Defaults to None, those of the first run.
+
+    Returns:
+        model (dict): JSON-serializable, evaluated by compact_model_function
+    """
+    names = list(settings_list[0]) if names is None else list(names)
+    exponents = [e for order in range(geometry_order+1)
+                 for e in itertools.product(range(order+1), repeat=len(names)) if sum(e) == order]
+    if len(results_list) < len(exponents):
+        raise Exception(f'{len(results_list)} runs cannot fit {len(exponents)} geometry terms, lower geometry_order.')
+
+    A = []
+    for results in results_list:
+        wavelengths, S, channels = s_parameters(results, input_port=input_port, input_mode=input_mode, ports=ports,
+                                                num_modes=num_modes, wavelengths=wavelengths)
+        ports = list(dict.fromkeys(port for port, _ in channels[1:])) if ports is None else ports
+        A.append(S[1:, 0])
+    A = np.asarray(A) # (run, channel, wavelength)
+
+    # normalized coordinates
+    G = np.array([[settings[name] for name in names] for settings in settings_list], dtype=float).reshape(len(A), len(names))
+    low, high = G.min(axis=0), G.max(axis=0)
+    g = 2*(G - low)/np.where(high > low, high - low, 1.0) - 1
+    t = 2*(wavelengths - wavelengths[0])/max(wavelengths[-1] - wavelengths[0], 1e-12) - 1
+    wav_order = min(wav_order, len(wavelengths) - 1)
+
+    # real amplitude and phase modulo pi, so that a transmission crossing zero stays smooth (sign change, no phase jump),
+    # unwrapped along the wavelength, then between the runs at the center wavelength, each run against its
+    # nearest run already aligned
+    phase = np.unwrap(2*np.angle(A), axis=-1)/2
+    mid = len(wavelengths)//2
+    aligned = [0]
+    while len(aligned) < len(A):
+        distance = np.linalg.norm(g[:, None, :] - g[None, aligned, :], axis=-1)
+        distance[aligned] = np.inf
+        r, k = np.unravel_index(np.argmin(distance), distance.shape)
+        phase[r] -= np.pi*np.round((phase[r, :, mid] - phase[aligned[k], :, mid])/np.pi)[:, None]
+        aligned.append(int(r))
+    amplitude = np.real(A*np.exp(-1j*phase))
+
+    # least squares over all runs and wavelengths, one column per channel and quantity
+    design = np.einsum('wi,rj->rwij', np.stack(_legendre(t, wav_order), axis=-1), _geometry_terms(g, np.array(exponents, dtype=float)))
+    design = design.reshape(len(A)*len(wavelengths), -1)
+    targets = np.concatenate([amplitude, phase], axis=1).transpose(0, 2, 1).reshape(len(A)*len(wavelengths), -1)
+    coefficients = np.linalg.lstsq(design, targets, rcond=None)[0]
+    coefficients = coefficients.T.reshape(2, A.shape[1], wav_order+1, len(exponents))
+
+    fitted = (design @ coefficients.reshape(2*A.shape[1], -1).T).reshape(len(A), len(wavelengths), 2, A.shape[1])
+    error = np.abs(fitted[:, :, 0]*np.exp(1j*fitted[:, :, 1]) - A.transpose(0, 2, 1))
+    names_out = channel_names(channels)
+    return dict(
+        kind = 'legendre-monomial',
+        names = names,
+        low = low.tolist(),
+        high = high.tolist(),
+        wavelength_range = [float(wavelengths[0]), float(wavelengths[-1])],
+        exponents = [list(e) for e in exponents],
+        channels = [list(channel) for channel in channels],
+        amplitude = coefficients[0].tolist(),
+        phase = coefficients[1].tolist(),
+        rms_error = {name: float(np.sqrt(np.mean(error[:, :, k]**2))) for k, name in enumerate(names_out[1:])},
+        num_runs = len(A),
+    )
+
+def compact_model_function(model):
+    r""" fast evaluation of a compact model, numpy only: no solver or layout module is imported.
+
+    Example:
+        s = compact_model_function(load_compact_model('coupler_compact_model.json'))
+        s(1.55, gap=0.2)[('o3', 'o1')]
+
+    Returns:
+        s (function): (wavelength (um), **settings) -> dict of (output, input) channel names -> complex amplitude,
+            arrays over the wavelength; valid inside the wavelength range and settings of the fit
+    """
+    names = model['names']
+    low, high = np.array(model['low']), np.array(model['high'])
+    scale = 2/np.where(high > low, high - low, 1.0)
+    w0, w1 = model['wavelength_range']
+    span = 2/max(w1 - w0, 1e-12)
+    exponents = np.array(model['exponents'], dtype=float).reshape(len(model['exponents']), len(names))
+    amplitude, phase = np.array(model['amplitude']), np.array(model['phase']) # (channel, order+1, term)
+    order = amplitude.shape[1] - 1
+    channels = channel_names(model['channels'])
+    pairs = [(out, channels[0]) for out in channels[1:]] + [(channels[0], out) for out in channels[1:]]
+    n = len(channels) - 1
+
+    last = {}
+    def s(wavelength, **settings):
+        key = tuple(settings[name] for name in names)
+        if key not in last:
+            # wavelength coefficients of this geometry, kept for the next calls at the same settings
+            psi = np.prod(((np.array(key, dtype=float) - low)*scale - 1)**exponents, axis=-1)
+            last.clear()
+            last[key] = ((amplitude @ psi).T, (phase @ psi).T) # (order+1, channel)
+        m, p = last[key]
+        t = (np.asarray(wavelength, dtype=float) - w0)*span - 1
+        basis = np.array(_legendre(float(t) if t.ndim == 0 else t, order)).T # (..., order+1), plain floats for one wavelength
+        values = (basis @ m)*np.exp(1j*(basis @ p)) # (..., channel)
+        return {pair: values[..., k % n] for k, pair in enumerate(pairs)}
+    return s
+
+def load_compact_model(json_name):
+    r""" compact model saved by export_sweep.
+    """
+    with open(json_name) as f:
+        return json.load(f)
+
+def export_sweep(runs, solver, names, file_name, **kwargs):
+    r""" Touchstone file of every run of a sweep, and the compact model fitted over the sweep.
+
+    Example:
+        runs = sweep_geometry('tidy3d', p, yml_file, sweep=dict(gap=[0.15, 0.2, 0.25, 0.3]))
+        export_sweep(runs, 'tidy3d', ['gap'], p['file_name'])
+
+    Args:
+        runs (list): dicts with the settings and 'file_name' of every run, as returned by sweep_geometry
+        solver (str): 'lumerical', 'tidy3d' or 'fdtd2d'
+        names (list): geometry settings of the model
+        file_name (str): the model is saved to file_name+'_compact_model.json'
+        **kwargs: of fit_compact_model
+
+    Returns:
+        model (dict)
+    """
+    from helper_functions.generic.compare_solvers import load_results
+    results_list = [load_results(run['file_name'], solver) for run in runs]
+    fit_keys = ['input_port', 'input_mode', 'ports', 'num_modes']
+    for run, results in zip(runs, results_list):
+        wavelengths, S, channels = s_parameters(results, **{key: kwargs[key] for key in fit_keys if key in kwargs})
+        write_touchstone(run['file_name'], wavelengths, S, channels,
+                         comments=[f'{solver} run {run["file_name"]}'] + [f'{name} = {run[name]}' for name in names])
+
+    model = fit_compact_model(results_list, [{name: run[name] for name in names} for run in runs], names=names, **kwargs)
+    model['solver'] = solver
+    write_to_json(dict_name=model, json_name=file_name+'_compact_model.json')
+    print('Compact model rms error: '+', '.join(f'{name} {error:.2e}' for name, error in model['rms_error'].items()))
+    return model
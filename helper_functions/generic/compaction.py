@@ -0,0 +1,388 @@
+from datetime import datetime
+import os
+import json
+import gzip
+import shutil
+import argparse
+import numpy as np
+
+from helper_functions.generic.misc import write_to_json
+from helper_functions.generic.results import output_ports, port_transmission, port_amplitude, mode_count
+from helper_functions.generic.run_catalog import scalar_metrics, update_files
+from helper_functions.generic.convergence import device_key
+
+# files of a compacted directory, at its root
+INDEX_FILE = 'compaction_index.json'
+STORE_FILE = 'compact_store.h5'
+GDS_STORE = 'gds_store'
+
+# bulky outputs of a run, by kind
+BULK_FILES = dict(fsp='_FDTD.fsp', fields='_results.hdf5')
+
+# retention policy: (age in days since the run finished, action) steps, the last step reached applies.
+# 'keep', 'compress' (gzip), 'strip' (Tidy3D results only: field data removed, mode and flux data kept) or 'drop'.
+# A dropped .fsp can be rebuilt from the saved parameters, the spectra stay in the compact store.
+RETENTION = dict(
+    fsp = [(0, 'compress'), (30, 'drop')],
+    fields = [(0, 'strip')],
+)
+
+# Tidy3D monitor data kept by 'strip', everything else (fields, permittivity, projections) is removed
+SPECTRAL_DATA = ('ModeData', 'FluxData', 'FluxTimeData')
+
+def find_runs(root):
+    r""" finished runs under a directory: the output base names with a results file.
+    """
+    runs = set()
+    for directory, folders, files in os.walk(root):
+        folders[:] = [folder for folder in folders if folder != GDS_STORE]
+        for name in files:
+            for suffix in ('_results.json', '_results.hdf5', '_results.hdf5.gz'):
+                if name.endswith(suffix):
+                    runs.add(os.path.join(directory, name[:-len(suffix)]))
+    return sorted(runs)
+
+def infer_solver(file_name):
+    r""" solver of a run, from its Data/<solver>/ folder or else its outputs.
+    """
+    parts = os.path.abspath(file_name).split(os.sep)
+    for solver in ('lumerical', 'tidy3d', 'fdtd2d'):
+        if solver in parts:
+            return solver
+    if os.path.exists(file_name+'_FDTD.fsp') or os.path.exists(file_name+'_FDTD.fsp.gz'):
+        return 'lumerical'
+    if os.path.exists(file_name+'_results.hdf5') or os.path.exists(file_name+'_results.hdf5.gz'):
+        return 'tidy3d'
+    return 'fdtd2d'
+
+def retention_action(steps, age):
+    r""" action of a retention policy for a run age (days).
+    """
+    action = 'keep'
+    for days, step in sorted(steps):
+        if age >= days:
+            action = step
+    return action
+
+def format_bytes(size):
+    for unit in ['B', 'kB', 'MB', 'GB']:
+        if abs(size) < 1024 or unit == 'GB':
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+        size /= 1024
+
+def gzip_file(path):
+    r""" replace a file by its gzip copy, path+'.gz'.
+    """
+    with open(path, 'rb') as source, gzip.open(path+'.gz.tmp', 'wb', compresslevel=6) as target:
+        shutil.copyfileobj(source, target, length=16*1024**2)
+    os.replace(path+'.gz.tmp', path+'.gz')
+    os.remove(path)
+    return path+'.gz'
+
+def strip_fields(path):
+    r""" remove the field data from saved Tidy3D results, keeping the mode and flux data.
+
+    The simulation is unchanged, so that the stripped results still load as SimulationData.
+    """
+    import tidy3d as td
+    sim_data = td.SimulationData.from_file(path)
+    data = tuple(data for data in sim_data.data if type(data).__name__ in SPECTRAL_DATA)
+    sim_data.updated_copy(data=data).to_file(path+'.tmp.hdf5')
+    os.replace(path+'.tmp.hdf5', path)
+
+def extract_spectra(results):
+    r""" spectra of every port of a run, the same for all solvers.
+
+    Returns:
+        spectra (dict): port -> dict of 'wavelengths' (um), 'T' (total transmission), 'T_net' (n_wvl, num_modes)
+            and, for Tidy3D, the complex 'amplitude' (n_wvl, num_modes)
+    """
+    spectra = {}
+    for port in output_ports(results, input_port=None):
+        wavelengths, T = port_transmission(results, port, mode_index=None)
+        modes = range(mode_count(results, port))
+        spectra[port] = dict(
+            wavelengths = wavelengths,
+            T = T,
+            T_net = np.stack([port_transmission(results, port, mode_index=mode)[1] for mode in modes], axis=1),
+        )
+        if not isinstance(results, dict):
+            spectra[port]['amplitude'] = np.stack([port_amplitude(results, port, mode_index=mode)[1] for mode in modes], axis=1)
+    return spectra
+
+def write_spectra(store_file, key, spectra, attributes):
+    r""" save the spectra of a run to the compact store, one group per run.
+    """
+    import h5py
+    with h5py.File(store_file, 'a') as f:
+        if key in f:
+            del f[key]
+        group = f.create_group(key)
+        for name, value in attributes.items():
+            group.attrs[name] = value
+        for port, data in spectra.items():
+            for name, value in data.items():
+                group.create_dataset(port+'/'+name, data=value, compression='gzip', shuffle=True)
+
+def find_index(file_name):
+    r""" root of the compacted directory holding a run, None when the run was never compacted.
+    """
+    directory = os.path.dirname(os.path.abspath(file_name))
+    while True:
+        if os.path.exists(os.path.join(directory, INDEX_FILE)):
+            return directory
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+def run_key(root, file_name):
+    return os.path.relpath(os.path.abspath(file_name), os.path.abspath(root)).replace(os.sep, '/')
+
+def load_index(root):
+    path = os.path.join(root, INDEX_FILE)
+    if not os.path.exists(path):
+        return dict(runs={}, gds={})
+    with open(path) as f:
+        return json.load(f)
+
+def load_compacted(file_name):
+    r""" results of a compacted run from the compact store, whatever was kept of its outputs.
+
+    Returns:
+        results (dict): Lumerical-style results dict, with the complex amplitudes as '<port> amplitude' for Tidy3D runs
+    """
+    import h5py
+    root = find_index(file_name)
+    if root is None:
+        raise Exception(f'{file_name} has no results and was not compacted.')
+    key = run_key(root, file_name)
+    with h5py.File(os.path.join(root, STORE_FILE), 'r') as f:
+        if key not in f:
+            raise Exception(f'{file_name} is not in the compact store of {root}.')
+        group = f[key]
+        results = {name: value.item() if hasattr(value, 'item') else value for name, value in group.attrs.items()}
+        for port in group:
+            wavelengths = group[port]['wavelengths'][()]*1e-6
+            results[port+' T'] = {'lambda': wavelengths, 'T': group[port]['T'][()]}
+            results[port+' T_net'] = {'lambda': wavelengths, 'T_net': group[port]['T_net'][()]}
+            if 'amplitude' in group[port]:
+                results[port+' amplitude'] = {'lambda': wavelengths, 'amplitude': group[port]['amplitude'][()]}
+    return results
+
+def deduplicate_gds(root, dry_run = False):
+    r""" replace identical GDS files by hard links to one copy per content hash, in root/gds_store.
+
+    The paths of the runs stay valid. A run written again into the folder replaces its GDS file rather
+    than writing into the shared copy (see write_gds), so the other runs keep their layout.
+
+    Returns:
+        stored (dict): content hash -> path of the stored copy, relative to root
+        reclaimed (int): bytes
+    """
+    store_dir = os.path.join(root, GDS_STORE)
+    stored, reclaimed = {}, 0
+    for directory, folders, files in os.walk(root):
+        folders[:] = [folder for folder in folders if folder != GDS_STORE]
+        for name in sorted(files):
+            if not name.endswith('.gds'):
+                continue
+            path = os.path.join(directory, name)
+            digest = device_key(path)[1]
+            target = os.path.join(store_dir, digest+'.gds')
+            if os.path.exists(target) and os.path.samefile(path, target):
+                stored[digest] = run_key(root, target)
+                continue
+            if digest in stored or os.path.exists(target):
+                reclaimed += os.path.getsize(path)
+                if not dry_run:
+                    os.link(target, path+'.tmp')
+                    os.replace(path+'.tmp', path)
+            elif not dry_run:
+                os.makedirs(store_dir, exist_ok=True)
+                os.link(path, target)
+            stored[digest] = run_key(root, target)
+    return stored, reclaimed
+
+def apply_retention(file_name, solver, policy, age, states, dry_run = False):
+    r""" compress, strip or drop the bulky outputs of a run according to the retention policy.
+
+    Args:
+        file_name (str): output base name of the run
+        solver (str): 'lumerical', 'tidy3d' or 'fdtd2d'
+        policy (dict): kind -> retention steps, see RETENTION
+        age (float): days since the run finished
+        states (dict): kind -> state of the previous compaction, updated
+        dry_run (bool, optional): only report. Defaults to False.
+
+    Returns:
+        reclaimed (dict): kind -> bytes
+    """
+    reclaimed = {}
+    for kind, suffix in BULK_FILES.items():
+        if kind == 'fields' and solver != 'tidy3d':
+            continue
+        path = file_name+suffix
+        current = path if os.path.exists(path) else path+'.gz' if os.path.exists(path+'.gz') else None
+        if current is None:
+            continue
+        action = retention_action(policy.get(kind, []), age)
+        size = os.path.getsize(current)
+        if action == 'drop':
+            if not dry_run:
+                os.remove(current)
+            states[kind] = 'dropped'
+            reclaimed[kind] = size
+        elif action == 'compress' and current == path:
+            if not dry_run:
+                current = gzip_file(path)
+            states[kind] = 'compressed'
+            reclaimed[kind] = size - os.path.getsize(current)
+        elif action == 'strip' and current == path and states.get(kind) != 'stripped':
+            if kind != 'fields':
+                raise Exception(f"Only the Tidy3D results can be stripped, not the {kind} files.")
+            if not dry_run:
+                strip_fields(path)
+            states[kind] = 'stripped'
+            reclaimed[kind] = size - os.path.getsize(path)
+        else:
+            states.setdefault(kind, 'kept')
+    return reclaimed
+
+def compact(root, policy: dict | None = None,
+            solver: str | None = None,
+            catalog_db: str | None = None,
+            dry_run = False):
+    r""" compact the completed runs of a sweep directory, and report the reclaimed space.
+
+    Each run is compacted once: its spectra and scalar metrics are extracted to the compact store and
+    the index. Identical GDS files are deduplicated, and the retention policy is applied again at every
+    call, so that old outputs are dropped as they age. Compacted runs can still be loaded with
+    load_results or load_compacted, and queried with query_compacted.
+
+    Example:
+        python -m helper_functions.generic.compaction Data/tidy3d --dry-run
+
+    Args:
+        root (str): sweep directory, e.g. Data/tidy3d
+        policy (dict | None, optional): kind -> retention steps. Defaults to None, RETENTION.
+        solver (str | None, optional): solver of all runs. Defaults to None, inferred per run.
+        catalog_db (str | None, optional): run catalog whose file pointers are refreshed. Defaults to None.
+        dry_run (bool, optional): report what would be reclaimed, without changing anything; the savings of
+            compress and strip are only known once applied. Defaults to False.
+
+    Returns:
+        report (dict): runs compacted, and bytes reclaimed per kind
+    """
+    from helper_functions.generic.compare_solvers import load_results
+    policy = RETENTION if policy is None else policy
+    index = load_index(root)
+    store_file = os.path.join(root, STORE_FILE)
+    store_size = os.path.getsize(store_file) if os.path.exists(store_file) else 0
+    now = datetime.now()
+    report = dict(runs=0, new=0, reclaimed={})
+
+    index['gds'], report['reclaimed']['gds'] = deduplicate_gds(root, dry_run=dry_run)
+
+    keys = set(run_key(root, file_name) for file_name in find_runs(root)) | set(index['runs'])
+    for key in sorted(keys):
+        file_name = os.path.join(root, key)
+        entry = index['runs'].get(key)
+        if entry is None:
+            run_solver = solver or infer_solver(file_name)
+            results = load_results(file_name, run_solver)
+            parameters = {}
+            for name in (file_name+'_fdtd.json', file_name+'.json'):
+                if os.path.exists(name):
+                    with open(name) as f:
+                        parameters = json.load(f)
+                    break
+            result_file = [name for name in (file_name+'_results.json', file_name+'_results.hdf5', file_name+'_results.hdf5.gz')
+                           if os.path.exists(name)][0]
+            gds_file = file_name+'.gds' if os.path.exists(file_name+'.gds') else parameters.get('predefined_gds')
+            device, gds_hash = device_key(gds_file) if gds_file and os.path.exists(gds_file) else (None, None)
+            entry = dict(solver = run_solver, device = device, gds_hash = gds_hash,
+                         finished = datetime.fromtimestamp(os.path.getmtime(result_file)).isoformat(),
+                         compacted = now.isoformat(),
+                         metrics = scalar_metrics(results),
+                         parameters = parameters,
+                         files = {})
+            if not dry_run:
+                attributes = {name: value for name, value in results.items() if isinstance(value, (int, float))} \
+                    if isinstance(results, dict) else {}
+                write_spectra(store_file, key, extract_spectra(results), dict(attributes, solver=run_solver))
+            report['new'] += 1
+        age = (now - datetime.fromisoformat(entry['finished'])).total_seconds()/86400
+        reclaimed = apply_retention(file_name, entry['solver'], policy, age, entry['files'], dry_run=dry_run)
+        for kind, size in reclaimed.items():
+            report['reclaimed'][kind] = report['reclaimed'].get(kind, 0) + size
+        index['runs'][key] = entry
+        report['runs'] += 1
+        if catalog_db is not None and reclaimed and not dry_run:
+            update_files(catalog_db, file_name)
+
+    added = (os.path.getsize(store_file) if os.path.exists(store_file) else 0) - store_size
+    report['reclaimed']['compact store'] = -added
+    report['total'] = sum(report['reclaimed'].values())
+    if not dry_run:
+        write_to_json(dict_name=index, json_name=os.path.join(root, INDEX_FILE))
+
+    print(f"{'Dry run: ' if dry_run else ''}{report['runs']} runs, {report['new']} newly compacted, "
+          f"{len(index['gds'])} distinct GDS files")
+    for kind, size in report['reclaimed'].items():
+        print(f'  {kind:14s} {format_bytes(size):>10s}')
+    print(f"  {'reclaimed':14s} {format_bytes(report['total']):>10s}")
+    return report
+
+def query_compacted(root, expand_parameters = False, **filters):
+    r""" query the index of a compacted directory, one row per run with one column per metric.
+
+    Example:
+        query_compacted('Data/tidy3d', device='mmi2x2_with_sbend', solver='tidy3d')
+
+    Args:
+        root (str): compacted directory
+        expand_parameters (bool, optional): add one 'parameters.<key>' column per parameter. Defaults to False.
+        **filters: equality filters on the index columns (solver, device, gds_hash, ...)
+
+    Returns:
+        runs (pandas.DataFrame): runs, their metrics and the state of their bulky outputs
+    """
+    import pandas as pd
+    rows = []
+    for key, entry in load_index(root)['runs'].items():
+        row = dict(file_name=os.path.join(os.path.abspath(root), key), solver=entry['solver'], device=entry['device'],
+                   gds_hash=entry['gds_hash'], finished=entry['finished'], compacted=entry['compacted'])
+        row.update({kind+' file': state for kind, state in entry['files'].items()})
+        row.update(entry['metrics'])
+        if expand_parameters:
+            row.update({'parameters.'+name: value for name, value in pd.json_normalize(entry['parameters']).iloc[0].items()})
+        rows.append(row)
+    runs = pd.DataFrame(rows)
+    for key, value in filters.items():
+        if key not in runs.columns:
+            raise Exception(f"Unknown index column '{key}'.")
+        runs = runs[runs[key] == value]
+    return runs.reset_index(drop=True)
+
+def parse_steps(text):
+    r""" retention steps from the command line, e.g. 'compress:0,drop:30'.
+    """
+    steps = []
+    for step in text.split(','):
+        action, _, days = step.partition(':')
+        steps.append((float(days or 0), action))
+    return steps
+
+if __name__ == '__main__':
+    # python -m helper_functions.generic.compaction Data/tidy3d [--fsp compress:0,drop:30] [--fields strip:0] [--dry-run]
+    parser = argparse.ArgumentParser(description='Compact the completed runs of a sweep directory.')
+    parser.add_argument('root')
+    parser.add_argument('--fsp', type=parse_steps, default=RETENTION['fsp'])
+    parser.add_argument('--fields', type=parse_steps, default=RETENTION['fields'])
+    parser.add_argument('--solver', default=None)
+    parser.add_argument('--catalog', default=None)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    compact(args.root, policy=dict(fsp=args.fsp, fields=args.fields), solver=args.solver,
+            catalog_db=args.catalog, dry_run=args.dry_run)
@@ -0,0 +1,205 @@
+import os
+import json
+import numpy as np
+
+from helper_functions.generic.results import output_ports, port_transmission, mode_count
+from helper_functions.generic.mode_solver import convert_mode_index
+from helper_functions.generic.run_catalog import query_runs
+from helper_functions.generic.spectral import query
+
+# run parameters that define a matched pair, the injected mode is compared counted from 0
+MATCH_KEYS = ('gds_hash', 'resolution', 'wavelength', 'wav_span', 'mode_idx')
+
+def load_results(file_name, solver):
+    r""" load the results of a finished run from its output files.
+
+    Args:
+        file_name (str): output base name of the run
+        solver (str): 'lumerical', 'tidy3d' or 'fdtd2d'
+
+    Returns:
+        results: Tidy3D SimulationData, or Lumerical-style results dict (Lumerical, fdtd2d, and compacted runs
+            whose results were dropped, see compaction)
+    """
+    if solver == 'tidy3d' and os.path.exists(file_name+'_results.hdf5'):
+        import tidy3d as td
+        return td.SimulationData.from_file(file_name+'_results.hdf5')
+    if solver == 'tidy3d' and os.path.exists(file_name+'_results.hdf5.gz'):
+        import tidy3d as td
+        return td.SimulationData.from_hdf5_gz(file_name+'_results.hdf5.gz')
+    if solver != 'tidy3d' and os.path.exists(file_name+'_results.json'):
+        with open(file_name+'_results.json') as f:
+            return json.load(f)
+    from helper_functions.generic.compaction import load_compacted
+    return load_compacted(file_name)
+
+def run_cost(file_name, solver):
+    r""" Flex Credits billed for a run, None for the solvers running on a local license or CPU.
+    """
+    if solver != 'tidy3d' or not os.path.exists(file_name+'_cost.json'):
+        return None
+    with open(file_name+'_cost.json') as f:
+        cost = json.load(f)
+    return cost['real_cost'] if cost.get('real_cost') is not None else cost.get('estimated_cost')
+
+def common_grid(wavelength_sets, wav_step: float | None = None):
+    r""" wavelength grid covered by all runs.
+
+    Args:
+        wavelength_sets (list): wavelengths of each run (um)
+        wav_step (float | None, optional): grid step (um). Defaults to None, the coarsest step of the runs.
+
+    Returns:
+        grid (ndarray): wavelengths (um)
+    """
+    start = max(np.min(w) for w in wavelength_sets)
+    stop = min(np.max(w) for w in wavelength_sets)
+    if stop < start:
+        raise Exception('The runs do not overlap in wavelength.')
+    if wav_step is None:
+        steps = [np.median(np.diff(np.sort(w))) for w in wavelength_sets if len(w) > 1]
+        wav_step = max(steps) if steps else stop - start
+    num = int(round((stop - start)/wav_step)) + 1 if wav_step > 0 else 1
+    return np.linspace(start, stop, max(num, 1))
+
+def stack_spectra(results, ports, num_modes):
+    r""" transmission of every (port, mode) of a run, as the columns of one array.
+
+    The output modes are the columns of the mode expansion, counted from 0 for all solvers.
+
+    Returns:
+        wavelengths (ndarray): wavelengths (um)
+        T (ndarray): shape (n_wvl, n_ports*num_modes)
+    """
+    columns = []
+    for port in ports:
+        for mode in range(num_modes[port]):
+            wavelengths, T = port_transmission(results, port, mode_index=mode)
+            columns.append(T)
+    return wavelengths, np.stack(columns, axis=1)
+
+def compare_results(reference, candidate, wav_step: float | None = None, num_modes: int | None = None):
+    r""" difference between the results of two runs of the same device, on a common wavelength grid.
+
+    Args:
+        reference: results of the reference run (Lumerical-style dict or Tidy3D SimulationData)
+        candidate: results of the compared run
+        wav_step (float | None, optional): step of the common grid (um). Defaults to None, the coarsest step.
+        num_modes (int | None, optional): output modes compared per port. Defaults to None, all modes of both runs.
+
+    Returns:
+        comparison (dict): 'grid' (um), 'keys' (port, mode), 'reference' and 'candidate' spectra (n_grid, n_keys),
+            and 'metrics': 'max |dT|', 'rms dT', 'max |dIL| (dB)', 'max |d ratio|' and 'max |dT| oN mM' per key
+    """
+    ports = sorted(set(output_ports(reference)) & set(output_ports(candidate)), key=lambda name: int(name[1:]))
+    if not ports:
+        raise Exception('The runs have no output port in common.')
+    modes = {port: min(mode_count(reference, port), mode_count(candidate, port)) for port in ports}
+    if num_modes is not None:
+        modes = {port: min(num, num_modes) for port, num in modes.items()}
+    keys = [(port, mode) for port in ports for mode in range(modes[port])]
+
+    w_ref, T_ref = stack_spectra(reference, ports, modes)
+    w_cand, T_cand = stack_spectra(candidate, ports, modes)
+    grid = common_grid([w_ref, w_cand], wav_step=wav_step)
+    T_ref = query(w_ref, T_ref, grid, axis=0)
+    T_cand = query(w_cand, T_cand, grid, axis=0)
+    dT = T_cand - T_ref
+
+    metrics = {
+        'max |dT|': float(np.max(np.abs(dT))),
+        'rms dT': float(np.sqrt(np.mean(dT**2))),
+    }
+
+    # insertion loss and splitting ratios from the fundamental output mode, as default_metrics
+    fundamental = [keys.index((port, 0)) for port in ports]
+    total_ref = np.maximum(T_ref[:, fundamental].sum(axis=1), 1e-12)
+    total_cand = np.maximum(T_cand[:, fundamental].sum(axis=1), 1e-12)
+    metrics['max |dIL| (dB)'] = float(np.max(np.abs(10*np.log10(total_ref/total_cand))))
+    ratio_ref = T_ref[:, fundamental]/total_ref[:, None]
+    ratio_cand = T_cand[:, fundamental]/total_cand[:, None]
+    metrics['max |d ratio|'] = float(np.max(np.abs(ratio_cand - ratio_ref)))
+
+    for k, (port, mode) in enumerate(keys):
+        metrics[f'max |dT| {port} m{mode}'] = float(np.max(np.abs(dT[:, k])))
+
+    return dict(grid=grid, keys=keys, reference=T_ref, candidate=T_cand, metrics=metrics)
+
+def match_runs(db_file, reference: str = 'lumerical', candidate: str = 'tidy3d', keys = MATCH_KEYS, **filters):
+    r""" pairs of catalogued runs of the same device and settings on two solvers, the latest run of each.
+
+    Args:
+        db_file (str): path to the SQLite run catalog
+        reference (str, optional): reference solver. Defaults to 'lumerical'.
+        candidate (str, optional): compared solver. Defaults to 'tidy3d'.
+        keys (tuple, optional): settings that must match. 'mode_idx' is compared counted from 0.
+        **filters: catalog filters, e.g. device='mmi2x2_with_sbend'
+
+    Returns:
+        pairs (pandas.DataFrame): one row per pair, run columns suffixed '_ref' and '_cand', empty when
+            either solver has no catalogued run
+    """
+    import pandas as pd
+    columns = ['id', 'device', 'file_name', 'solver', 'duration']
+    runs = []
+    for solver in [reference, candidate]:
+        df = query_runs(db_file, solver=solver, expand_parameters=True, **filters)
+        if df.empty or 'parameters.mode_idx' not in df:
+            return pd.DataFrame(columns=list(keys) + [column+suffix for suffix in ['_ref', '_cand'] for column in columns])
+        df['mode_idx'] = [convert_mode_index(int(mode), solver, 'tidy3d') for mode in df['parameters.mode_idx']]
+        for key in ['wavelength', 'wav_span']:
+            df[key] = df[key].round(6)
+        df = df.sort_values('id').drop_duplicates(subset=list(keys), keep='last')
+        runs.append(df[list(keys) + columns])
+    return runs[0].merge(runs[1], on=list(keys), suffixes=('_ref', '_cand'))
+
+def compare_sweep(db_file, reference: str = 'lumerical', candidate: str = 'tidy3d', keys = MATCH_KEYS,
+                  wav_step: float | None = None, num_modes: int | None = None, csv_file: str | None = None, **filters):
+    r""" compare every matched pair of a sweep: accuracy of the candidate solver against wall time and cost.
+
+    Example:
+        compare_sweep('run_catalog.db', device='mmi2x2_with_sbend', csv_file='mmi2x2_comparison.csv')
+
+    Args:
+        db_file (str): path to the SQLite run catalog
+        reference (str, optional): reference solver. Defaults to 'lumerical'.
+        candidate (str, optional): compared solver. Defaults to 'tidy3d'.
+        keys (tuple, optional): settings that must match. Defaults to MATCH_KEYS.
+        wav_step (float | None, optional): step of the common grid (um). Defaults to None.
+        num_modes (int | None, optional): output modes compared per port. Defaults to None, all.
+        csv_file (str | None, optional): save the report. Defaults to None.
+        **filters: catalog filters
+
+    Returns:
+        report (pandas.DataFrame): one row per pair, settings, difference metrics, durations (s), costs and speedup
+    """
+    import pandas as pd
+    pairs = match_runs(db_file, reference=reference, candidate=candidate, keys=keys, **filters)
+    if pairs.empty:
+        print(f'No matched runs of {reference} and {candidate}.')
+
+    rows = []
+    for _, pair in pairs.iterrows():
+        comparison = compare_results(load_results(pair['file_name_ref'], reference),
+                                     load_results(pair['file_name_cand'], candidate),
+                                     wav_step=wav_step, num_modes=num_modes)
+        row = {key: pair[key] for key in keys}
+        row.update(
+            device = pair['device_ref'],
+            file_name_ref = pair['file_name_ref'],
+            file_name_cand = pair['file_name_cand'],
+        )
+        row.update(comparison['metrics'])
+        row.update(
+            duration_ref = pair['duration_ref'],
+            duration_cand = pair['duration_cand'],
+            cost_ref = run_cost(pair['file_name_ref'], reference),
+            cost_cand = run_cost(pair['file_name_cand'], candidate),
+            speedup = pair['duration_ref']/pair['duration_cand'],
+        )
+        rows.append(row)
+
+    report = pd.DataFrame(rows)
+    if csv_file:
+        report.to_csv(csv_file, index=False)
+    return report
@@ -0,0 +1,217 @@
+import os
+import json
+import hashlib
+import numpy as np
+from scipy.optimize import brentq
+
+from helper_functions.generic.misc import write_to_json
+from helper_functions.generic.results import output_ports, port_transmission
+
+# settings besides the layout that the converged resolution depends on
+SETTING_KEYS = ('wavelength', 'wav_span', 'material_type', 'guiding_material')
+
+def default_metrics(results, mode_index: int = 0):
+    r""" key figures of a device: total insertion loss, and the splitting ratio of every output port.
+
+    Args:
+        results: Lumerical-style results dict or Tidy3D SimulationData
+        mode_index (int, optional): output mode, counted from 0. Defaults to 0.
+
+    Returns:
+        metrics (dict): name -> spectrum, 'IL' in dB, 'ratio oN' as a fraction of the transmitted power
+    """
+    spectra = {name: port_transmission(results, name, mode_index=mode_index)[1] for name in output_ports(results)}
+    total = np.sum(list(spectra.values()), axis=0)
+
+    metrics = {'IL': -10*np.log10(np.maximum(total, 1e-12))}
+    if len(spectra) > 1:
+        for name, T in spectra.items():
+            metrics['ratio '+name] = T/np.maximum(total, 1e-12)
+    return metrics
+
+def convergence_order(values, steps, order: float = 2.0):
+    r""" observed order of convergence from the last three runs, f(h) = f0 + C h^p.
+
+    Falls back to the nominal order when the runs are not in the asymptotic range
+    (non-monotonic differences, or an order outside 0.5 to 6).
+
+    Args:
+        values (list): metric value of the last three runs (scalars)
+        steps (list): relative grid steps of the runs, 1/resolution
+        order (float, optional): nominal order. Defaults to 2.0.
+
+    Returns:
+        p (float): order of convergence
+    """
+    f1, f2, f3 = values
+    h1, h2, h3 = steps
+    if (f1 - f2)*(f2 - f3) <= 0 or f2 == f3:
+        return order
+    ratio = (f1 - f2)/(f2 - f3)
+    residual = lambda p: (h1**p - h2**p)/(h2**p - h3**p) - ratio
+    try:
+        return brentq(residual, 0.5, 6.0)
+    except ValueError:
+        return order
+
+def richardson(values, steps, order: float = 2.0):
+    r""" Richardson extrapolation of a metric to an infinitely fine grid.
+
+    Args:
+        values (list): metric spectra of the runs, coarse to fine, each of shape (n_wvl,)
+        steps (list): grid steps of the runs, 1/resolution
+        order (float, optional): nominal order of convergence. Defaults to 2.0.
+
+    Returns:
+        extrapolated (ndarray): metric at zero grid step
+        error (ndarray): estimated error of the finest run
+    """
+    values = [np.asarray(value, dtype=float) for value in values]
+    h2, h3 = steps[-2], steps[-1]
+    f2, f3 = values[-2], values[-1]
+
+    # observed order on the band average, for three or more runs
+    if len(values) >= 3:
+        p = convergence_order([np.mean(value) for value in values[-3:]], steps[-3:], order=order)
+    else:
+        p = order
+
+    extrapolated = f3 + (f3 - f2)/((h2/h3)**p - 1)
+    return extrapolated, np.abs(f3 - extrapolated)
+
+def device_key(gds_file):
+    r""" cache key of a device: the GDS name, and a hash of its content so that a layout change invalidates the cache.
+    """
+    with open(gds_file, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return os.path.splitext(os.path.basename(gds_file))[0], digest
+
+def setting_key(parameters):
+    r""" settings besides the layout that change the converged resolution: the band and the materials.
+    """
+    return {key: parameters.get(key) for key in SETTING_KEYS}
+
+def cached_resolution(cache_file, gds_file, solver, settings: dict | None = None):
+    r""" converged resolution of a device and solver from the cache.
+
+    Args:
+        cache_file (str): path to the JSON cache
+        gds_file (str): path to the device GDS
+        solver (str): 'lumerical', 'tidy3d' or 'fdtd2d'
+        settings (dict | None, optional): from setting_key, the entry must match them. Defaults to None, not checked.
+
+    Returns:
+        entry (dict | None): 'resolution', 'tolerance' and 'errors', None if not cached or the layout or settings changed
+    """
+    if not os.path.exists(cache_file):
+        return None
+    with open(cache_file) as f:
+        cache = json.load(f)
+    name, digest = device_key(gds_file)
+    entry = cache.get(name, {}).get(solver)
+    if entry is None or entry.get('gds_hash') != digest:
+        return None
+    if settings is not None and entry.get('settings') != json.loads(json.dumps(settings)):
+        return None
+    return entry
+
+def converge_resolution(simulate, parameters, solver,
+                        resolutions = (6, 8, 10, 12, 14, 16, 20, 24),
+                        tolerance: float | dict = 0.05,
+                        metrics = default_metrics,
+                        order: float = 2.0,
+                        cache_file: str = 'convergence_cache.json',
+                        flag_recompute = 0):
+    r""" run increasing resolutions until the key figures converge.
+
+    After each run, the figures are extrapolated to an infinitely fine grid (Richardson),
+    and the driver stops as soon as the estimated error of every figure is below the tolerance,
+    over the whole band. The converged resolution is cached per device and solver, for the band and materials of the run.
+
+    Args:
+        simulate (function): simulate_predefined_gds of the solver
+        parameters (dict): simulation parameters, 'file_name' and 'task_name' may contain '{res}'
+        solver (str): 'lumerical', 'tidy3d' or 'fdtd2d', used as cache key
+        resolutions (tuple, optional): resolution ladder, only run as far as needed.
+        tolerance (float | dict, optional): error tolerance, for all figures or per figure name. Defaults to 0.05 (dB for 'IL').
+        metrics (function, optional): results -> dict of spectra. Defaults to default_metrics.
+        order (float, optional): nominal order of convergence. Defaults to 2.0.
+        cache_file (str, optional): JSON cache of converged resolutions. Defaults to 'convergence_cache.json'.
+        flag_recompute (int, optional): ignore the cache. Defaults to 0.
+
+    Returns:
+        convergence (dict): 'resolution' (None if not converged), 'converged', 'errors', 'extrapolated', 'history'
+    """
+    gds_file = parameters['predefined_gds']
+    settings = setting_key(parameters)
+    entry = cached_resolution(cache_file, gds_file, solver, settings=settings)
+    if entry is not None and entry['tolerance'] == tolerance and not flag_recompute:
+        print(f"Converged resolution from cache: {entry['resolution']}")
+        return dict(entry, converged=True)
+
+    history = []
+    values = {}
+    errors = {}
+    extrapolated = {}
+    converged = False
+    for res in resolutions:
+        p = dict(parameters)
+        p['resolution'] = res
+        p['flag_run_simulation'] = 1
+        for key in ['file_name', 'task_name']:
+            if key in p:
+                p[key] = p[key].format(res=res)
+
+        results = simulate(parameters=p)
+        if results is None:
+            raise Exception(f'No results returned at resolution {res}.')
+
+        run = metrics(results)
+        history.append(dict(resolution=res, metrics=run))
+        for name, value in run.items():
+            values.setdefault(name, []).append(value)
+
+        if len(history) < 2:
+            continue
+
+        steps = [1.0/record['resolution'] for record in history]
+        converged = True
+        for name in values:
+            extrapolated[name], error = richardson(values[name], steps, order=order)
+            errors[name] = float(np.max(error))
+            tol = tolerance[name] if isinstance(tolerance, dict) else tolerance
+            converged = converged and errors[name] < tol
+            print(f'resolution {res}, {name}: estimated error {errors[name]:.4f} (tolerance {tol})')
+
+        if converged:
+            print(f'Converged at resolution {res}.')
+            break
+
+    if not converged:
+        print('\033[1;91mAttention: not converged within the resolution ladder.\033[0m')
+
+    convergence = dict(
+        resolution = history[-1]['resolution'] if converged else None,
+        converged = converged,
+        tolerance = tolerance,
+        errors = errors,
+        extrapolated = extrapolated,
+        history = history,
+    )
+
+    if converged:
+        cache = {}
+        if os.path.exists(cache_file):
+            with open(cache_file) as f:
+                cache = json.load(f)
+        name, digest = device_key(gds_file)
+        cache.setdefault(name, {})[solver] = dict(
+            resolution = convergence['resolution'],
+            tolerance = tolerance,
+            errors = errors,
+            gds_hash = digest,
+            settings = settings,
+        )
+        write_to_json(dict_name=cache, json_name=cache_file)
+
+    return convergence
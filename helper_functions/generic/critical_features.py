@@ -0,0 +1,86 @@
+import gdsfactory as gf
+
+from helper_functions.generic.gds_clipping import read_layout
+
+def default_min_feat_size():
+    r""" minimum feature size declared in the layer stack configuration ('min_feat_size' in stack_universal.json).
+    """
+    from gds_library.pdk_universal import min_feat_size
+    return min_feat_size
+
+def find_critical_features(gds_file, mesh_step,
+                           min_feat_size: float | None = None,
+                           mesh_min_cells: int = 4,
+                           margin: float | None = None,
+                           cell_name: str | None = None):
+    r""" find the narrow gaps, tips and narrow regions of a layout that the global mesh cannot resolve.
+
+    A feature is critical when it is narrower than min_feat_size, or than mesh_min_cells global mesh cells.
+    Gaps and notches are found with a space check, tips and narrow waveguides with a width check,
+    on each layer of the layer stack. Overlapping refinement boxes are merged.
+
+    Args:
+        gds_file (str): path to the GDS file
+        mesh_step (float): global mesh step (um)
+        min_feat_size (float | None, optional): minimum feature size (um). Defaults to None, from the layer stack configuration.
+        mesh_min_cells (int, optional): cells required across a feature. Defaults to 4.
+        margin (float | None, optional): margin around a feature (um). Defaults to None, the detection threshold.
+        cell_name (str | None, optional): cell to check. Defaults to None, the top cell.
+
+    Returns:
+        features (list): dicts with 'layer', 'bounds' (x_min, y_min, z_min, x_max, y_max, z_max) in um,
+            'size' the smallest feature in the box (um), and 'dl' the local mesh step (um)
+    """
+    import pya
+    if min_feat_size is None:
+        min_feat_size = default_min_feat_size()
+    threshold = max(min_feat_size, mesh_min_cells*mesh_step)
+    if margin is None:
+        margin = threshold
+
+    pdk = gf.get_active_pdk()
+    layers = pdk.get_layer_views().layer_map
+    layer_stack = pdk.get_layer_stack()
+
+    layout = read_layout(gds_file)
+    top_cell = layout.cell(cell_name) if cell_name else layout.top_cell()
+    dbu = layout.dbu
+    distance = int(round(threshold/dbu))
+    enlarge = int(round(margin/dbu))
+
+    features = []
+    for layer_name, level in layer_stack.layers.items():
+        layer_index = layout.find_layer(*layers[layer_name])
+        if layer_index is None:
+            continue
+        region = pya.Region(top_cell.begin_shapes_rec(layer_index))
+        region.merge()
+
+        # refinement box of every violation, with the step that resolves the feature
+        # projection metrics and an 80 degree angle limit skip the corners of polygon ends
+        space = region.space_check(distance, False, pya.Region.Projection, 80)
+        width = region.width_check(distance, False, pya.Region.Projection, 80)
+        boxes = []
+        for edge_pair in list(space.each()) + list(width.each()):
+            size = max(edge_pair.distance()*dbu, min_feat_size)
+            boxes.append((edge_pair.bbox().enlarged(enlarge, enlarge), size))
+        if not boxes:
+            continue
+
+        merged = pya.Region()
+        for box, _ in boxes:
+            merged.insert(box)
+        merged.merge()
+
+        for polygon in merged.each():
+            bbox = polygon.bbox()
+            size = min(s for box, s in boxes if bbox.contains(box.center()))
+            dbox = bbox.to_dtype(dbu)
+            features.append(dict(
+                layer = layer_name,
+                bounds = (dbox.left, dbox.bottom, level.zmin - margin, dbox.right, dbox.top, level.zmin + level.thickness + margin),
+                size = size,
+                dl = size/mesh_min_cells,
+            ))
+
+    return features
@@ -0,0 +1,201 @@
+import os
+import yaml
+
+def read_layout(gds_file, layers: list | None = None):
+    r""" read a GDS file into a KLayout layout, keeping the hierarchy.
+    Only the listed layers are loaded, other layers are skipped while reading.
+
+    Args:
+        gds_file (str): path to the GDS file
+        layers (list | None, optional): GDS (layer, datatype) tuples to load. Defaults to None, all layers.
+
+    Returns:
+        layout (pya.Layout): hierarchical layout
+    """
+    import pya
+    options = pya.LoadLayoutOptions()
+    if layers:
+        layer_map = pya.LayerMap()
+        for idx, layer in enumerate(layers):
+            layer_map.map(pya.LayerInfo(layer[0], layer[1]), idx)
+        options.set_layer_map(layer_map, False) # False: do not create unlisted layers
+
+    layout = pya.Layout()
+    layout.read(gds_file, options)
+    return layout
+
+def window_from_ports(ports, margin: float = 2.0):
+    r""" bounding window of a set of ports, enlarged by a margin.
+
+    Args:
+        ports (dict): port name -> gdsfactory Port or port dict with 'center' and 'width'
+        margin (float, optional): margin added on each side (um). Defaults to 2.0.
+
+    Returns:
+        window (tuple): (x_min, y_min, x_max, y_max) in um
+    """
+    x_min = y_min = float('inf')
+    x_max = y_max = -float('inf')
+    for port in ports.values():
+        record = port_record(port)
+        x, y = record['center']
+        w = record['width']
+        x_min = min(x_min, x - w)
+        x_max = max(x_max, x + w)
+        y_min = min(y_min, y - w)
+        y_max = max(y_max, y + w)
+    return (x_min - margin, y_min - margin, x_max + margin, y_max + margin)
+
+def port_record(port):
+    r""" convert a gdsfactory Port, or a port dict read from a .yml file, into a plain dict.
+    """
+    if isinstance(port, dict):
+        get = port.get
+    else:
+        get = lambda key, default=None: getattr(port, key, default)
+    return dict(
+        center = [float(v) for v in get('center')],
+        width = float(get('width')),
+        orientation = float(get('orientation')),
+        layer = [int(v) for v in get('layer')],
+        port_type = get('port_type', 'optical') or 'optical',
+    )
+
+def find_device_instances(layout, device_cell, top_cell: str | None = None):
+    r""" find all placements of a device cell below a top cell.
+
+    Args:
+        layout (pya.Layout): layout to search
+        device_cell (str): name of the device cell
+        top_cell (str | None, optional): cell to search from. Defaults to None, the layout top cell.
+
+    Returns:
+        transforms (list): pya.DCplxTrans from device to top cell coordinates, one per placement
+    """
+    import pya
+    top = layout.cell(top_cell) if top_cell else layout.top_cell()
+    device = layout.cell(device_cell)
+    if device is None:
+        raise Exception(f"Cell '{device_cell}' does not exist in the layout.")
+
+    if device.cell_index() == top.cell_index():
+        return [pya.DCplxTrans()]
+
+    # the instance iterator walks the hierarchy without flattening any geometry
+    transforms = []
+    it = top.begin_instances_rec()
+    it.targets = [device.cell_index()]
+    while not it.at_end():
+        if it.inst_cell().cell_index() == device.cell_index():
+            transforms.append(it.dtrans() * it.inst_dtrans())
+        it.next()
+    return transforms
+
+def clip_layout(layout, cell, window, trans=None):
+    r""" extract the geometry of a cell inside a window.
+
+    The window query uses the per-cell box trees of KLayout, so only instances and
+    shapes touching the window are visited.
+
+    Args:
+        layout (pya.Layout): source layout
+        cell (pya.Cell): cell to clip from
+        window (tuple): (x_min, y_min, x_max, y_max) in um, in the frame given by trans
+        trans (pya.DCplxTrans | None, optional): transformation from the window frame to the cell frame. Defaults to None.
+
+    Returns:
+        regions (dict): (layer, datatype) -> pya.Region, clipped and expressed in the window frame
+    """
+    import pya
+    dbu = layout.dbu
+    trans = trans or pya.DCplxTrans()
+    window_box = pya.DBox(*window)
+    search_box = window_box.transformed(trans)
+    to_window = trans.inverted().to_itrans(dbu)
+
+    regions = {}
+    for layer_index in layout.layer_indexes():
+        info = layout.get_info(layer_index)
+        region = pya.Region(cell.begin_shapes_rec_touching(layer_index, search_box))
+        if region.is_empty():
+            continue
+        region.transform(to_window)
+        region &= pya.Region(window_box.to_itype(dbu))
+        regions[(info.layer, info.datatype)] = region
+    return regions
+
+def write_regions(regions, output_file, cell_name, dbu: float = 0.001, ports: dict | None = None):
+    r""" write clipped regions to a GDS file, with ports in a .yml file next to it.
+    The .yml file is read by gf.import_gds(..., read_metadata=True).
+    """
+    import pya
+    layout = pya.Layout()
+    layout.dbu = dbu
+    cell = layout.create_cell(cell_name)
+    for (layer, datatype), region in regions.items():
+        cell.shapes(layout.layer(layer, datatype)).insert(region)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    # a new file, never written through a hard link of a compacted folder (see write_gds)
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    layout.write(output_file)
+
+    if ports:
+        metadata = dict(
+            name = cell_name,
+            ports = {name: dict(name=name, **port_record(port)) for name, port in ports.items()},
+        )
+        with open(os.path.splitext(output_file)[0]+'.yml', 'w') as f:
+            yaml.safe_dump(metadata, f)
+
+    return output_file
+
+def clip_device_from_reticle(gds_file, device_cell, output_file,
+                             ports: dict | None = None,
+                             margin: float = 2.0,
+                             instance: int = 0,
+                             layers: list | None = None,
+                             top_cell: str | None = None):
+    r""" cut the region around one placed device out of a large layout.
+
+    The layout is read hierarchically with only the requested layers, the device placement is found
+    by walking cell instances, and only geometry inside the window (device bounding box and ports,
+    plus margin) is extracted. The result is written in the device frame, so ports from the device
+    .yml file stay valid and the output can be passed to fdtd_from_gds directly.
+
+    Args:
+        gds_file (str): path to the reticle GDS
+        device_cell (str): name of the device cell to simulate
+        output_file (str): path of the clipped GDS
+        ports (dict | None, optional): device ports in the device frame. Defaults to None.
+        margin (float, optional): simulation margin around the device (um). Defaults to 2.0.
+        instance (int, optional): which placement of the device to use. Defaults to 0.
+        layers (list | None, optional): GDS (layer, datatype) tuples to keep. Defaults to None, all layers.
+        top_cell (str | None, optional): cell to search from. Defaults to None, the layout top cell.
+
+    Returns:
+        output_file (str): path of the clipped GDS
+    """
+    layout = read_layout(gds_file, layers=layers)
+    top = layout.cell(top_cell) if top_cell else layout.top_cell()
+
+    transforms = find_device_instances(layout, device_cell, top_cell=top.name)
+    if not transforms:
+        raise Exception(f"Cell '{device_cell}' is not placed below '{top.name}'.")
+    if not 0 <= instance < len(transforms):
+        raise Exception(f"Instance {instance} of cell '{device_cell}' does not exist, "
+                        f"it is placed {len(transforms)} times below '{top.name}' (instance 0 to {len(transforms)-1}).")
+    trans = transforms[instance]
+
+    # window in the device frame: device bounding box and ports, plus margin
+    bbox = layout.cell(device_cell).dbbox()
+    window = (bbox.left - margin, bbox.bottom - margin, bbox.right + margin, bbox.top + margin)
+    if ports:
+        port_window = window_from_ports(ports, margin=margin)
+        window = (min(window[0], port_window[0]), min(window[1], port_window[1]),
+                  max(window[2], port_window[2]), max(window[3], port_window[3]))
+
+    regions = clip_layout(layout, top, window, trans=trans)
+
+    return write_regions(regions, output_file, cell_name=device_cell, dbu=layout.dbu, ports=ports)
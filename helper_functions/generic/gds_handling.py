@@ -1,5 +1,16 @@
+import os
 import gdsfactory as gf 
 
+def write_gds(device, gds_file):
+    r""" write a component to a GDS file, with its metadata, as a new file.
+
+    A GDS deduplicated by compaction is a hard link shared with other runs; removing it first
+    keeps their layout when a run is written again into a compacted folder.
+    """
+    if os.path.exists(gds_file):
+        os.remove(gds_file)
+    device.write_gds(gds_file, with_metadata=True)
+
 def get_layer_name_by_tuple(layer_tuple):
     r"""Get layer name in the active PDK from a layer (GDS) tuple.
 
@@ -29,12 +40,14 @@ def get_layer_name_by_tuple(layer_tuple):
                 return name
     return "Unknown Layer"
 
-def extend_from_ports(device, offset: float=10.0):
+def extend_from_ports(device, offset: float=10.0, flatten: bool=True):
     r""" add straight sections to all ports of a device in order to extend through boundaries in simulations.
 
     Args:
         device (Component): A gdsfactory component with ports
         offset (float, optional): Length of the straight section to extend ports. Default is 10.0 um
+        flatten (bool, optional): Flatten the device into the new component. If False, the device is kept
+            as a reference so its hierarchy (e.g. arrays) is preserved. Default is True
 
     Returns:
         c (Component): A new component with extended ports
@@ -75,6 +88,7 @@ def extend_from_ports(device, offset: float=10.0):
     
     # save original ports before they are overwritten
     original_ports = device.ports
-    c.absorb(device)
+    if flatten:
+        c.absorb(device)
     
     return c, original_ports
\ No newline at end of file
@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+import numpy as np
+
+from helper_functions.generic.misc import write_to_json
+
+# modules a sweep worker or project script imports first
+ENTRY_POINTS = [
+    'gds_library.pdk_universal',
+    'helper_functions.lumerical.simulate_device',
+    'helper_functions.tidy3d.simulate_device',
+    'helper_functions.fdtd2d.simulate_device',
+    'helper_functions.generic.parametric',
+    'helper_functions.generic.subband',
+    'helper_functions.generic.work_queue',
+]
+
+# heavy packages whose import cost is reported separately
+HEAVY_PACKAGES = ['tidy3d', 'gdsfactory', 'pya', 'klayout', 'gdstk', 'matplotlib', 'scipy', 'pandas', 'h5py', 'lumapi']
+
+def parse_importtime(stderr):
+    r""" cumulative import time (s) of the heavy packages, nested imports included, from the output of python -X importtime.
+    """
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        fields = [field.strip() for field in line[len('import time:'):].split('|')]
+        if fields[1].isdigit() and fields[2] in HEAVY_PACKAGES:
+            cumulative[fields[2]] = int(fields[1])*1e-6
+    return cumulative
+
+def measure(module, repeats: int = 3, cwd: str | None = None):
+    r""" import cost of a module in fresh interpreters.
+
+    Args:
+        module (str): dotted module name
+        repeats (int, optional): interpreters started, the median is reported. Defaults to 3.
+        cwd (str | None, optional): working directory, also put on the path. Defaults to None, the current one.
+
+    Returns:
+        result (dict): 'total' wall time of the import (s), 'packages' cumulative time per heavy package (s)
+            and 'loaded' heavy packages in sys.modules after the import
+    """
+    cwd = os.getcwd() if cwd is None else cwd
+    code = ('import sys, time, json; sys.path.insert(0, %r); t = time.perf_counter(); import %s; '
+            'print(json.dumps([time.perf_counter() - t, sorted(m for m in %r if m in sys.modules)]))') % (cwd, module, HEAVY_PACKAGES)
+    totals, packages, loaded = [], [], []
+    for _ in range(repeats):
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=cwd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            return dict(total=None, packages={}, loaded=[], error=proc.stderr.strip().splitlines()[-1])
+        total, loaded = json.loads(proc.stdout.strip().splitlines()[-1])
+        totals.append(total)
+        packages.append(parse_importtime(proc.stderr))
+    return dict(total = float(np.median(totals)),
+                packages = {name: float(np.median([p.get(name, 0.0) for p in packages])) for name in HEAVY_PACKAGES
+                            if any(name in p for p in packages)},
+                loaded = loaded)
+
+def benchmark(modules = None, repeats: int = 3, json_name: str | None = None):
+    r""" startup cost of every entry point, to check that a worker only pays for the solver it uses.
+
+    Example:
+        python -m helper_functions.generic.import_benchmark --json import_times.json
+
+    Args:
+        modules (list | None, optional): dotted module names. Defaults to None, ENTRY_POINTS.
+        repeats (int, optional): interpreters started per module. Defaults to 3.
+        json_name (str | None, optional): save the results. Defaults to None.
+
+    Returns:
+        results (dict): module -> result of measure
+    """
+    results = {}
+    for module in (ENTRY_POINTS if modules is None else modules):
+        results[module] = measure(module, repeats=repeats)
+        result = results[module]
+        if result['total'] is None:
+            print(f"{module:48s}  failed: {result['error']}")
+            continue
+        heavy = ', '.join(f'{name} {t:.2f}' for name, t in sorted(result['packages'].items(), key=lambda item: -item[1]))
+        print(f"{module:48s} {result['total']:6.2f} s   {heavy}")
+    if json_name is not None:
+        write_to_json(dict_name=results, json_name=json_name)
+    return results
+
+if __name__ == '__main__':
+    # python -m helper_functions.generic.import_benchmark [modules ...] [--repeats 3] [--json file]
+    parser = argparse.ArgumentParser(description='Import time of the entry points, in fresh interpreters.')
+    parser.add_argument('modules', nargs='*', default=None)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--json', default=None)
+    args = parser.parse_args()
+    benchmark(args.modules or None, repeats=args.repeats, json_name=args.json)
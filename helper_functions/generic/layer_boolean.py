@@ -0,0 +1,134 @@
+import math
+import os
+import gdstk
+
+# supported operations of a boolean rule
+OPERATIONS = {
+    '-': lambda a, b: a - b,    # NOT
+    '&': lambda a, b: a & b,    # AND
+    '|': lambda a, b: a | b,    # OR
+    '^': lambda a, b: a ^ b,    # XOR
+}
+
+def default_boolean_rules():
+    r""" boolean rules declared in the layer stack configuration ('boolean_rules' in stack_universal.json).
+    """
+    from gds_library.pdk_universal import BOOLEAN_RULES
+    return BOOLEAN_RULES
+
+def apply_boolean_rules(gds_file, rules, layers, cell_name: str | None = None):
+    r""" apply layer boolean rules to a GDS layout in memory.
+
+    Each rule is a dict with layer names from the PDK, e.g.
+    {"result": "SiN1", "a": "SiN1", "operation": "-", "b": "SiN1p"}.
+    Rules are applied in order, a rule sees the results of the previous ones.
+    Regions are built in deep (hierarchical) mode, so the work scales with the
+    number of unique cells rather than with the flattened shape count.
+    The input file is not modified.
+
+    Args:
+        gds_file (str): path to the GDS file
+        rules (list): boolean rules
+        layers (dict): layer name -> GDS (layer, datatype) tuple, e.g. from the PDK layer map
+        cell_name (str | None, optional): cell to operate on. Defaults to None, the top cell.
+
+    Returns:
+        layout (pya.Layout): layout with the result layers replaced
+        top_cell (pya.Cell): the cell the rules were applied to
+    """
+    import pya
+    layout = pya.Layout()
+    layout.read(gds_file)
+    top_cell = layout.cell(cell_name) if cell_name else layout.top_cell()
+
+    dss = pya.DeepShapeStore()
+
+    def region(name):
+        layer_index = layout.find_layer(*layers[name])
+        if layer_index is None:
+            return pya.Region()
+        # bulk insertion through the recursive shape iterator, hierarchy kept in the deep shape store
+        return pya.Region(top_cell.begin_shapes_rec(layer_index), dss)
+
+    for rule in rules:
+        if rule['operation'] not in OPERATIONS:
+            raise Exception(f"Unsupported boolean operation '{rule['operation']}'.")
+        result = OPERATIONS[rule['operation']](region(rule['a']), region(rule['b']))
+
+        result_index = layout.layer(*layers[rule['result']])
+        layout.clear_layer(result_index)
+        result.insert_into(layout, top_cell.cell_index(), result_index)
+
+    return layout, top_cell
+
+def layout_to_gdstk(layout, top_cell):
+    r""" convert a KLayout cell and its hierarchy into gdstk cells, without writing a file.
+
+    Args:
+        layout (pya.Layout): source layout
+        top_cell (pya.Cell): cell to convert
+
+    Returns:
+        cell (gdstk.Cell): converted top cell, referencing converted child cells
+    """
+    cells = {}
+    top_index = top_cell.cell_index()
+    needed = set(top_cell.called_cells()) | {top_index}
+
+    for cell_index in layout.each_cell_bottom_up():
+        if cell_index not in needed:
+            continue
+        cell = layout.cell(cell_index)
+        gds_cell = gdstk.Cell(cell.name)
+
+        for layer_index in layout.layer_indexes():
+            info = layout.get_info(layer_index)
+            for shape in cell.shapes(layer_index).each():
+                if shape.is_polygon() or shape.is_box() or shape.is_path() or shape.is_simple_polygon():
+                    polygon = shape.polygon.resolved_holes().to_dtype(layout.dbu)
+                    gds_cell.add(gdstk.Polygon(
+                        [(p.x, p.y) for p in polygon.each_point_hull()],
+                        layer=info.layer,
+                        datatype=info.datatype,
+                    ))
+
+        for inst in cell.each_inst():
+            trans = inst.dcplx_trans
+            reference = gdstk.Reference(
+                cells[inst.cell_index],
+                origin=(trans.disp.x, trans.disp.y),
+                rotation=math.radians(trans.angle),
+                magnification=trans.mag,
+                x_reflection=trans.is_mirror(),
+            )
+            if inst.is_regular_array():
+                reference.repetition = gdstk.Repetition(
+                    columns=inst.na, rows=inst.nb,
+                    v1=(inst.da.x, inst.da.y), v2=(inst.db.x, inst.db.y),
+                )
+            gds_cell.add(reference)
+
+        cells[cell_index] = gds_cell
+
+    return cells[top_index]
+
+def boolean_gds_cell(gds_file, rules, layers, cell_name: str | None = None):
+    r""" apply boolean rules and return the result as an in-memory gdstk cell.
+    """
+    layout, top_cell = apply_boolean_rules(gds_file, rules, layers, cell_name=cell_name)
+    return layout_to_gdstk(layout, top_cell)
+
+def boolean_gds_file(gds_file, rules, layers, cell_name: str | None = None):
+    r""" apply boolean rules and write the result next to the input as '<name>_boolean.gds'.
+    For importers that can only read from a file. The input file is left untouched.
+
+    Returns:
+        output_file (str): path to the written GDS
+    """
+    layout, top_cell = apply_boolean_rules(gds_file, rules, layers, cell_name=cell_name)
+    output_file = os.path.splitext(gds_file)[0]+'_boolean.gds'
+    # a new file, never written through a hard link of a compacted folder (see write_gds)
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    layout.write(output_file)
+    return output_file
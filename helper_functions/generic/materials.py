@@ -1,5 +1,10 @@
+import re
 import json
-import matplotlib.pyplot as plt
+import hashlib
+import numpy as np
+
+# samples resampled over a band, by material_key, for the process
+SAMPLED = {}
 
 def read_nk(filename, material,
             wvl_key: str = 'lambda_mat',
@@ -32,7 +37,7 @@ def read_nk(filename, material,
     result['k'] = data[k_key]
     
     if plot_on:
-        
+        import matplotlib.pyplot as plt
         fig, axs = plt.subplots(nrows=2, ncols=1, figsize=(6, 4))
         axs[0].plot(result['wvls'], result['n'], label='refractive index', color='b')
         axs[0].legend()
@@ -46,6 +51,88 @@ def read_nk(filename, material,
         
     return result
 
+def interpolate_nk(filename, wavelengths,
+                   wvl_key: str = 'wavelength(m)',
+                   n_key: str = 'Re(index)', k_key: str = 'Im(index)'):
+    r""" interpolate n, k of a materials library file at given wavelengths.
+
+    Args:
+        filename (str): json file name, without '.json'.
+        wavelengths (float or array): wavelengths in um.
+        wvl_key (str, optional): key of the wavelengths (m) in the file. Defaults to 'wavelength(m)'.
+        n_key (str, optional): key of the refractive index. Defaults to 'Re(index)'.
+        k_key (str, optional): key of the extinction coefficient. Defaults to 'Im(index)'.
+
+    Returns:
+        n (ndarray): refractive index at the wavelengths
+        k (ndarray): extinction coefficient at the wavelengths
+    """
+    data = read_nk(filename=filename, material='', wvl_key=wvl_key, n_prefix=n_key, k_prefix=k_key)
+    
+    wvls = np.array(data['wvls'])*1e6
+    order = np.argsort(wvls)
+    n = np.interp(wavelengths, wvls[order], np.array(data['n'])[order])
+    k = np.interp(wavelengths, wvls[order], np.array(data['k'])[order])
+    return n, k
+
+def band_range(wav_start, wav_stop, margin: float | None = None):
+    r""" wavelength range (um) of the materials of a run: its band plus a margin on both sides.
+
+    Args:
+        wav_start (float): shortest wavelength of the band (um)
+        wav_stop (float): longest wavelength of the band (um)
+        margin (float | None, optional): margin (um). Defaults to None, the band span, which covers the
+            spectrum of the source pulse.
+
+    Returns:
+        wav_range (tuple): (shortest, longest) wavelength (um)
+    """
+    margin = wav_stop - wav_start if margin is None else margin
+    return (round(wav_start - margin, 6), round(wav_stop + margin, 6))
+
+def material_key(filename, wav_range, **settings):
+    r""" cache key of a material over a band: its name, the band, and a hash of the data and of the settings,
+    so that a change of either invalidates the cache.
+    """
+    with open(filename+'.json', 'rb') as f:
+        digest = hashlib.sha256(f.read() + json.dumps(settings, sort_keys=True).encode()).hexdigest()
+    name = re.split(r'[\\/]', filename)[-1] # library paths are written with either separator
+    return f'{name}_{wav_range[0]:.4f}-{wav_range[1]:.4f}_{digest[:12]}'
+
+def resample_nk(filename, wav_range, num_points: int = 21,
+                wvl_key: str = 'wavelength(m)',
+                n_key: str = 'Re(index)', k_key: str = 'Im(index)'):
+    r""" n, k of a materials library file resampled over a band, uniformly in frequency.
+
+    The library samples are sparse and slightly noisy; the monotone cubic (PCHIP) interpolation does not
+    overshoot between them, so that the band can be fitted with few poles.
+
+    Args:
+        filename (str): json file name, without '.json'.
+        wav_range (tuple): (shortest, longest) wavelength (um), see band_range
+        num_points (int, optional): samples over the band. Defaults to 21.
+        wvl_key (str, optional): key of the wavelengths (m) in the file. Defaults to 'wavelength(m)'.
+        n_key (str, optional): key of the refractive index. Defaults to 'Re(index)'.
+        k_key (str, optional): key of the extinction coefficient. Defaults to 'Im(index)'.
+
+    Returns:
+        wavelengths (ndarray): wavelengths (um), ascending
+        n (ndarray): refractive index
+        k (ndarray): extinction coefficient
+    """
+    from scipy.interpolate import PchipInterpolator
+    key = material_key(filename, wav_range, num_points=num_points)
+    if key not in SAMPLED:
+        data = read_nk(filename=filename, material='', wvl_key=wvl_key, n_prefix=n_key, k_prefix=k_key)
+        wvls, index = np.unique(np.array(data['wvls'])*1e6, return_index=True)
+        if wav_range[0] < wvls[0] or wav_range[1] > wvls[-1]:
+            raise Exception(f'{filename} covers {wvls[0]:.3f} to {wvls[-1]:.3f} um, not {wav_range[0]:.3f} to {wav_range[1]:.3f} um.')
+        wavelengths = 1/np.linspace(1/wav_range[1], 1/wav_range[0], num_points)[::-1]
+        n = PchipInterpolator(wvls, np.array(data['n'])[index])(wavelengths)
+        k = np.maximum(PchipInterpolator(wvls, np.array(data['k'])[index])(wavelengths), 0.0)
+        SAMPLED[key] = (wavelengths, n, k)
+    return SAMPLED[key]
+
 def convert_txt_to_json(txt_file, json_file):
 
     r"""
@@ -45,15 +45,25 @@ def write_to_json(dict_name, json_name):
 def find_closest(lst, target):
     r"""
     Find the value and index of the item in a list closest to a given target.
+    Several targets are looked up at once with a binary search on the sorted values.
 
     Args:
-        lst (list): List of numeric values.
-        target (float or int): Target value.
+        lst (list or ndarray): List of numeric values.
+        target (float, int or ndarray): Target value(s).
 
     Returns:
-        tuple: (closest_value, index_of_closest_value)
+        tuple: (closest_value, index_of_closest_value), arrays of the shape of target for several targets
     """
-    lst = list(lst)
-    closest_value = min(lst, key=lambda x: abs(x - target))
-    closest_index = lst.index(closest_value)
-    return closest_value, closest_index
\ No newline at end of file
+    values = np.asarray(lst)
+    targets = np.asarray(target, dtype=float)
+    order = np.argsort(values, kind='stable')
+    sorted_values = values[order].astype(float)
+    if values.size == 1:
+        index = np.zeros(targets.shape, dtype=int)
+    else:
+        i = np.clip(np.searchsorted(sorted_values, targets), 1, values.size - 1)
+        i = np.where(targets - sorted_values[i-1] <= sorted_values[i] - targets, i - 1, i)
+        index = order[i]
+    if targets.ndim == 0:
+        return values[int(index)].item(), int(index)
+    return values[index], index
\ No newline at end of file
@@ -0,0 +1,354 @@
+import os
+import re
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import eigs, splu, LinearOperator
+
+from helper_functions.generic.misc import write_to_json
+from helper_functions.generic.materials import interpolate_nk
+from helper_functions.fdtd2d.gds_handling import import_gds_to_grid
+from helper_functions.fdtd2d.materials import cell_overlap, slab_effective_index
+
+# first mode index of each solver: Lumerical counts modes from 1, Tidy3D (and fdtd2d) from 0
+MODE_INDEX_BASE = dict(lumerical=1, tidy3d=0, fdtd2d=0)
+
+# samples across each lateral cell for the coverage of the layers
+LATERAL_SUBSAMPLES = 4
+
+def convert_mode_index(mode_idx, from_solver, to_solver):
+    r""" convert a mode index between the counting conventions of the solvers.
+
+    Args:
+        mode_idx (int): mode index in the convention of from_solver
+        from_solver (str): 'lumerical', 'tidy3d' or 'fdtd2d'
+        to_solver (str): 'lumerical', 'tidy3d' or 'fdtd2d'
+
+    Returns:
+        mode_idx (int): mode index in the convention of to_solver
+    """
+    return mode_idx - MODE_INDEX_BASE[from_solver] + MODE_INDEX_BASE[to_solver]
+
+def port_cross_section(gds_file, port, z_min: float = -1.0, z_max: float = 1.0,
+                       margin: float = 1.0, dl: float = 0.025, z_pad: float = 1.0, flag_boolean = 0):
+    r""" sample the layers of a GDS across a port, on a plane normal to the port.
+
+    The plane is cropped vertically to the layers present at the port and z_pad of cladding on each side,
+    where the guided modes have decayed; the solve then costs the same whatever the simulation domain.
+
+    Args:
+        gds_file (str): path to the GDS file
+        port: gdsfactory port with center, width and orientation
+        z_min (float, optional): lower bound of the plane (um). Defaults to -1.0.
+        z_max (float, optional): upper bound of the plane (um). Defaults to 1.0.
+        margin (float, optional): lateral margin on each side of the port (um). Defaults to 1.0.
+        dl (float, optional): grid step (um). Defaults to 0.025.
+        z_pad (float, optional): cladding kept below and above the layers (um). Defaults to 1.0.
+        flag_boolean (int, optional): apply the layer boolean rules first. Defaults to 0.
+
+    Returns:
+        u (ndarray): lateral coordinates, relative to the port center (um)
+        z (ndarray): vertical coordinates (um)
+        masks (dict): layer name -> fraction of each lateral cell covered by the layer, along u
+        layer_bounds (dict): layer name -> (zmin, zmax) in um
+    """
+    half = 0.5*port.width + margin
+    u = np.arange(-half, half + 0.5*dl, dl)
+    offsets = ((np.arange(LATERAL_SUBSAMPLES) + 0.5)/LATERAL_SUBSAMPLES - 0.5)*dl
+    samples = (u[:, None] + offsets[None, :]).ravel()
+
+    # sample slightly inside the device, the port itself lies on a polygon edge
+    angle = np.deg2rad(port.orientation)
+    inward = -0.01*np.array([np.cos(angle), np.sin(angle)])
+    x0 = port.center[0] + inward[0]
+    y0 = port.center[1] + inward[1]
+
+    if port.orientation in [0.0, 180.0]:
+        masks, layer_bounds = import_gds_to_grid(gds_file, np.array([x0]), y0 + samples, flag_boolean=flag_boolean)
+        masks = {name: mask[0, :] for name, mask in masks.items()}
+    else:
+        masks, layer_bounds = import_gds_to_grid(gds_file, x0 + samples, np.array([y0]), flag_boolean=flag_boolean)
+        masks = {name: mask[:, 0] for name, mask in masks.items()}
+    masks = {name: mask.reshape(u.size, LATERAL_SUBSAMPLES).mean(axis=1) for name, mask in masks.items()}
+
+    present = [name for name, mask in masks.items() if mask.any()]
+    if present:
+        z_min = max(z_min, min(layer_bounds[name][0] for name in present) - z_pad)
+        z_max = min(z_max, max(layer_bounds[name][1] for name in present) + z_pad)
+    z = np.arange(z_min, z_max + 0.5*dl, dl)
+
+    return u, z, masks, layer_bounds
+
+def cross_section_permittivity(u, z, masks, layer_bounds, n_core, n_clad):
+    r""" permittivity map eps(u, z) of a cross-section, core material inside the layers, cladding elsewhere.
+
+    The cells on the layer edges get the permittivity averaged over the core fraction of the cell.
+    """
+    dz = z[1] - z[0] if z.size > 1 else 1.0
+    fill = np.zeros((u.size, z.size))
+    for name, coverage in masks.items():
+        fill += np.outer(coverage, cell_overlap(z, dz, *layer_bounds[name]))
+    return n_clad**2 + np.clip(fill, 0.0, 1.0)*(n_core**2 - n_clad**2)
+
+def _difference(num, dl):
+    r""" forward difference matrix with zero field beyond the last point.
+    """
+    return sp.diags([-np.ones(num), np.ones(num-1)], [0, 1], format='csr')/dl
+
+def solve_modes(eps, dl, wavelength, num_modes: int = 4, n_guess: float | None = None, v0=None):
+    r""" full-vector finite-difference eigenmodes of a 2D cross-section.
+
+    Transverse electric field formulation on a Yee grid (Zhu and Brown, 2002):
+    beta^2 E_t = Q_eh Q_he E_t, with zero fields on the boundary of the plane.
+
+    Args:
+        eps (ndarray): permittivity on the cell centers, shape (Nu, Nz)
+        dl (float): grid step (um), same in both directions
+        wavelength (float): wavelength (um)
+        num_modes (int, optional): number of modes. Defaults to 4.
+        n_guess (float | None, optional): index just above the expected modes. Defaults to None, just above the
+            fundamental mode of the slab through the core, an upper bound of the modes of the plane.
+        v0 (ndarray | None, optional): starting vector of the iterations, e.g. the modes of a nearby wavelength. Defaults to None.
+
+    Returns:
+        n_eff (ndarray): effective indices, descending, shape (num_modes,)
+        te_fraction (ndarray): fraction of the transverse electric field energy along the lateral axis
+        E (ndarray): lateral and vertical electric field, shape (num_modes, 2, Nu, Nz)
+    """
+    k0 = 2*np.pi/wavelength
+    nu, nz = eps.shape
+    num = nu*nz
+
+    # derivative operators: forward differences from E to H, backward from H to E
+    Uu = sp.kron(_difference(nu, dl), sp.identity(nz), format='csr')
+    Uz = sp.kron(sp.identity(nu), _difference(nz, dl), format='csr')
+    Vu = -Uu.T.tocsr()
+    Vz = -Uz.T.tocsr()
+
+    # permittivity at the field positions
+    eps_u = 0.5*(eps + np.vstack((eps[1:, :], eps[-1:, :])))
+    eps_z = 0.5*(eps + np.hstack((eps[:, 1:], eps[:, -1:])))
+    eps_u = sp.diags(eps_u.ravel())
+    eps_z = sp.diags(eps_z.ravel())
+    inv_eps_w = sp.diags(1.0/eps.ravel())
+    k2 = k0**2*sp.identity(num)
+
+    Q_he = sp.bmat([
+        [Vu @ Uz, -(k0**2*eps_z + Vu @ Uu)],
+        [k0**2*eps_u + Vz @ Uz, -(Vz @ Uu)],
+    ])/k0
+    Q_eh = sp.bmat([
+        [-(Uu @ inv_eps_w @ Vz), k2 + Uu @ inv_eps_w @ Vu],
+        [-(k2 + Uz @ inv_eps_w @ Vz), Uz @ inv_eps_w @ Vu],
+    ])/k0
+    operator = (Q_eh @ Q_he).tocsc()
+
+    # shift-invert above the fundamental mode, the factorization is reused at every iteration
+    if n_guess is None:
+        column = int(np.argmax(eps.sum(axis=1)))
+        n_guess = slab_effective_index(np.sqrt(eps[column]), dl, wavelength) + 0.05
+    sigma = (k0*n_guess)**2
+    lu = splu((operator - sigma*sp.identity(2*num, format='csc')).tocsc(), permc_spec='MMD_AT_PLUS_A')
+    inverse = LinearOperator(operator.shape, matvec=lu.solve, dtype=float)
+    beta2, vectors = eigs(operator, k=num_modes, sigma=sigma, OPinv=inverse, which='LM', tol=1e-8, v0=v0)
+
+    order = np.argsort(-beta2.real)
+    n_eff = np.sqrt(beta2.real[order].clip(min=0))/k0
+    E = vectors[:, order].T.reshape(num_modes, 2, nu, nz)
+
+    power = np.sum(np.abs(E)**2, axis=(2, 3))
+    te_fraction = power[:, 0]/power.sum(axis=1)
+    return n_eff, te_fraction, E
+
+def solve_port_modes(gds_file, port, wavelengths,
+                     num_modes: int = 4,
+                     material_type: str = 'universal',
+                     guiding_material: str = 'Si',
+                     cladding_material: str = 'SiO2',
+                     z_min: float = -1.0,
+                     z_max: float = 1.0,
+                     margin: float = 1.0,
+                     dl: float = 0.025,
+                     z_pad: float = 1.0,
+                     flag_boolean = 0):
+    r""" eigenmodes of a port cross-section across a band, from the layer stack and the materials library.
+
+    Args:
+        gds_file (str): path to the GDS file
+        port: gdsfactory port
+        wavelengths (array): wavelengths (um), at least 2 for the group index
+        num_modes (int, optional): number of modes. Defaults to 4.
+        material_type (str, optional): material model. Defaults to 'universal'.
+        guiding_material (str, optional): core material. Defaults to 'Si'.
+        cladding_material (str, optional): cladding material. Defaults to 'SiO2'.
+        z_min (float, optional): lower bound of the plane (um). Defaults to -1.0.
+        z_max (float, optional): upper bound of the plane (um). Defaults to 1.0.
+        margin (float, optional): lateral margin on each side of the port (um). Defaults to 1.0.
+        dl (float, optional): grid step (um). Defaults to 0.025.
+        z_pad (float, optional): cladding kept below and above the layers (um). Defaults to 1.0.
+        flag_boolean (int, optional): apply the layer boolean rules first. Defaults to 0.
+
+    Returns:
+        modes (dict): 'wavelengths', 'n_eff', 'n_group' and 'te_fraction' of shape (n_wvl, num_modes),
+            'n_clad' of shape (n_wvl,), and the fields 'E' at the center wavelength with their 'u', 'z' coordinates
+    """
+    wavelengths = np.atleast_1d(np.asarray(wavelengths, dtype=float))
+    u, z, masks, layer_bounds = port_cross_section(gds_file, port, z_min=z_min, z_max=z_max,
+                                                   margin=margin, dl=dl, z_pad=z_pad, flag_boolean=flag_boolean)
+
+    n_core = interpolate_nk(os.path.join('materials_library', material_type+'_'+guiding_material), wavelengths)[0]
+    n_clad = interpolate_nk(os.path.join('materials_library', material_type+'_'+cladding_material), wavelengths)[0]
+
+    n_eff = np.zeros((wavelengths.size, num_modes))
+    te_fraction = np.zeros((wavelengths.size, num_modes))
+    center = int(np.argmin(np.abs(wavelengths - wavelengths.mean())))
+    n_guess = None
+    v0 = None
+    for i, wvl in enumerate(wavelengths):
+        eps = cross_section_permittivity(u, z, masks, layer_bounds, n_core[i], n_clad[i])
+        n_eff[i], te_fraction[i], E = solve_modes(eps, dl, wvl, num_modes=num_modes, n_guess=n_guess, v0=v0)
+        # the next wavelength starts just above this fundamental mode, from these modes, which converges faster
+        n_guess = n_eff[i, 0] + 0.05
+        peaks = E.reshape(num_modes, -1)[np.arange(num_modes), np.argmax(np.abs(E.reshape(num_modes, -1)), axis=1)]
+        v0 = np.sum(E.reshape(num_modes, -1)*(np.abs(peaks)/peaks)[:, None], axis=0).real
+        if i == center:
+            fields = E
+
+    # group index n_g = n_eff - lambda dn_eff/dlambda, modes matched by order
+    if wavelengths.size > 1:
+        n_group = n_eff - wavelengths[:, None]*np.gradient(n_eff, wavelengths, axis=0)
+    else:
+        n_group = np.full_like(n_eff, np.nan)
+
+    return dict(
+        wavelengths = wavelengths,
+        n_eff = n_eff,
+        n_group = n_group,
+        te_fraction = te_fraction,
+        n_clad = n_clad,
+        E = fields,
+        u = u,
+        z = z,
+    )
+
+def minimal_mode_num(modes, mode_idx: int = 0):
+    r""" smallest number of modes for the port objects: every guided mode in the band, and the injected mode.
+
+    Args:
+        modes (dict): result of solve_port_modes
+        mode_idx (int, optional): injected mode, counted from 0. Defaults to 0.
+
+    Returns:
+        mode_num (int): number of modes to request from the solver
+    """
+    guided = np.sum(modes['n_eff'] > modes['n_clad'][:, None], axis=1).max()
+    return int(max(guided, mode_idx + 1, 1))
+
+def select_mode(modes, polarization: str = 'TE', order: int = 0):
+    r""" index (counted from 0) of the order-th mode of a given polarization at the center wavelength.
+
+    Args:
+        modes (dict): result of solve_port_modes
+        polarization (str, optional): 'TE' (lateral electric field) or 'TM'. Defaults to 'TE'.
+        order (int, optional): 0 for the fundamental mode of that polarization. Defaults to 0.
+
+    Returns:
+        mode_idx (int): mode index, convert with convert_mode_index for Lumerical
+    """
+    center = int(np.argmin(np.abs(modes['wavelengths'] - modes['wavelengths'].mean())))
+    te = modes['te_fraction'][center] > 0.5
+    candidates = np.flatnonzero(te if polarization == 'TE' else ~te)
+    if order >= candidates.size:
+        raise Exception(f'Only {candidates.size} {polarization} modes found, increase num_modes.')
+    return int(candidates[order])
+
+def preview_mode_num(gds_file, ports, wavelengths, mode_idx, solver: str = 'tidy3d',
+                     num_modes: int = 4, file_name: str | None = None, **kwargs):
+    r""" solve the modes of every optical port before a simulation, and pick the number of port modes.
+
+    Args:
+        gds_file (str): path to the GDS file, as imported by the builder
+        ports (dict): gdsfactory ports of the device
+        wavelengths (array): wavelengths (um), typically the band edges and the center
+        mode_idx (int): injected mode, in the convention of the solver
+        solver (str, optional): 'lumerical', 'tidy3d' or 'fdtd2d'. Defaults to 'tidy3d'.
+        num_modes (int, optional): number of modes solved per port. Defaults to 4.
+        file_name (str | None, optional): if given, the port modes are saved to file_name+'_modes.json'.
+        **kwargs: passed to solve_port_modes (material_type, guiding_material, z_min, z_max, flag_boolean, ...)
+
+    Returns:
+        mode_num (int): smallest number of modes covering every guided port mode and the injected mode
+    """
+    mode_idx = convert_mode_index(mode_idx, solver, 'tidy3d')
+    mode_num = mode_idx + 1
+    summary = {}
+    for port_name in ports:
+        if not re.match(r'^o\d+$', port_name):
+            continue
+        modes = solve_port_modes(gds_file, ports[port_name], wavelengths, num_modes=max(num_modes, mode_idx+1), **kwargs)
+        mode_num = max(mode_num, minimal_mode_num(modes, mode_idx))
+
+        center = int(np.argmin(np.abs(modes['wavelengths'] - modes['wavelengths'].mean())))
+        print(f'Port {port_name}:')
+        for m in range(modes['n_eff'].shape[1]):
+            print(f"    mode {convert_mode_index(m, 'tidy3d', solver)}: n_eff {modes['n_eff'][center, m]:.4f}, "
+                  f"n_g {modes['n_group'][center, m]:.4f}, TE fraction {modes['te_fraction'][center, m]:.2f}")
+        summary[port_name] = {key: modes[key] for key in ['wavelengths', 'n_eff', 'n_group', 'te_fraction', 'n_clad']}
+
+    print(f'Number of port modes: {mode_num}')
+    if file_name:
+        summary['mode_num'] = mode_num
+        write_to_json(dict_name=summary, json_name=file_name+'_modes.json')
+    return mode_num
+
+def mode_extent(modes, mode_num: int, field_threshold: float = 1e-2):
+    r""" extent of the first mode_num modes, where the field amplitude exceeds a fraction of its peak.
+
+    Args:
+        modes (dict): result of solve_port_modes
+        mode_num (int): number of modes to include
+        field_threshold (float, optional): truncation threshold of the field amplitude. Defaults to 1e-2.
+
+    Returns:
+        extent (tuple): (u_min, u_max, z_min, z_max) in um, u relative to the port center
+    """
+    intensity = np.sum(np.abs(modes['E'][:mode_num])**2, axis=1)
+    amplitude = np.sqrt(intensity/intensity.max(axis=(1, 2), keepdims=True))
+    mask = np.any(amplitude > field_threshold, axis=0)
+    u = modes['u'][mask.any(axis=1)]
+    z = modes['z'][mask.any(axis=0)]
+    return u.min(), u.max(), z.min(), z.max()
+
+def port_planes(gds_file, ports, wavelengths, mode_idx, solver: str = 'tidy3d',
+                field_threshold: float = 1e-2, margin: float = 3.0, **kwargs):
+    r""" size of the source and monitor planes of every optical port from the decay of its modes.
+
+    Args:
+        gds_file (str): path to the GDS file, as imported by the builder
+        ports (dict): gdsfactory ports of the device
+        wavelengths (array): wavelengths (um), the longest one has the widest modes
+        mode_idx (int): injected mode, in the convention of the solver
+        solver (str, optional): 'lumerical', 'tidy3d' or 'fdtd2d'. Defaults to 'tidy3d'.
+        field_threshold (float, optional): field amplitude, relative to the peak, at the plane edges. Defaults to 1e-2.
+        margin (float, optional): lateral margin of the mode solve on each side of the port (um). Defaults to 3.0.
+        **kwargs: passed to solve_port_modes (material_type, guiding_material, z_min, z_max, flag_boolean, ...)
+
+    Returns:
+        planes (dict): port name -> dict with 'span' (lateral size), 'z' (center), 'z_span' (vertical size)
+            and 'decay' (lateral field extent beyond the port width), in um
+    """
+    mode_idx = convert_mode_index(mode_idx, solver, 'tidy3d')
+    planes = {}
+    for port_name in ports:
+        if not re.match(r'^o\d+$', port_name):
+            continue
+        port = ports[port_name]
+        modes = solve_port_modes(gds_file, port, [max(wavelengths)], num_modes=mode_idx+2, margin=margin, **kwargs)
+        u_min, u_max, z_min, z_max = mode_extent(modes, minimal_mode_num(modes, mode_idx), field_threshold)
+        half_span = max(-u_min, u_max)
+        planes[port_name] = dict(
+            span = 2*half_span,
+            z = 0.5*(z_min + z_max),
+            z_span = z_max - z_min,
+            decay = max(half_span - 0.5*port.width, 0.0),
+        )
+    return planes
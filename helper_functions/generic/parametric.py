@@ -0,0 +1,202 @@
+from contextlib import contextmanager
+from functools import partial
+import os
+import sys
+import json
+import yaml
+import hashlib
+import importlib
+import itertools
+import gdsfactory as gf
+from gdsfactory.generic_tech import get_generic_pdk
+
+from helper_functions.generic.misc import write_to_json
+from helper_functions.generic.gds_handling import extend_from_ports
+from helper_functions.generic.subband import run_workers
+
+# generated components and extended geometries of this process, by settings hash
+COMPONENTS = {}
+EXTENDED = {}
+
+def resolve_setting(value):
+    r""" component functions stored in the YAML as {'function': name, 'settings': {...}} become cell factories.
+    """
+    if isinstance(value, dict) and 'function' in value:
+        factory = gf.get_active_pdk().get_cell(value['function'])
+        kwargs = dict(value.get('settings', {}))
+        kwargs.update({key: item for key, item in value.items() if key not in ['function', 'module', 'settings']})
+        return partial(factory, **kwargs) if kwargs else factory
+    return value
+
+@contextmanager
+def generic_pdk():
+    r""" activate the generic PDK the GDS library was exported with, and restore the active PDK afterwards.
+
+    The cross-sections ('xs_sc') and nested components ('bend_s') of the settings, and the cross-sections
+    of the generated ports, are those of the generic PDK.
+    """
+    active = gf.get_active_pdk()
+    get_generic_pdk().activate()
+    try:
+        yield
+    finally:
+        active.activate()
+
+def generate_component(module, function_name, settings):
+    r""" call a gdsfactory component function with the settings saved in a YAML.
+    """
+    with generic_pdk():
+        function = getattr(importlib.import_module(module), function_name)
+        return function(**{key: resolve_setting(value) for key, value in settings.items()})
+
+def read_spec(yml_file, cache_dir: str = 'layout_cache', **changes):
+    r""" parametric description of a GDS library cell, from the YAML saved next to its GDS.
+
+    The port names of the exported GDS are kept: if the installed gdsfactory names the ports differently,
+    they are matched by position and direction at the exported settings.
+
+    Args:
+        yml_file (str): path to the YAML, e.g. 'gds_library/cells_from_gds/gdsfactory_generic_pdk/coupler.yml'
+        cache_dir (str, optional): directory of the generated GDS files. Defaults to 'layout_cache'.
+        **changes: settings to change, e.g. gap=0.2
+
+    Returns:
+        spec (dict): 'module', 'function_name', 'settings', 'port_names' and 'cache_dir', JSON-serializable
+    """
+    with open(yml_file) as f:
+        metadata = yaml.safe_load(f)
+    cell = metadata['settings'] if 'settings' in metadata else metadata['cells'][metadata['name']]
+    settings = dict(cell['full'])
+    for key in changes:
+        if key not in settings:
+            raise Exception(f"'{key}' is not a setting of {cell['function_name']}, only {list(settings)}.")
+
+    # port names of the exported GDS
+    component = generate_component(cell['module'], cell['function_name'], settings)
+    port_names = {}
+    for name, port in component.ports.items():
+        for exported, saved in metadata.get('ports', {}).items():
+            if (abs(port.center[0] - saved['center'][0]) < 1e-3 and abs(port.center[1] - saved['center'][1]) < 1e-3
+                    and port.orientation == saved['orientation']):
+                port_names[name] = exported
+    if all(name == exported for name, exported in port_names.items()):
+        port_names = {}
+
+    settings.update(changes)
+    return dict(
+        module = cell['module'],
+        function_name = cell['function_name'],
+        settings = settings,
+        port_names = port_names,
+        cache_dir = cache_dir,
+    )
+
+def spec_hash(spec):
+    r""" hash of the function and settings of a parametric component.
+    """
+    key = json.dumps([spec['module'], spec['function_name'], spec['settings'], spec.get('port_names', {})], sort_keys=True, default=str)
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+def parametric_gds(spec):
+    r""" path of the generated GDS of a parametric component in the layout cache.
+    """
+    return os.path.join(spec.get('cache_dir', 'layout_cache'), spec_hash(spec), spec['function_name']+'.gds')
+
+def parametric_component(spec):
+    r""" component of a parametric description, generated once per process and settings.
+
+    The generated GDS is also written to the layout cache, for the tools reading GDS files.
+
+    Args:
+        spec (dict): from read_spec
+
+    Returns:
+        component (Component): with the port names of the exported GDS
+    """
+    key = spec_hash(spec)
+    if key not in COMPONENTS:
+        component = generate_component(spec['module'], spec['function_name'], spec['settings'])
+        if spec.get('port_names'):
+            renamed = gf.Component(component.name+'_ports')
+            ref = renamed << component
+            for name, port in ref.ports.items():
+                renamed.add_port(name=spec['port_names'].get(name, name), port=port)
+            component = renamed
+
+        gds_file = parametric_gds(spec)
+        if not os.path.exists(gds_file):
+            os.makedirs(os.path.dirname(gds_file), exist_ok=True)
+            component.write_gds(gds_file, with_metadata=True)
+            write_to_json(dict_name=spec, json_name=os.path.join(os.path.dirname(gds_file), 'spec.json'))
+        COMPONENTS[key] = component
+    return COMPONENTS[key]
+
+def extended_component(spec, extension: float = 10.0, flatten: bool = True):
+    r""" component of a parametric description with its ports extended, generated once per process and settings.
+
+    Returns:
+        device (Component): extended component
+        ports (dict): ports of the component before the extension
+    """
+    key = (spec_hash(spec), extension, flatten)
+    if key not in EXTENDED:
+        component = parametric_component(spec)
+        with generic_pdk():
+            EXTENDED[key] = extend_from_ports(component, offset=extension, flatten=flatten)
+    return EXTENDED[key]
+
+def sweep_geometry(solver, parameters, yml_file, sweep,
+                   workers: int = 4,
+                   cache_dir: str = 'layout_cache'):
+    r""" run a device over all combinations of geometry settings, regenerated from its YAML.
+
+    Each combination runs in its own process, at most 'workers' at a time, with the component
+    generated in memory instead of read from predefined_gds. The runs are found in the run catalog.
+
+    Example:
+        sweep_geometry('tidy3d', p, 'gds_library/cells_from_gds/gdsfactory_generic_pdk/coupler.yml',
+                       sweep=dict(gap=[0.2, 0.236, 0.27], length=[15.0, 20.0]))
+
+    Args:
+        solver (str): 'lumerical', 'tidy3d' or 'fdtd2d'
+        parameters (dict): simulation parameters, as for simulate_predefined_gds
+        yml_file (str): YAML of the GDS library cell
+        sweep (dict): setting name -> list of values
+        workers (int, optional): runs in parallel. Defaults to 4.
+        cache_dir (str, optional): directory of the generated GDS files. Defaults to 'layout_cache'.
+
+    Returns:
+        runs (list): dicts with the swept settings, 'file_name' and 'predefined_gds' of every run
+    """
+    names = list(sweep)
+    runs = []
+    run_parameters = []
+    for values in itertools.product(*[sweep[name] for name in names]):
+        changes = dict(zip(names, values))
+        spec = read_spec(yml_file, cache_dir=cache_dir, **changes)
+        suffix = '_'+'_'.join(f'{name}{value}' for name, value in changes.items())
+
+        q = dict(parameters)
+        q['parametric'] = spec
+        q['predefined_gds'] = parametric_gds(spec)
+        q['file_name'] = parameters['file_name']+suffix
+        if 'task_name' in q:
+            q['task_name'] = q['task_name']+suffix
+
+        # generate the layouts up front, so that invalid settings fail before any run
+        parametric_component(spec)
+        run_parameters.append(q)
+        runs.append(dict(changes, file_name=q['file_name'], predefined_gds=q['predefined_gds']))
+
+    run_workers('helper_functions.generic.parametric', solver, run_parameters, workers=workers, suffix='_sweep.json')
+    return runs
+
+if __name__ == '__main__':
+    # worker of sweep_geometry: python -m helper_functions.generic.parametric <solver> <run parameters JSON>
+    sys.path.append(os.getcwd())
+    from gds_library import pdk_universal
+    pdk_universal.activate()
+    with open(sys.argv[2]) as f:
+        run_parameters = json.load(f)
+    simulate = importlib.import_module('helper_functions.'+sys.argv[1]+'.simulate_device').simulate_predefined_gds
+    simulate(parameters=run_parameters)
@@ -0,0 +1,106 @@
+import re
+import numpy as np
+
+# speed of light in um/s, Tidy3D monitors are indexed by frequency
+C_0 = 299792458.0e6
+
+def output_ports(results, input_port: str | None = 'o1'):
+    r""" names of the output ports found in a results dictionary or a Tidy3D SimulationData.
+
+    Args:
+        results: Lumerical-style results dict (Lumerical, fdtd2d) or Tidy3D SimulationData
+        input_port (str | None, optional): port excluded from the list. Defaults to 'o1', None keeps all ports.
+
+    Returns:
+        port_names (list): sorted by port number
+    """
+    if isinstance(results, dict):
+        names = [key.split(' ')[0] for key in results if key.endswith(' T_net')]
+    else:
+        names = [monitor.name.split(' ')[0] for monitor in results.simulation.monitors if monitor.name.endswith(' mode')]
+    names = [name for name in set(names) if re.match(r'^o\d+$', name) and name != input_port]
+    return sorted(names, key=lambda name: int(name[1:]))
+
+def port_transmission(results, port_name, mode_index: int | None = 0, direction: str | None = None):
+    r""" transmission spectrum of a port, the same for all solvers.
+
+    Args:
+        results: Lumerical-style results dict (Lumerical, fdtd2d, or loaded from '_results.json') or Tidy3D SimulationData
+        port_name (str): port name, e.g. 'o2'
+        mode_index (int | None, optional): mode, counted from 0 as the columns of the mode expansion.
+            Defaults to 0. None for the total transmission (flux).
+        direction (str | None, optional): Tidy3D only, '+' or '-'. Defaults to None, the direction carrying more power.
+
+    Returns:
+        wavelengths (ndarray): wavelengths (um), ascending
+        T (ndarray): power transmission, fraction of the injected power
+    """
+    if isinstance(results, dict):
+        if mode_index is None:
+            data = results[port_name+' T']
+            T = np.asarray(data['T'], dtype=float).ravel()
+        else:
+            data = results[port_name+' T_net']
+            T = np.asarray(data['T_net'], dtype=float)
+            T = T.reshape(T.shape[0], -1)[:, mode_index]
+        wavelengths = np.asarray(data['lambda'], dtype=float).ravel()*1e6
+    else:
+        if mode_index is None and port_name+' flux' in results.monitor_data:
+            flux = results[port_name+' flux'].flux
+            wavelengths = C_0/flux.coords['f'].values
+            T = np.abs(flux.values)
+        else:
+            amps = results[port_name+' mode'].amps
+            wavelengths = C_0/amps.coords['f'].values
+            power = np.abs(amps.values)**2   # (direction, f, mode_index)
+            directions = list(amps.coords['direction'].values)
+            if direction is None:
+                i_dir = int(np.argmax(power.sum(axis=(1, 2))))
+            else:
+                i_dir = directions.index(direction)
+            T = power[i_dir].sum(axis=1) if mode_index is None else power[i_dir, :, mode_index]
+
+    order = np.argsort(wavelengths)
+    return wavelengths[order], T[order]
+
+def port_amplitude(results, port_name, mode_index: int = 0, direction: str | None = None):
+    r""" complex mode amplitude of a port, normalized to the injected power.
+
+    Lumerical-style results keep the power only, their amplitude is sqrt(T_net) with zero phase, unless they
+    hold the '<port> amplitude' of a compacted Tidy3D run.
+
+    Args:
+        results: Lumerical-style results dict or Tidy3D SimulationData
+        port_name (str): port name, e.g. 'o2'
+        mode_index (int, optional): mode, counted from 0. Defaults to 0.
+        direction (str | None, optional): Tidy3D only, '+' or '-'. Defaults to None, the direction carrying more power.
+
+    Returns:
+        wavelengths (ndarray): wavelengths (um), ascending
+        amplitude (ndarray): complex
+    """
+    if isinstance(results, dict) and port_name+' amplitude' in results:
+        data = results[port_name+' amplitude']
+        wavelengths = np.asarray(data['lambda'], dtype=float).ravel()*1e6
+        order = np.argsort(wavelengths)
+        return wavelengths[order], np.asarray(data['amplitude'])[:, mode_index][order]
+    if isinstance(results, dict):
+        wavelengths, T = port_transmission(results, port_name, mode_index=mode_index)
+        return wavelengths, np.sqrt(np.maximum(T, 0.0)).astype(complex)
+    amps = results[port_name+' mode'].amps
+    wavelengths = C_0/amps.coords['f'].values
+    values = amps.values # (direction, f, mode_index)
+    if direction is None:
+        i_dir = int(np.argmax((np.abs(values)**2).sum(axis=(1, 2))))
+    else:
+        i_dir = list(amps.coords['direction'].values).index(direction)
+    order = np.argsort(wavelengths)
+    return wavelengths[order], values[i_dir, :, mode_index][order]
+
+def mode_count(results, port_name):
+    r""" number of modes in the mode expansion of a port.
+    """
+    if isinstance(results, dict):
+        T_net = np.asarray(results[port_name+' T_net']['T_net'])
+        return T_net.reshape(T_net.shape[0], -1).shape[1]
+    return results[port_name+' mode'].amps.coords['mode_index'].size
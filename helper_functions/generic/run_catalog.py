@@ -0,0 +1,178 @@
+from contextlib import closing
+from datetime import datetime
+import os
+import glob
+import json
+import sqlite3
+import numpy as np
+
+from helper_functions.generic.misc import ComplexEncoder, convert_for_json
+from helper_functions.generic.results import output_ports
+from helper_functions.generic.convergence import default_metrics, device_key
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file_name TEXT,
+    solver TEXT,
+    device TEXT,
+    gds_hash TEXT,
+    resolution REAL,
+    wavelength REAL,
+    wav_span REAL,
+    started TEXT,
+    finished TEXT,
+    duration REAL,
+    parameters TEXT,
+    files TEXT
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER REFERENCES runs(id) ON DELETE CASCADE,
+    name TEXT,
+    value REAL,
+    PRIMARY KEY (run_id, name)
+);
+CREATE INDEX IF NOT EXISTS runs_device ON runs (device, solver, resolution);
+CREATE INDEX IF NOT EXISTS runs_gds_hash ON runs (gds_hash);
+CREATE INDEX IF NOT EXISTS metrics_name ON metrics (name, value);
+"""
+
+# columns of the runs table that can be filtered on directly
+COLUMNS = ['id', 'file_name', 'solver', 'device', 'gds_hash', 'resolution', 'wavelength', 'wav_span',
+           'started', 'finished', 'duration']
+
+def connect(db_file):
+    r""" open the catalog, creating the tables on first use.
+    Write-ahead logging lets several runs write to the same catalog while it is being queried.
+    """
+    if os.path.dirname(db_file):
+        os.makedirs(os.path.dirname(db_file), exist_ok=True)
+    conn = sqlite3.connect(db_file, timeout=60)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA foreign_keys=ON')
+    conn.executescript(SCHEMA)
+    return conn
+
+def scalar_metrics(results):
+    r""" scalar figures of a run, from the spectra of default_metrics: the value at the center wavelength, and the band extremes.
+
+    Args:
+        results: Lumerical-style results dict or Tidy3D SimulationData
+
+    Returns:
+        metrics (dict): name -> float
+    """
+    metrics = {}
+    if isinstance(results, dict) and 'time(s)' in results:
+        metrics['time(s)'] = float(results['time(s)'])
+    if not output_ports(results):
+        return metrics
+    for name, spectrum in default_metrics(results).items():
+        spectrum = np.asarray(spectrum, dtype=float)
+        metrics[name] = float(spectrum[spectrum.size//2])
+        metrics[name+' min'] = float(spectrum.min())
+        metrics[name+' max'] = float(spectrum.max())
+    return metrics
+
+def run_files(file_name):
+    r""" pointers to the bulk data of a run: every output sharing the file name.
+    """
+    return sorted(path for path in glob.glob(glob.escape(file_name)+'*')
+                  if os.path.basename(path)[len(os.path.basename(file_name)):][:1] in ['.', '_'])
+
+def record_run(db_file, parameters, results, solver, start_time, end_time=None):
+    r""" add a finished run to the catalog, in a single transaction.
+
+    Args:
+        db_file (str): path to the SQLite catalog
+        parameters (dict): simulation parameters, as saved to file_name+'.json'
+        results: Lumerical-style results dict or Tidy3D SimulationData
+        solver (str): 'lumerical', 'tidy3d' or 'fdtd2d'
+        start_time (datetime): start of the run
+        end_time (datetime, optional): end of the run. Defaults to None, now.
+
+    Returns:
+        run_id (int): id of the run in the catalog
+    """
+    if end_time is None:
+        end_time = datetime.now()
+    file_name = parameters['file_name']
+    device, gds_hash = device_key(parameters['predefined_gds'])
+
+    files = run_files(file_name)
+
+    row = (
+        os.path.abspath(file_name), solver, device, gds_hash,
+        parameters.get('resolution'), parameters.get('wavelength'), parameters.get('wav_span'),
+        start_time.isoformat(), end_time.isoformat(), (end_time - start_time).total_seconds(),
+        json.dumps(convert_for_json(parameters), cls=ComplexEncoder, default=str),
+        json.dumps([os.path.abspath(path) for path in files]),
+    )
+    metrics = scalar_metrics(results)
+
+    with closing(connect(db_file)) as conn:
+        with conn:
+            cursor = conn.execute(
+                'INSERT INTO runs (file_name, solver, device, gds_hash, resolution, wavelength, wav_span, '
+                'started, finished, duration, parameters, files) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', row)
+            run_id = cursor.lastrowid
+            conn.executemany('INSERT INTO metrics (run_id, name, value) VALUES (?, ?, ?)',
+                             [(run_id, name, value) for name, value in metrics.items()])
+    return run_id
+
+def update_files(db_file, file_name):
+    r""" refresh the file pointers of the runs of a file name, after their outputs were moved or removed.
+
+    Returns:
+        count (int): runs updated
+    """
+    files = json.dumps([os.path.abspath(path) for path in run_files(file_name)])
+    with closing(connect(db_file)) as conn:
+        with conn:
+            cursor = conn.execute('UPDATE runs SET files = ? WHERE file_name = ?', (files, os.path.abspath(file_name)))
+    return cursor.rowcount
+
+def query_runs(db_file, where: str | None = None, args: tuple = (), expand_parameters = False, **filters):
+    r""" query the catalog, one row per run with one column per metric.
+
+    Examples:
+        query_runs('run_catalog.db', device='mmi2x2_with_sbend', solver='tidy3d', resolution=8)
+        query_runs('run_catalog.db', where='resolution >= ? AND wav_span > ?', args=(10, 0.05))
+
+    Args:
+        db_file (str): path to the SQLite catalog
+        where (str | None, optional): extra SQL condition on the runs table. Defaults to None.
+        args (tuple, optional): values of the '?' placeholders in where.
+        expand_parameters (bool, optional): add one 'parameters.<key>' column per parameter. Defaults to False.
+        **filters: equality filters on the runs columns (solver, device, resolution, gds_hash, ...)
+
+    Returns:
+        runs (pandas.DataFrame): runs and their metrics
+    """
+    import pandas as pd
+    conditions = []
+    values = []
+    for key, value in filters.items():
+        if key not in COLUMNS:
+            raise Exception(f"Unknown catalog column '{key}'.")
+        conditions.append(f'{key} = ?')
+        values.append(value)
+    if where:
+        conditions.append('('+where+')')
+        values.extend(args)
+    condition = ' WHERE '+' AND '.join(conditions) if conditions else ''
+
+    with closing(connect(db_file)) as conn:
+        runs = pd.read_sql_query('SELECT * FROM runs'+condition, conn, params=values)
+        metrics = pd.read_sql_query(
+            'SELECT run_id, name, value FROM metrics WHERE run_id IN (SELECT id FROM runs'+condition+')',
+            conn, params=values)
+
+    if not metrics.empty:
+        metrics = metrics.pivot(index='run_id', columns='name', values='value')
+        runs = runs.join(metrics, on='id')
+    runs['files'] = runs['files'].apply(json.loads)
+    if expand_parameters:
+        parameters = pd.json_normalize(runs['parameters'].apply(json.loads).tolist()).add_prefix('parameters.')
+        runs = pd.concat([runs, parameters], axis=1)
+    return runs
@@ -0,0 +1,387 @@
+from dataclasses import dataclass, asdict
+import os
+import json
+import hashlib
+import numpy as np
+import gdstk
+import gdsfactory as gf
+
+from helper_functions.generic.misc import write_to_json
+from helper_functions.generic.gds_handling import extend_from_ports, get_layer_name_by_tuple, write_gds
+from helper_functions.generic.parametric import parametric_component, extended_component, spec_hash
+from helper_functions.generic.mode_solver import preview_mode_num, port_planes, convert_mode_index
+from helper_functions.generic.materials import interpolate_nk
+from helper_functions.generic.critical_features import find_critical_features
+
+# layout parameters of the specs, with the defaults of the builders that do not define them
+SPEC_KEYS = dict(
+    flag_extend = 1,
+    extension = 10.0,
+    flag_instance = 0,
+    flag_boolean = 0,
+    flag_mode_preview = 0,
+    mode_num = 5,
+    flag_auto_size = 0,
+    field_threshold = 1e-2,
+    flag_mesh_override = 0,
+    mesh_min_cells = 4,
+    resolution = 6,
+    wavelength = 1.55,
+    wav_span = 0.05,
+    wav_step = 0.01,
+    solver_z_min = -1.0,
+    solver_z_max = 1.0,
+    material_type = 'universal',
+    guiding_material = 'SiN',
+    change_cladding = False,
+)
+
+# specs built by this process, by layout key
+SPECS = {}
+
+@dataclass(frozen=True, slots=True)
+class PortSpec:
+    r""" port of the device and its mode plane, in um and degrees.
+    """
+    name: str
+    center: tuple
+    width: float
+    orientation: float
+    span: float
+    z: float
+    z_span: float
+
+    @property
+    def axis(self):
+        r""" normal axis of the port plane, None for a non-Manhattan port.
+        """
+        if self.orientation in [0.0, 180.0]:
+            return 'x'
+        if self.orientation in [90.0, 270.0]:
+            return 'y'
+        return None
+
+    @property
+    def plane_center(self):
+        return (self.center[0], self.center[1], self.z)
+
+    @property
+    def plane_size(self):
+        if self.axis == 'y':
+            return (self.span, 0, self.z_span)
+        return (0, self.span, self.z_span)
+
+@dataclass(frozen=True, slots=True)
+class LayerSpec:
+    r""" polygons of one layer of the layout, summarized: the geometry itself stays in the GDS of the spec.
+    """
+    name: str
+    layer: tuple
+    z_min: float | None
+    z_max: float | None
+    num_polygons: int
+    bbox: tuple
+    digest: str
+
+@dataclass(frozen=True, slots=True)
+class BandSpec:
+    r""" wavelength band of the sources and monitors (um).
+    """
+    wavelength: float
+    wav_span: float
+    wav_step: float
+
+    @property
+    def wav_start(self):
+        return self.wavelength - 0.5*self.wav_span
+
+    @property
+    def wav_stop(self):
+        return self.wavelength + 0.5*self.wav_span
+
+    @property
+    def num_points(self):
+        return round(self.wav_span/self.wav_step) + 1
+
+@dataclass(frozen=True, slots=True)
+class MeshSpec:
+    r""" global mesh cells per wavelength, and local overrides as (layer name, bounds, maximum step).
+    """
+    resolution: float
+    overrides: tuple = ()
+
+@dataclass(frozen=True, slots=True)
+class SimulationSpec:
+    r""" solver-agnostic description of a simulation, compiled by the backends.
+
+    Lengths in um, domain as (x_min, y_min, z_min, x_max, y_max, z_max), mode_idx counted from 0.
+    """
+    gds_file: str
+    layers: tuple
+    ports: tuple
+    domain: tuple
+    band: BandSpec
+    mesh: MeshSpec
+    mode_num: int
+    mode_idx: int
+    material_type: str
+    guiding_material: str
+    cladding_index: float | None = None
+    monitor_z: float = 0.1
+
+    @property
+    def center(self):
+        x_min, y_min, z_min, x_max, y_max, z_max = self.domain
+        return (0.5*(x_max+x_min), 0.5*(y_max+y_min), 0.5*(z_max+z_min))
+
+    @property
+    def size(self):
+        x_min, y_min, z_min, x_max, y_max, z_max = self.domain
+        return (x_max-x_min, y_max-y_min, z_max-z_min)
+
+    @property
+    def cladding_bounds(self):
+        r""" box of the changed top cladding, 5 um beyond the domain.
+        """
+        x_min, y_min, z_min, x_max, y_max, z_max = self.domain
+        return (x_min-5.0, y_min-5.0, 0, x_max+5.0, y_max+5.0, z_max+5.0)
+
+    @property
+    def optical_ports(self):
+        r""" ports named 'o<n>', the others (e.g. 'o2_1') are on the same position but other layers, redundant.
+        """
+        return [port for port in self.ports if port.name[0] == 'o' and port.name[1:].isdigit()]
+
+    def port(self, name):
+        for port in self.ports:
+            if port.name == name:
+                return port
+        raise Exception(f"The spec has no port '{name}', only {[port.name for port in self.ports]}.")
+
+    def to_dict(self):
+        return asdict(self)
+
+def _tuples(value):
+    r""" lists of a JSON spec back to tuples.
+    """
+    if isinstance(value, list):
+        return tuple(_tuples(item) for item in value)
+    return value
+
+def spec_from_dict(spec):
+    r""" SimulationSpec from its dict, e.g. read back from JSON.
+    """
+    spec = dict(spec)
+    spec['layers'] = tuple(LayerSpec(**{key: _tuples(value) for key, value in layer.items()}) for layer in spec['layers'])
+    spec['ports'] = tuple(PortSpec(**{key: _tuples(value) for key, value in port.items()}) for port in spec['ports'])
+    spec['domain'] = _tuples(spec['domain'])
+    spec['band'] = BandSpec(**spec['band'])
+    spec['mesh'] = MeshSpec(resolution=spec['mesh']['resolution'], overrides=_tuples(spec['mesh']['overrides']))
+    return SimulationSpec(**spec)
+
+def load_spec(json_file):
+    with open(json_file) as f:
+        return spec_from_dict(json.load(f))
+
+def simulation_hash(spec):
+    r""" hash of the content of a spec, independent of where its GDS was written.
+    """
+    content = spec.to_dict()
+    content.pop('gds_file')
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()[:16]
+
+def layout_key(parameters):
+    r""" hash of the inputs of the layout work: source geometry, PDK and layout parameters.
+
+    The injected mode is hashed counted from 0, and numbers as floats, so that the solvers share the key.
+    """
+    if parameters.get('parametric'):
+        source = spec_hash(parameters['parametric'])
+    else:
+        with open(parameters['gds_file'], 'rb') as f:
+            source = hashlib.sha256(f.read()).hexdigest()
+    values = {}
+    for key, default in SPEC_KEYS.items():
+        value = parameters.get(key, default)
+        values[key] = float(value) if isinstance(value, (bool, int, float)) else value
+    values['mode_idx'] = convert_mode_index(int(parameters['mode_idx']), parameters['solver'], 'tidy3d')
+    key = json.dumps([source, gf.get_active_pdk().name, values], sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+def layer_specs(gds_file):
+    r""" per-layer summary of the top cell of a GDS, with the z range of the layer stack.
+    """
+    layer_stack = gf.get_active_pdk().get_layer_stack()
+    cell = gdstk.read_gds(gds_file).top_level()[0]
+    polygons = {}
+    for polygon in cell.get_polygons():
+        polygons.setdefault((polygon.layer, polygon.datatype), []).append(np.round(polygon.points, 4) + 0.0)
+
+    layers = []
+    for layer in sorted(polygons):
+        name = get_layer_name_by_tuple(layer)
+        level = layer_stack.layers.get(name)
+        points = np.concatenate(polygons[layer])
+        layers.append(LayerSpec(
+            name = name,
+            layer = layer,
+            z_min = float(level.zmin) if level else None,
+            z_max = float(level.zmin + level.thickness) if level else None,
+            num_polygons = len(polygons[layer]),
+            bbox = tuple(float(v) for v in (*points.min(axis=0), *points.max(axis=0))),
+            digest = hashlib.sha256(b''.join(sorted(points.tobytes() for points in polygons[layer]))).hexdigest()[:16],
+        ))
+    return tuple(layers)
+
+def mesh_overrides(gds_file, wavelength, resolution, material_type, guiding_material, mesh_min_cells: int = 4):
+    r""" local mesh overrides of a layout, around the features the global mesh cannot resolve.
+
+    Returns:
+        overrides (tuple): (layer name, bounds, maximum step) per feature
+    """
+    n_core = interpolate_nk(os.path.join('materials_library', material_type+'_'+guiding_material), wavelength)[0]
+    features = find_critical_features(
+        gds_file = gds_file,
+        mesh_step = wavelength/(n_core*resolution),
+        mesh_min_cells = mesh_min_cells,
+    )
+    return tuple((feature['layer'], tuple(float(v) for v in feature['bounds']), float(feature['dl'])) for feature in features)
+
+def build_spec(parameters, solver: str = 'tidy3d', spec_cache: str | None = None):
+    r""" do the layout work of a simulation once: import or generate and extend the layout, count the port modes,
+    place the ports and planes, size the domain and find the mesh overrides.
+
+    Specs are kept by layout key for the process, and in spec_cache if given, so that the runs of the
+    same device on several solvers share the layout work.
+
+    Args:
+        parameters (dict): builder parameters, 'file_name', 'gds_file' or 'parametric', mode_idx in the convention of solver
+        solver (str, optional): 'lumerical', 'tidy3d' or 'fdtd2d'. Defaults to 'tidy3d'.
+        spec_cache (str | None, optional): directory of the specs as JSON. Defaults to None, kept in memory only.
+
+    Returns:
+        spec (SimulationSpec)
+    """
+    p = dict(SPEC_KEYS)
+    p.update(parameters)
+    p['solver'] = solver
+    key = layout_key(p)
+
+    cache_file = os.path.join(spec_cache, key+'.json') if spec_cache else None
+    if key not in SPECS and cache_file and os.path.exists(cache_file):
+        SPECS[key] = load_spec(cache_file)
+    if key in SPECS and os.path.exists(SPECS[key].gds_file):
+        print(f"Layout of spec {key} reused from {SPECS[key].gds_file}.")
+        return SPECS[key]
+
+    file_name = p['file_name']
+    parametric = p.get('parametric')
+    flatten = not p['flag_instance']
+
+    # import or generate, and optionally extend the layout
+    component = parametric_component(parametric) if parametric else gf.import_gds(p['gds_file'], read_metadata=True)
+    if p['flag_extend']:
+        if parametric:
+            # generated component, extended once per process and settings
+            device, ports = extended_component(parametric, extension=p['extension'], flatten=flatten)
+        else:
+            device, ports = extend_from_ports(component, offset=p['extension'], flatten=flatten)
+        sim_gds = file_name+'_extended.gds'
+    else:
+        device = component
+        ports = device.ports
+        sim_gds = file_name+'.gds'
+    write_gds(device, sim_gds)
+
+    wav_start = p['wavelength'] - 0.5*p['wav_span']
+    wav_stop = p['wavelength'] + 0.5*p['wav_span']
+    solve = dict(
+        gds_file = sim_gds,
+        ports = ports,
+        mode_idx = p['mode_idx'],
+        solver = solver,
+        material_type = p['material_type'],
+        guiding_material = p['guiding_material'],
+        z_min = p['solver_z_min'],
+        z_max = p['solver_z_max'],
+        flag_boolean = p['flag_boolean'],
+    )
+
+    # pick the number of port modes from a local eigenmode solve
+    mode_num = p['mode_num']
+    if p['flag_mode_preview']:
+        mode_num = preview_mode_num(wavelengths=[wav_start, p['wavelength'], wav_stop], file_name=file_name, **solve)
+
+    # calculate bounds from ports
+    x_min = np.inf
+    x_max = -1*np.inf
+    y_min = np.inf
+    y_max = -1*np.inf
+
+    for port_name in ports:
+        x = ports[port_name].center[0]
+        y = ports[port_name].center[1]
+        w = ports[port_name].width
+        x_min = min(x_min, x)
+        x_max = max(x_max, x)
+        y_min = min(y_min, y - w)
+        y_max = max(y_max, y + w)
+
+    if x_min == x_max: # like a 180-degree bend, U-shape
+        x_min = ports['o1'].center[0]
+        x_max = device.xmax
+        y_min = device.ymin
+        y_max = device.ymax
+
+    solver_x_min = x_min - 1.0
+    solver_x_max = x_max + 1.0
+    solver_y_min = y_min - 1.0
+    solver_y_max = y_max + 1.0
+    solver_z_min = p['solver_z_min']
+    solver_z_max = p['solver_z_max']
+
+    # port planes: port width + 4 um by 2 um, or sized from the decay of the port modes
+    planes = {port_name: dict(span=ports[port_name].width+4.0, z=0.0, z_span=2.0) for port_name in ports}
+    if p['flag_auto_size']:
+        planes.update(port_planes(wavelengths=[wav_start, wav_stop], field_threshold=p['field_threshold'], **solve))
+        # tight domain in y: bounding box of the device without its extensions plus the lateral field decay,
+        # vertical extent of the port planes; x keeps the ports plus 1 um, the planes must stay inside
+        decay = max(plane['decay'] for plane in planes.values() if 'decay' in plane)
+        solver_y_min = component.ymin - decay
+        solver_y_max = component.ymax + decay
+        solver_z_min = min(plane['z'] - 0.5*plane['z_span'] for plane in planes.values() if 'decay' in plane)
+        solver_z_max = max(plane['z'] + 0.5*plane['z_span'] for plane in planes.values() if 'decay' in plane)
+
+    # local refinement around the features the global mesh cannot resolve
+    overrides = ()
+    if p['flag_mesh_override']:
+        overrides = mesh_overrides(sim_gds, p['wavelength'], p['resolution'], p['material_type'], p['guiding_material'],
+                                   mesh_min_cells=p['mesh_min_cells'])
+
+    spec = SimulationSpec(
+        gds_file = sim_gds,
+        layers = layer_specs(sim_gds),
+        ports = tuple(PortSpec(
+            name = port_name,
+            center = (float(ports[port_name].center[0]), float(ports[port_name].center[1])),
+            width = float(ports[port_name].width),
+            orientation = float(ports[port_name].orientation),
+            span = float(planes[port_name]['span']),
+            z = float(planes[port_name]['z']),
+            z_span = float(planes[port_name]['z_span']),
+        ) for port_name in ports),
+        domain = tuple(float(v) for v in (solver_x_min, solver_y_min, solver_z_min, solver_x_max, solver_y_max, solver_z_max)),
+        band = BandSpec(wavelength=p['wavelength'], wav_span=p['wav_span'], wav_step=p['wav_step']),
+        mesh = MeshSpec(resolution=p['resolution'], overrides=overrides),
+        mode_num = int(mode_num),
+        mode_idx = convert_mode_index(int(p['mode_idx']), solver, 'tidy3d'),
+        material_type = p['material_type'],
+        guiding_material = p['guiding_material'],
+        cladding_index = 2.0 if p['change_cladding'] else None,
+    )
+
+    SPECS[key] = spec
+    if cache_file:
+        os.makedirs(spec_cache, exist_ok=True)
+        write_to_json(dict_name=spec.to_dict(), json_name=cache_file)
+    return spec
@@ -0,0 +1,201 @@
+import numpy as np
+
+from helper_functions.generic.results import output_ports, port_transmission
+
+def query(wavelengths, spectra, targets, axis: int = -1):
+    r""" values of spectra at arbitrary wavelengths, linear interpolation located with searchsorted.
+
+    All spectra sharing the wavelength axis are interpolated at once. Targets outside the band take the edge values.
+
+    Args:
+        wavelengths (ndarray): wavelengths of the spectra, shape (n_wvl,), any order
+        spectra (ndarray): spectra, wavelengths along axis
+        targets (float | ndarray): query wavelengths
+        axis (int, optional): wavelength axis of spectra. Defaults to -1.
+
+    Returns:
+        values (ndarray): spectra with the wavelength axis replaced by the shape of targets
+    """
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    spectra = np.moveaxis(np.asarray(spectra), axis, -1)
+    order = np.argsort(wavelengths)
+    wavelengths, spectra = wavelengths[order], spectra[..., order]
+    targets = np.asarray(targets, dtype=float)
+    if wavelengths.size == 1:
+        values = np.broadcast_to(spectra, spectra.shape[:-1] + targets.shape)
+        return np.moveaxis(values, -1, axis) if targets.ndim == 1 else values
+
+    x = np.clip(targets.ravel(), wavelengths[0], wavelengths[-1])
+    i = np.clip(np.searchsorted(wavelengths, x) - 1, 0, wavelengths.size - 2)
+    t = (x - wavelengths[i])/(wavelengths[i+1] - wavelengths[i])
+    values = spectra[..., i]*(1 - t) + spectra[..., i+1]*t
+    values = values.reshape(spectra.shape[:-1] + targets.shape)
+    return np.moveaxis(values, -1, axis) if targets.ndim == 1 else values
+
+def to_dB(T):
+    r""" power ratio in dB, floored at -120 dB.
+    """
+    return 10*np.log10(np.maximum(T, 1e-12))
+
+def stack_results(results_list, ports: list | None = None, mode_index: int | None = 0, wavelengths=None):
+    r""" transmission of every run and output port of a sweep, as one array on a common wavelength grid.
+
+    Args:
+        results_list (list): results of the runs (Lumerical-style dicts or Tidy3D SimulationData)
+        ports (list | None, optional): output ports. Defaults to None, those of the first run.
+        mode_index (int | None, optional): output mode, counted from 0, None for the total transmission. Defaults to 0.
+        wavelengths (ndarray, optional): common grid (um). Defaults to None, the wavelengths of the first run.
+
+    Returns:
+        wavelengths (ndarray): wavelengths (um), shape (n_wvl,)
+        T (ndarray): transmission, shape (n_runs, n_ports, n_wvl)
+        ports (list): port names
+    """
+    if ports is None:
+        ports = output_ports(results_list[0])
+    T = []
+    for results in results_list:
+        spectra = [port_transmission(results, port, mode_index=mode_index) for port in ports]
+        if wavelengths is None:
+            wavelengths = spectra[0][0]
+        T.append([query(w, values, wavelengths) for w, values in spectra])
+    return np.asarray(wavelengths), np.asarray(T), ports
+
+def peak(wavelengths, T):
+    r""" peak of each spectrum, refined with a parabola through the three highest samples (in dB).
+
+    Args:
+        wavelengths (ndarray): wavelengths, shape (n_wvl,), ascending
+        T (ndarray): spectra, shape (..., n_wvl)
+
+    Returns:
+        peak (ndarray): peak transmission, shape (...)
+        peak_wavelength (ndarray): shape (...)
+    """
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    y = to_dB(np.asarray(T, dtype=float))
+    i = np.argmax(y, axis=-1)
+    if wavelengths.size < 3:
+        return 10**(np.max(y, axis=-1)/10), wavelengths[i]
+
+    j = np.clip(i, 1, wavelengths.size - 2)
+    y0, y1, y2 = [np.take_along_axis(y, (j + k)[..., None], axis=-1)[..., 0] for k in (-1, 0, 1)]
+    curvature = y0 - 2*y1 + y2
+    shift = np.where((i == j) & (curvature < 0), 0.5*(y0 - y2)/np.where(curvature < 0, curvature, -1), 0.0)
+    step = 0.5*(wavelengths[j+1] - wavelengths[j-1])
+    peak = np.where(i == j, y1 - 0.25*(y0 - y2)*shift, np.max(y, axis=-1))
+    return 10**(peak/10), np.where(i == j, wavelengths[j] + shift*step, wavelengths[i])
+
+def bandwidth(wavelengths, T, level: float = -3.0):
+    r""" band around the peak of each spectrum where the transmission stays within level dB of the peak.
+
+    The edges are interpolated between the samples, a band reaching the end of the sweep is cut there.
+
+    Args:
+        wavelengths (ndarray): wavelengths, shape (n_wvl,), ascending
+        T (ndarray): spectra, shape (..., n_wvl)
+        level (float, optional): level below the peak (dB). Defaults to -3.0.
+
+    Returns:
+        bandwidth (ndarray): shape (...)
+        center (ndarray): center wavelength of the band, shape (...)
+        edges (ndarray): lower and upper edge, shape (..., 2)
+    """
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    y = to_dB(np.asarray(T, dtype=float))
+    n = wavelengths.size
+    i_peak = np.argmax(y, axis=-1)[..., None]
+    threshold = np.max(y, axis=-1, keepdims=True) + level
+    below = y < threshold
+    index = np.arange(n)
+
+    # last sample below the threshold before the peak, first one after it
+    left = np.max(np.where(below & (index < i_peak), index, -1), axis=-1)
+    right = np.min(np.where(below & (index > i_peak), index, n), axis=-1)
+    threshold = threshold[..., 0]
+
+    def crossing(i0, i1, default):
+        i0c, i1c = np.clip(i0, 0, n - 1), np.clip(i1, 0, n - 1)
+        y0 = np.take_along_axis(y, i0c[..., None], axis=-1)[..., 0]
+        y1 = np.take_along_axis(y, i1c[..., None], axis=-1)[..., 0]
+        t = np.where(y1 != y0, (threshold - y0)/np.where(y1 != y0, y1 - y0, 1), 0.0)
+        edge = wavelengths[i0c] + t*(wavelengths[i1c] - wavelengths[i0c])
+        return np.where((i0 < 0) | (i1 >= n), default, edge)
+
+    lower = crossing(left, left + 1, wavelengths[0])
+    upper = crossing(right - 1, right, wavelengths[-1])
+    return upper - lower, 0.5*(upper + lower), np.stack([lower, upper], axis=-1)
+
+def insertion_loss(T):
+    r""" insertion loss (dB), from the power summed over the output ports.
+
+    Args:
+        T (ndarray): transmission, shape (..., n_ports, n_wvl)
+
+    Returns:
+        IL (ndarray): shape (..., n_wvl)
+    """
+    return -to_dB(np.sum(T, axis=-2))
+
+def imbalance(T):
+    r""" imbalance between the output ports (dB), strongest over weakest.
+
+    Args:
+        T (ndarray): transmission, shape (..., n_ports, n_wvl)
+
+    Returns:
+        imbalance (ndarray): shape (..., n_wvl)
+    """
+    y = to_dB(T)
+    return np.max(y, axis=-2) - np.min(y, axis=-2)
+
+def crosstalk(T, signal, leak):
+    r""" crosstalk (dB), power of the leak ports relative to the signal ports.
+
+    Args:
+        T (ndarray): transmission, shape (..., n_ports, n_wvl)
+        signal (int | list): index of the signal ports along the port axis
+        leak (int | list): index of the leak ports
+
+    Returns:
+        crosstalk (ndarray): shape (..., n_wvl)
+    """
+    signal = np.sum(np.take(T, np.atleast_1d(signal), axis=-2), axis=-2)
+    leak = np.sum(np.take(T, np.atleast_1d(leak), axis=-2), axis=-2)
+    return to_dB(leak) - to_dB(signal)
+
+def figures_of_merit(wavelengths, T, reference: float | None = None, signal=None, leak=None):
+    r""" standard figures of a stacked sweep, all runs at once.
+
+    Args:
+        wavelengths (ndarray): wavelengths (um), shape (n_wvl,)
+        T (ndarray): transmission, shape (..., n_ports, n_wvl), e.g. from stack_results
+        reference (float | None, optional): wavelength of the single-value figures (um). Defaults to None, the center of the sweep.
+        signal (int | list, optional): signal ports for the crosstalk. Defaults to None, no crosstalk.
+        leak (int | list, optional): leak ports for the crosstalk.
+
+    Returns:
+        figures (dict): name -> array of shape (...): 'IL' and 'imbalance' (dB) at the reference wavelength,
+            'IL max' over the sweep, 'peak' and 'peak wavelength', '1 dB bandwidth', '3 dB bandwidth'
+            and 'center wavelength' of the total transmission, and 'crosstalk' (dB) if requested
+    """
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    order = np.argsort(wavelengths)
+    wavelengths, T = wavelengths[order], np.asarray(T, dtype=float)[..., order]
+    if reference is None:
+        reference = 0.5*(wavelengths[0] + wavelengths[-1])
+
+    IL = insertion_loss(T)
+    total = np.sum(T, axis=-2)
+    figures = {
+        'IL': query(wavelengths, IL, reference),
+        'IL max': np.max(IL, axis=-1),
+    }
+    if T.shape[-2] > 1:
+        figures['imbalance'] = query(wavelengths, imbalance(T), reference)
+    figures['peak'], figures['peak wavelength'] = peak(wavelengths, total)
+    figures['1 dB bandwidth'] = bandwidth(wavelengths, total, level=-1.0)[0]
+    figures['3 dB bandwidth'], figures['center wavelength'], _ = bandwidth(wavelengths, total, level=-3.0)
+    if signal is not None and leak is not None:
+        figures['crosstalk'] = query(wavelengths, crosstalk(T, signal, leak), reference)
+    return figures
@@ -0,0 +1,321 @@
+from datetime import datetime
+import os
+import sys
+import json
+import importlib
+import subprocess
+import numpy as np
+
+from helper_functions.generic.misc import write_to_json
+from helper_functions.generic.results import output_ports, port_transmission, mode_count
+
+# speed of light (um/s)
+C_0 = 299792458.0e6
+
+def estimate_cost(wav_start, wav_stop, n_freq, run_time, dft_weight: float = 0.01):
+    r""" relative cost of an FDTD run over a band, cells times time steps.
+
+    The mesh step and the time step scale with the shortest wavelength, so the cell count scales
+    as 1/wav_start^3 and the step count as the run time over wav_start. The Gaussian pulse of
+    the band lasts about 10/(2 pi fwidth), which grows as the band narrows. Each frequency point
+    adds the running Fourier transform of the monitors, a fraction dft_weight of a time step.
+
+    Args:
+        wav_start (float): shortest wavelength (um)
+        wav_stop (float): longest wavelength (um)
+        n_freq (int): number of frequency points
+        run_time (float): propagation time through the device (s)
+        dft_weight (float, optional): cost of one frequency point, relative to a time step. Defaults to 0.01.
+
+    Returns:
+        cost (float): relative cost, only meaningful in comparisons
+    """
+    fwidth = C_0/wav_start - C_0/wav_stop
+    pulse_time = 10.0/(2*np.pi*fwidth)
+    cells = 1.0/wav_start**3
+    steps = (run_time + pulse_time)*C_0/wav_start
+    return cells*steps*(1.0 + dft_weight*n_freq)
+
+def split_band(wavelengths, num_bands, overlap_points: int = 2):
+    r""" split a wavelength grid into sub-bands sharing overlap_points points with their neighbours.
+
+    Args:
+        wavelengths (array): global wavelength grid (um), ascending
+        num_bands (int): number of sub-bands
+        overlap_points (int, optional): points shared by consecutive bands. Defaults to 2.
+
+    Returns:
+        bands (list): (first, last) indices in the global grid, inclusive
+    """
+    num = len(wavelengths)
+    edges = np.round(np.linspace(0, num - 1, num_bands + 1)).astype(int)
+    bands = []
+    for i in range(num_bands):
+        first = edges[i] - (overlap_points - 1)//2 if i > 0 else 0
+        last = edges[i+1] + overlap_points//2 if i < num_bands - 1 else num - 1
+        bands.append((max(first, 0), min(last, num - 1)))
+    return bands
+
+def plan_subbands(wavelength, wav_span, wav_step, run_time,
+                  workers: int = 4,
+                  max_bands: int = 8,
+                  overlap_points: int = 2,
+                  overhead: float = 0.05,
+                  dft_weight: float = 0.01):
+    r""" choose between one broadband run and parallel sub-bands, from the estimated cost.
+
+    The wall time of n bands is the cost of the most expensive band times the number of rounds
+    (n over the number of workers), plus a fixed overhead per run (setup, upload, mode solves),
+    given as a fraction of the broadband cost.
+
+    Args:
+        wavelength (float): center wavelength (um)
+        wav_span (float): wavelength span (um)
+        wav_step (float): wavelength step (um)
+        run_time (float): propagation time through the device (s)
+        workers (int, optional): runs in parallel. Defaults to 4.
+        max_bands (int, optional): largest number of sub-bands. Defaults to 8.
+        overlap_points (int, optional): wavelength points shared by consecutive bands. Defaults to 2.
+        overhead (float, optional): fixed cost per run, relative to the broadband run. Defaults to 0.05.
+        dft_weight (float, optional): cost of one frequency point, relative to a time step. Defaults to 0.01.
+
+    Returns:
+        plan (dict): 'bands' list of dicts with 'wavelength', 'wav_span', 'wav_step', 'cost',
+            and the estimated 'wall' and 'total' cost relative to the broadband run
+    """
+    wavelengths = np.linspace(wavelength - 0.5*wav_span, wavelength + 0.5*wav_span, round(wav_span/wav_step)+1)
+    broadband = estimate_cost(wavelengths[0], wavelengths[-1], wavelengths.size, run_time, dft_weight)
+
+    best = None
+    max_bands = min(max_bands, (wavelengths.size - 1)//overlap_points)
+    for num_bands in range(1, max(max_bands, 1) + 1):
+        bands = []
+        for first, last in split_band(wavelengths, num_bands, overlap_points):
+            cost = estimate_cost(wavelengths[first], wavelengths[last], last - first + 1, run_time, dft_weight)/broadband
+            bands.append(dict(
+                wavelength = 0.5*(wavelengths[first] + wavelengths[last]),
+                wav_span = wavelengths[last] - wavelengths[first],
+                wav_step = wav_step,
+                cost = cost,
+            ))
+        costs = [band['cost'] for band in bands]
+        rounds = int(np.ceil(num_bands/workers))
+        wall = max(costs)*rounds + overhead*num_bands
+        if best is None or wall < best['wall']:
+            best = dict(bands=bands, wall=wall, total=sum(costs) + overhead*num_bands)
+
+    return best
+
+def results_to_spectra(results):
+    r""" transmission spectra of every port, in the same form for all solvers.
+
+    Args:
+        results: Lumerical-style results dict (Lumerical, fdtd2d) or Tidy3D SimulationData
+
+    Returns:
+        spectra (dict): port name -> dict with 'wavelengths' (um), 'T' (total) and 'T_net' (n_wvl, mode_num)
+    """
+    spectra = {}
+    for port_name in output_ports(results, input_port=None):
+        wavelengths, T = port_transmission(results, port_name, mode_index=None)
+        T_net = np.column_stack([port_transmission(results, port_name, mode_index=m)[1]
+                                 for m in range(mode_count(results, port_name))])
+        spectra[port_name] = dict(wavelengths=wavelengths, T=T, T_net=T_net)
+    return spectra
+
+def run_band(solver, parameters):
+    r""" run one band with the simulate_predefined_gds function of a solver, and save its spectra.
+
+    Args:
+        solver (str): 'lumerical', 'tidy3d' or 'fdtd2d'
+        parameters (dict): simulation parameters of the band
+
+    Returns:
+        spectra (dict): result of results_to_spectra, also saved to file_name+'_spectra.json'
+    """
+    simulate = importlib.import_module('helper_functions.'+solver+'.simulate_device').simulate_predefined_gds
+    results = simulate(parameters=parameters)
+    if results is None:
+        raise Exception(f"No results returned for band {parameters['file_name']}.")
+    spectra = results_to_spectra(results)
+    write_to_json(dict_name=spectra, json_name=parameters['file_name']+'_spectra.json')
+    return spectra
+
+def stitch_spectra(band_spectra, wavelengths, overlap_tolerance: float = 0.02):
+    r""" stitch per-band spectra into one spectrum on the global wavelength grid.
+
+    In the overlap of two bands, both spectra are compared, then blended with linear weights,
+    so that the stitched spectrum has no step at the band edges.
+
+    Args:
+        band_spectra (list): results of results_to_spectra, one per band, in ascending wavelength
+        wavelengths (array): global wavelength grid (um)
+        overlap_tolerance (float, optional): largest accepted difference of the transmissions in an overlap. Defaults to 0.02.
+
+    Returns:
+        spectra (dict): port name -> dict with 'wavelengths', 'T' and 'T_net' on the global grid
+        mismatch (list): largest difference in each overlap
+    """
+    wavelengths = np.asarray(wavelengths)
+    ports = band_spectra[0].keys()
+    spectra = {}
+    mismatch = [0.0]*(len(band_spectra) - 1)
+    for port_name in ports:
+        spectra[port_name] = {}
+        for key in ['T', 'T_net']:
+            total = 0.0
+            weight_sum = np.zeros(wavelengths.size)
+            resampled = []
+            for band in band_spectra:
+                lam = np.asarray(band[port_name]['wavelengths'])
+                values = np.asarray(band[port_name][key]).reshape(lam.size, -1)
+                inside = (wavelengths >= lam.min() - 1e-9) & (wavelengths <= lam.max() + 1e-9)
+                data = np.column_stack([np.interp(wavelengths, lam, values[:, m]) for m in range(values.shape[1])])
+                resampled.append((inside, data))
+
+            for i, (inside, data) in enumerate(resampled):
+                # triangular weight: 1 inside the band, falling to 0 across each overlap
+                weight = inside.astype(float)
+                if i > 0:
+                    overlap = inside & resampled[i-1][0]
+                    if overlap.sum() > 1:
+                        weight[overlap] = np.linspace(0.0, 1.0, overlap.sum())
+                    if overlap.any():
+                        diff = np.abs(data[overlap] - resampled[i-1][1][overlap]).max()
+                        mismatch[i-1] = max(mismatch[i-1], float(diff))
+                if i < len(resampled) - 1:
+                    overlap = inside & resampled[i+1][0]
+                    if overlap.sum() > 1:
+                        weight[overlap] = np.linspace(1.0, 0.0, overlap.sum())
+                total = total + weight[:, None]*data
+                weight_sum += weight
+
+            stitched = total/np.maximum(weight_sum, 1e-12)[:, None]
+            spectra[port_name][key] = stitched[:, 0] if key == 'T' else stitched
+        spectra[port_name]['wavelengths'] = wavelengths
+
+    for i, diff in enumerate(mismatch):
+        if diff > overlap_tolerance:
+            print(f'\033[1;91mAttention: bands {i} and {i+1} differ by {diff:.3f} in their overlap.\033[0m')
+    return spectra, mismatch
+
+def run_workers(module, solver, run_parameters, workers: int = 4, suffix: str = '_run.json'):
+    r""" run simulations as separate processes, at most 'workers' at a time.
+
+    Separate processes rather than a process pool: the builders keep their settings in module globals,
+    and the project scripts have no main guard to be re-imported by spawned workers.
+    Each process runs 'python -m <module> <solver> <parameters JSON>', the JSON is saved to file_name+suffix.
+
+    Args:
+        module (str): worker module, e.g. 'helper_functions.generic.subband'
+        solver (str): 'lumerical', 'tidy3d' or 'fdtd2d'
+        run_parameters (list): simulation parameters of each run
+        workers (int, optional): runs in parallel. Defaults to 4.
+        suffix (str, optional): suffix of the parameter files. Defaults to '_run.json'.
+    """
+    pending = list(range(len(run_parameters)))
+    running = {}
+    while pending or running:
+        while pending and len(running) < workers:
+            i = pending.pop(0)
+            write_to_json(dict_name=run_parameters[i], json_name=run_parameters[i]['file_name']+suffix)
+            running[i] = subprocess.Popen([sys.executable, '-m', module, solver, run_parameters[i]['file_name']+suffix])
+        for i, process in list(running.items()):
+            if process.poll() is not None:
+                del running[i]
+                if process.returncode != 0:
+                    raise Exception(f"Run {run_parameters[i]['file_name']} failed with exit code {process.returncode}.")
+        if running:
+            try:
+                next(iter(running.values())).wait(timeout=1.0)
+            except subprocess.TimeoutExpired:
+                pass
+
+def simulate_broadband(solver, parameters,
+                       workers: int = 4,
+                       max_bands: int = 8,
+                       overlap_points: int = 2,
+                       overhead: float = 0.05,
+                       overlap_tolerance: float = 0.02,
+                       run_time_factor: float = 16.0):
+    r""" run a broadband simulation as one band or as parallel sub-bands, whichever is estimated faster.
+
+    Sub-bands run as separate processes (run_workers).
+    The stitched results have the structure of the Lumerical results, and are saved to file_name+'_results.json'.
+
+    Args:
+        solver (str): 'lumerical', 'tidy3d' or 'fdtd2d'
+        parameters (dict): simulation parameters, as for simulate_predefined_gds
+        workers (int, optional): sub-bands run in parallel. Defaults to 4.
+        max_bands (int, optional): largest number of sub-bands. Defaults to 8.
+        overlap_points (int, optional): wavelength points shared by consecutive bands. Defaults to 2.
+        overhead (float, optional): fixed cost per run, relative to the broadband run. Defaults to 0.05.
+        overlap_tolerance (float, optional): largest accepted difference in an overlap. Defaults to 0.02.
+        run_time_factor (float, optional): simulated time in units of the round trip through the device. Defaults to 16.0.
+
+    Returns:
+        results (dict): stitched results, with the sub-band plan under 'subbands'
+    """
+    import gdsfactory as gf
+
+    # same precedence as simulate_predefined_gds: defaults, config.json, then parameters
+    p = dict(wavelength=1.55, wav_span=0.05, wav_step=0.01, extension=10)
+    if os.path.exists('config.json'):
+        with open('config.json') as f:
+            p.update(json.load(f))
+    p.update(parameters)
+
+    if p.get('parametric'):
+        from helper_functions.generic.parametric import parametric_component
+        device = parametric_component(p['parametric'])
+    else:
+        device = gf.import_gds(p['predefined_gds'])
+    run_time = run_time_factor*2.0*(device.xsize + 2*p['extension'])/C_0
+
+    plan = plan_subbands(p['wavelength'], p['wav_span'], p['wav_step'], run_time,
+                         workers=workers, max_bands=max_bands, overlap_points=overlap_points, overhead=overhead)
+    bands = plan['bands']
+    print(f"{len(bands)} band(s), estimated wall time {plan['wall']:.2f} and total cost {plan['total']:.2f} of the broadband run.")
+
+    start_time = datetime.now()
+    band_parameters = []
+    for i, band in enumerate(bands):
+        q = dict(parameters)
+        q.update(wavelength=band['wavelength'], wav_span=band['wav_span'], wav_step=band['wav_step'])
+        if len(bands) > 1:
+            q['file_name'] = parameters['file_name']+f'_band{i}'
+            if 'task_name' in q:
+                q['task_name'] = q['task_name']+f'_band{i}'
+        band_parameters.append(q)
+
+    if len(bands) == 1:
+        band_spectra = [run_band(solver, band_parameters[0])]
+    else:
+        run_workers('helper_functions.generic.subband', solver, band_parameters, workers=workers, suffix='_band.json')
+        band_spectra = []
+        for q in band_parameters:
+            with open(q['file_name']+'_spectra.json') as f:
+                band_spectra.append(json.load(f))
+
+    wavelengths = np.linspace(p['wavelength'] - 0.5*p['wav_span'], p['wavelength'] + 0.5*p['wav_span'], round(p['wav_span']/p['wav_step'])+1)
+    spectra, mismatch = stitch_spectra(band_spectra, wavelengths, overlap_tolerance=overlap_tolerance)
+
+    results = {}
+    results['time(s)'] = (datetime.now() - start_time).seconds
+    lam = (wavelengths*1e-6)[:, None]  # m, column vector as returned by Lumerical
+    for port_name, spectrum in spectra.items():
+        results[port_name+' T'] = {'lambda': lam, 'T': spectrum['T']}
+        results[port_name+' T_net'] = {'lambda': lam, 'T_net': spectrum['T_net']}
+    results['subbands'] = dict(bands=bands, mismatch=mismatch)
+
+    write_to_json(dict_name=results, json_name=parameters['file_name']+'_results.json')
+    return results
+
+if __name__ == '__main__':
+    # worker of simulate_broadband: python -m helper_functions.generic.subband <solver> <band parameters JSON>
+    sys.path.append(os.getcwd())
+    from gds_library import pdk_universal
+    pdk_universal.activate()
+    with open(sys.argv[2]) as f:
+        band_parameters = json.load(f)
+    run_band(sys.argv[1], band_parameters)
@@ -0,0 +1,136 @@
+import time
+import numpy as np
+
+from helper_functions.generic.misc import write_to_json
+
+# settings tried in turn when a run diverges, in the boundaries of each solver
+RECOVERY = dict(
+    lumerical = [dict(pml_profile='stabilized'), dict(pml_profile='stabilized', pml_layers=128)],
+    tidy3d = [dict(boundary='stable_pml'), dict(boundary='absorber', pml_layers=80)],
+)
+
+class DivergenceError(Exception):
+    r""" a run stopped because its energy grew, with the telemetry report.
+    """
+    def __init__(self, report):
+        super().__init__(f"{report.get('name', 'The run')} diverged at {100*(report.get('progress') or 0):.0f}%: {report.get('reason')}")
+        self.report = report
+
+def detect_divergence(values, growth: float = 100.0, window: int = 5):
+    r""" exponential growth of an energy series: rising over the last window samples, and growth times above its minimum.
+
+    Args:
+        values (list): field energy or decay samples, positive, oldest first
+        growth (float, optional): rise above the minimum so far. Defaults to 100.
+        window (int, optional): consecutive rising samples. Defaults to 5.
+
+    Returns:
+        diverged (bool)
+    """
+    values = np.asarray([v for v in values if v is not None and v > 0], dtype=float)
+    if len(values) < window:
+        return False
+    rising = np.all(np.diff(np.log(values[-window:])) > 0)
+    return bool(rising and values[-1] >= growth*values.min())
+
+def eta(elapsed, progress):
+    r""" remaining time (s) at a constant rate, None before any progress.
+    """
+    if not progress or progress <= 0:
+        return None
+    return elapsed*(1.0 - progress)/progress
+
+def format_duration(seconds):
+    if seconds is None:
+        return '--:--:--'
+    seconds = int(round(seconds))
+    return f'{seconds//3600:02d}:{seconds%3600//60:02d}:{seconds%60:02d}'
+
+def watch(poll, abort, name: str = 'run',
+          interval: float = 10.0,
+          growth: float = 100.0,
+          window: int = 5,
+          json_name: str | None = None,
+          on_progress = None):
+    r""" poll a running job until it ends, printing progress and ETA, and abort it when its energy grows.
+
+    Args:
+        poll (function): () -> dict with 'state' ('queued', 'running', 'finished', 'diverged' or 'error'),
+            'progress' (0 to 1, or None) and 'energy' (field energy or decay, or None)
+        abort (function): stops the job
+        name (str, optional): name in the printed lines. Defaults to 'run'.
+        interval (float, optional): seconds between polls. Defaults to 10.
+        growth (float, optional): see detect_divergence. Defaults to 100.
+        window (int, optional): see detect_divergence. Defaults to 5.
+        json_name (str | None, optional): save the report after every poll. Defaults to None.
+        on_progress (function | None, optional): called with the report after every poll. Defaults to None.
+
+    Returns:
+        report (dict): 'state' ('finished', 'diverged' or 'error'), 'reason', 'progress' and the polled 'history'
+    """
+    start = time.time()
+    report = dict(name=name, state='queued', reason=None, progress=None, eta=None, history=[])
+    started = None
+    while True:
+        sample = poll()
+        now = time.time()
+        if sample['state'] == 'running' and started is None:
+            started = now
+        report['history'].append(dict(time=now - start, **sample))
+        report.update(state=sample['state'], progress=sample.get('progress'))
+        report['eta'] = eta(now - started, report['progress']) if started is not None else None
+
+        energies = [h.get('energy') for h in report['history']]
+        if sample['state'] == 'running' and detect_divergence(energies, growth=growth, window=window):
+            abort()
+            report.update(state='diverged', reason=f'energy grew {energies[-1]/min(e for e in energies if e):.3g} times over its minimum')
+        elif sample['state'] == 'diverged':
+            report['reason'] = report['reason'] or 'reported by the solver'
+
+        energy = sample.get('energy')
+        print(f"{name}: {sample['state']:9s} {100*(report['progress'] or 0):5.1f}%  "
+              f"energy {energy if energy is not None else float('nan'):.2e}  ETA {format_duration(report['eta'])}")
+        if on_progress is not None:
+            on_progress(report)
+        if json_name is not None:
+            write_to_json(dict_name=report, json_name=json_name)
+        if report['state'] in ('finished', 'diverged', 'error'):
+            return report
+        time.sleep(interval)
+
+def next_recovery(solver, parameters):
+    r""" parameters of the next retry of a diverged run, None when every recovery was tried.
+
+    The retry writes to <file_name>_r<N> under task <task_name>_r<N>, so it never meets the
+    output files, or the overwrite prompt, of the diverged run.
+    """
+    step = parameters.get('recovery', 0)
+    ladder = RECOVERY.get(solver, [])
+    if step >= len(ladder):
+        return None
+    q = dict(parameters, recovery=step+1, **ladder[step])
+    for key in ['file_name', 'task_name']:
+        if key in q:
+            name = q[key][:-len(f'_r{step}')] if step and q[key].endswith(f'_r{step}') else q[key]
+            q[key] = name+f'_r{step+1}'
+    return q
+
+def simulate_with_recovery(simulate, parameters, solver):
+    r""" run a simulation with telemetry, retrying a diverged run with the boundaries of RECOVERY.
+
+    Example:
+        simulate_with_recovery(simulate_predefined_gds, dict(p, flag_monitor=1), 'lumerical')
+
+    Returns:
+        results: of the first run that did not diverge
+    """
+    p = dict(parameters, flag_monitor=1)
+    while True:
+        try:
+            return simulate(parameters=p)
+        except DivergenceError as error:
+            q = next_recovery(solver, p)
+            if q is None:
+                raise
+            print(f"{error} Retrying with {RECOVERY[solver][q['recovery']-1]}.")
+            p = q
@@ -0,0 +1,190 @@
+import numpy as np
+from scipy.stats import norm, qmc
+
+from helper_functions.generic.misc import write_to_json
+from helper_functions.generic.results import port_transmission
+from helper_functions.generic.spectral import query
+
+# 1-sigma fabrication variations: width bias (um, total), sidewall angle (degrees from vertical), layer thickness (um)
+SIGMA = dict(width_bias=0.01, sidewall_angle=2.0, thickness=0.005)
+
+def sample_variations(num_samples: int, sigma: dict | None = None, seed: int = 0):
+    r""" normally distributed fabrication variations, by Latin hypercube sampling.
+
+    Args:
+        num_samples (int): samples
+        sigma (dict | None, optional): variation name -> standard deviation. Defaults to None, SIGMA.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        samples (list): variation name -> offset from the nominal process, per sample
+    """
+    sigma = SIGMA if sigma is None else sigma
+    names = list(sigma)
+    u = qmc.LatinHypercube(d=len(names), seed=seed).random(num_samples)
+    z = norm.ppf(u)
+    return [{name: float(z[k, i]*sigma[name]) for i, name in enumerate(names)} for k in range(num_samples)]
+
+def transmission_metrics(ports = ('o2',), wavelength: float | None = None):
+    r""" metrics of a device: transmission of each output port (dB) at one wavelength.
+
+    Args:
+        ports (tuple, optional): output ports. Defaults to ('o2',).
+        wavelength (float | None, optional): wavelength (um). Defaults to None, the center of the run.
+
+    Returns:
+        metrics (function): results -> dict of port name -> transmission (dB)
+    """
+    def metrics(results):
+        values = {}
+        for port in ports:
+            w, T = port_transmission(results, port, mode_index=0)
+            T = query(w, T, 0.5*(w.min() + w.max()) if wavelength is None else wavelength)
+            values[port] = float(10*np.log10(max(T, 1e-12)))
+        return values
+    return metrics
+
+def finite_differences(nominal, perturbed, sigma):
+    r""" first-order sensitivities from one run per variation, each offset by its sigma.
+
+    Args:
+        nominal (dict): metric name -> value of the nominal run
+        perturbed (dict): variation name -> metrics of the run with that variation at +sigma
+        sigma (dict): variation name -> standard deviation
+
+    Returns:
+        gradients (dict): metric name -> variation name -> derivative
+    """
+    return {metric: {name: (perturbed[name][metric] - nominal[metric])/sigma[name] for name in sigma}
+            for metric in nominal}
+
+def first_order(nominal, gradients, samples):
+    r""" linear estimate of the metrics of every sample.
+
+    Returns:
+        predicted (dict): metric name -> ndarray over the samples
+    """
+    return {metric: np.array([nominal[metric] + sum(gradients[metric][name]*sample[name] for name in sample)
+                              for sample in samples]) for metric in nominal}
+
+def passes(values, limits):
+    r""" samples with every metric within its limits.
+
+    Args:
+        values (dict): metric name -> ndarray over the samples
+        limits (dict): metric name -> (lower, upper), None for no limit
+
+    Returns:
+        mask (ndarray)
+    """
+    mask = np.ones(len(next(iter(values.values()))), dtype=bool)
+    for metric, (lower, upper) in limits.items():
+        if lower is not None:
+            mask &= values[metric] >= lower
+        if upper is not None:
+            mask &= values[metric] <= upper
+    return mask
+
+def screen(predicted, limits, margins):
+    r""" samples whose first-order estimate is too close to a limit to be trusted.
+
+    Returns:
+        mask (ndarray): samples that need a full run
+    """
+    mask = np.zeros(len(next(iter(predicted.values()))), dtype=bool)
+    for metric, (lower, upper) in limits.items():
+        for limit in [lower, upper]:
+            if limit is not None:
+                mask |= np.abs(predicted[metric] - limit) <= margins[metric]
+    return mask
+
+def yield_statistics(values, limits, gradients, sigma):
+    r""" yield, spread of every metric and share of its variance from each variation.
+
+    Returns:
+        statistics (dict)
+    """
+    statistics = dict(yield_fraction=float(np.mean(passes(values, limits))), metrics={})
+    for metric, v in values.items():
+        contributions = {name: (gradients[metric][name]*sigma[name])**2 for name in sigma}
+        total = sum(contributions.values())
+        statistics['metrics'][metric] = dict(
+            mean = float(np.mean(v)),
+            std = float(np.std(v)),
+            percentiles = {str(q): float(np.percentile(v, q)) for q in [1, 5, 50, 95, 99]},
+            sensitivity = gradients[metric],
+            variance_share = {name: float(c/total) if total > 0 else 0.0 for name, c in contributions.items()},
+        )
+    return statistics
+
+def variability_analysis(evaluate, metrics, limits,
+                         num_samples: int = 200,
+                         sigma: dict | None = None,
+                         margins: dict | None = None,
+                         seed: int = 0,
+                         file_name: str | None = None):
+    r""" Monte Carlo yield of a device under fabrication variations, with as few full runs as possible.
+
+    The nominal process and one +sigma offset per variation are run first, as one batch. Their finite
+    differences give a first-order estimate of every sample, and only the samples estimated within a
+    margin of a limit are run in full, as a second batch. The others are classified by the estimate.
+
+    Example:
+        variability_analysis(evaluate, transmission_metrics(ports=('o2',)), limits=dict(o2=(-1.0, None)))
+
+    Args:
+        evaluate (function): list of variation dicts -> list of results, run as one batch
+        metrics (function): results -> dict of metric name -> value
+        limits (dict): metric name -> (lower, upper), None for no limit
+        num_samples (int, optional): Monte Carlo samples. Defaults to 200.
+        sigma (dict | None, optional): variation name -> standard deviation. Defaults to None, SIGMA.
+        margins (dict | None, optional): metric name -> distance to a limit below which a sample is run in full.
+            Defaults to None, half the first-order standard deviation of the metric.
+        seed (int, optional): random seed. Defaults to 0.
+        file_name (str | None, optional): save the report to file_name+'_variability.json'. Defaults to None.
+
+    Returns:
+        report (dict): samples, values, which samples were run, yield and statistics
+    """
+    sigma = SIGMA if sigma is None else sigma
+    names = list(sigma)
+
+    # nominal and one-at-a-time runs
+    offsets = [{name: 0.0 for name in names}] + [{name: (sigma[name] if name == varied else 0.0) for name in names}
+                                                  for varied in names]
+    reference = [metrics(results) for results in evaluate(offsets)]
+    nominal = reference[0]
+    gradients = finite_differences(nominal, dict(zip(names, reference[1:])), sigma)
+
+    # screen the samples by their first-order estimate
+    samples = sample_variations(num_samples, sigma=sigma, seed=seed)
+    predicted = first_order(nominal, gradients, samples)
+    if margins is None:
+        margins = {metric: 0.5*np.sqrt(sum((gradients[metric][name]*sigma[name])**2 for name in names))
+                   for metric in nominal}
+    needs_run = screen(predicted, limits, margins)
+    print(f'{int(needs_run.sum())} of {num_samples} samples need a full run.')
+
+    values = {metric: predicted[metric].copy() for metric in nominal}
+    index = np.flatnonzero(needs_run)
+    if len(index):
+        for k, results in zip(index, evaluate([samples[k] for k in index])):
+            for metric, value in metrics(results).items():
+                values[metric][k] = value
+
+    statistics = yield_statistics(values, limits, gradients, sigma)
+    print(f"Yield {100*statistics['yield_fraction']:.1f}% over {num_samples} samples, "
+          f"{len(offsets) + len(index)} full runs.")
+
+    report = dict(statistics,
+                  nominal = nominal,
+                  limits = limits,
+                  sigma = sigma,
+                  margins = {metric: float(m) for metric, m in margins.items()},
+                  samples = samples,
+                  values = {metric: v.tolist() for metric, v in values.items()},
+                  full_run = needs_run.tolist(),
+                  num_runs = len(offsets) + len(index))
+    if file_name is not None:
+        write_to_json(dict_name=report, json_name=file_name+'_variability.json')
+    return report
@@ -0,0 +1,397 @@
+from datetime import datetime
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import hashlib
+import argparse
+import importlib
+import itertools
+import threading
+import traceback
+import numpy as np
+
+from helper_functions.generic.misc import write_to_json
+from helper_functions.generic.telemetry import DivergenceError, next_recovery
+
+# job states, one directory each in the queue directory
+STATES = ('pending', 'claimed', 'done', 'failed')
+
+def init_queue(queue_dir):
+    r""" create the directories of a queue, on a filesystem shared by all hosts.
+    """
+    for state in STATES + ('gds',):
+        os.makedirs(os.path.join(queue_dir, state), exist_ok=True)
+
+def _write_atomic(data, json_file):
+    r""" write a JSON file under a temporary name and rename it, readers never see a partial file.
+    """
+    temp_file = json_file+'.'+uuid.uuid4().hex[:8]+'.tmp'
+    write_to_json(dict_name=data, json_name=temp_file)
+    os.replace(temp_file, json_file)
+
+def _read(json_file):
+    with open(json_file) as f:
+        return json.load(f)
+
+def _job_file(queue_dir, state, job_id):
+    return os.path.join(queue_dir, state, job_id+'.json')
+
+def _new_job_id():
+    # sortable by submission time
+    return datetime.now().strftime('%Y%m%d%H%M%S%f')+'_'+uuid.uuid4().hex[:6]
+
+def submit(queue_dir, solver, parameters, device, run_name,
+           data_root: str = os.path.join('projects', 'FDTD_solvers')):
+    r""" add a simulation to a queue.
+
+    The GDS is copied into the queue directory, so that every host reads the same file.
+    The output goes to <data_root>/<device>/Data/<solver>/<run_name>, data_root being resolved on the worker host:
+    point it to the shared filesystem to collect the results of all hosts in one place.
+
+    Args:
+        queue_dir (str): queue directory, on the shared filesystem
+        solver (str): 'lumerical', 'tidy3d', 'fdtd2d' or 'fake'
+        parameters (dict): simulation parameters, as for simulate_predefined_gds
+        device (str): device folder name, e.g. 'mmi2x2'
+        run_name (str): output path below Data/<solver>/, e.g. 'sweep_gap/gap0.2'
+        data_root (str, optional): folder of the device folders. Defaults to 'projects/FDTD_solvers'.
+
+    Returns:
+        job_id (str)
+    """
+    init_queue(queue_dir)
+    parameters = dict(parameters)
+    if parameters.get('predefined_gds'):
+        with open(parameters['predefined_gds'], 'rb') as f:
+            gds_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+        gds_file = os.path.join('gds', gds_hash+'_'+os.path.basename(parameters['predefined_gds']))
+        if not os.path.exists(os.path.join(queue_dir, gds_file)):
+            shutil.copy(parameters['predefined_gds'], os.path.join(queue_dir, gds_file+'.tmp'))
+            yml_file = os.path.splitext(parameters['predefined_gds'])[0]+'.yml'
+            if os.path.exists(yml_file):
+                shutil.copy(yml_file, os.path.join(queue_dir, os.path.splitext(gds_file)[0]+'.yml'))
+            os.replace(os.path.join(queue_dir, gds_file+'.tmp'), os.path.join(queue_dir, gds_file))
+        parameters['predefined_gds'] = gds_file
+
+    job_id = _new_job_id()
+    parameters['file_name'] = os.path.join(data_root, device, 'Data', solver, run_name)
+    if 'task_name' in parameters:
+        parameters['task_name'] = parameters['task_name']+'_'+job_id
+    job = dict(
+        job_id = job_id,
+        solver = solver,
+        device = device,
+        run_name = run_name,
+        parameters = parameters,
+        submitted = datetime.now().isoformat(),
+        attempts = 0,
+    )
+    _write_atomic(job, _job_file(queue_dir, 'pending', job_id))
+    return job_id
+
+def submit_sweep(queue_dir, solver, parameters, device, sweep, run_name: str = 'sweep', **kwargs):
+    r""" add all combinations of swept settings to a queue, one job each.
+
+    Example:
+        submit_sweep('//server/share/queue', 'lumerical', p, 'mmi2x2', dict(resolution=[6, 8, 10]))
+
+    Returns:
+        job_ids (list)
+    """
+    names = list(sweep)
+    job_ids = []
+    for values in itertools.product(*[sweep[name] for name in names]):
+        q = dict(parameters)
+        q.update(zip(names, values))
+        suffix = '_'.join(f'{name}{value}' for name, value in zip(names, values))
+        job_ids.append(submit(queue_dir, solver, q, device, run_name+'/'+suffix, **kwargs))
+    return job_ids
+
+def claim(queue_dir, worker):
+    r""" take the oldest pending job, by an atomic rename: only one worker gets each job.
+
+    Returns:
+        job (dict | None): None if no job is pending
+    """
+    for name in sorted(os.listdir(os.path.join(queue_dir, 'pending'))):
+        if not name.endswith('.json'):
+            continue
+        job_id = name[:-len('.json')]
+        try:
+            # fresh modification time: the claim counts as a heartbeat until the first one is written
+            os.utime(_job_file(queue_dir, 'pending', job_id))
+            os.rename(_job_file(queue_dir, 'pending', job_id), _job_file(queue_dir, 'claimed', job_id))
+        except (FileNotFoundError, PermissionError, FileExistsError):
+            continue # claimed by another worker in the meantime
+        job = _read(_job_file(queue_dir, 'claimed', job_id))
+        job.update(worker=worker, claimed=datetime.now().isoformat(), attempts=job.get('attempts', 0)+1)
+        if job['attempts'] > 1:
+            # reclaimed job: the previous worker may still write its output, or left a project behind
+            file_name = job['parameters']['file_name']
+            suffix = f"_a{job['attempts']-1}"
+            if job['attempts'] > 2 and file_name.endswith(suffix):
+                file_name = file_name[:-len(suffix)]
+            job['parameters']['file_name'] = file_name+f"_a{job['attempts']}"
+        _write_atomic(job, _job_file(queue_dir, 'claimed', job_id))
+        heartbeat(queue_dir, job_id, worker)
+        return job
+    return None
+
+def heartbeat(queue_dir, job_id, worker):
+    r""" mark a claimed job as alive.
+    """
+    _write_atomic(dict(worker=worker, time=time.time()), os.path.join(queue_dir, 'claimed', job_id+'.heartbeat'))
+
+def _last_beat(queue_dir, job_id):
+    try:
+        return _read(os.path.join(queue_dir, 'claimed', job_id+'.heartbeat'))['time']
+    except (FileNotFoundError, ValueError):
+        # claimed but no heartbeat written yet: count from the claim
+        try:
+            return os.path.getmtime(_job_file(queue_dir, 'claimed', job_id))
+        except FileNotFoundError:
+            return time.time()
+
+def reclaim(queue_dir, timeout: float = 300.0, max_attempts: int = 3):
+    r""" return the jobs of dead workers to the queue, their heartbeat older than timeout.
+
+    The timeout must exceed the heartbeat interval plus the clock offsets between the hosts.
+    Jobs already tried max_attempts times are failed instead.
+
+    Returns:
+        job_ids (list): reclaimed jobs
+    """
+    reclaimed = []
+    now = time.time()
+    for name in sorted(os.listdir(os.path.join(queue_dir, 'claimed'))):
+        if not name.endswith('.json'):
+            continue
+        job_id = name[:-len('.json')]
+        if now - _last_beat(queue_dir, job_id) < timeout:
+            continue
+        try:
+            job = _read(_job_file(queue_dir, 'claimed', job_id))
+        except (FileNotFoundError, ValueError):
+            continue
+        state = 'pending' if job.get('attempts', 0) < max_attempts else 'failed'
+        try:
+            os.rename(_job_file(queue_dir, 'claimed', job_id), _job_file(queue_dir, state, job_id))
+        except (FileNotFoundError, PermissionError, FileExistsError):
+            continue # finished or reclaimed by another worker in the meantime
+        if state == 'failed':
+            job['error'] = f"worker {job.get('worker')} stopped sending heartbeats, {job.get('attempts')} attempts"
+            _write_atomic(job, _job_file(queue_dir, state, job_id))
+        _remove(os.path.join(queue_dir, 'claimed', job_id+'.heartbeat'))
+        print(f"Job {job_id} of worker {job.get('worker')} reclaimed: {state}.")
+        reclaimed.append(job_id)
+    return reclaimed
+
+def _remove(file):
+    try:
+        os.remove(file)
+    except FileNotFoundError:
+        pass
+
+def finish(queue_dir, job, state, **info):
+    r""" move a claimed job to 'done' or 'failed', with information on the run.
+
+    Only the worker holding the claim moves the job: a job reclaimed in the meantime, and possibly
+    claimed again by another worker, is left to that worker.
+
+    Returns:
+        moved (bool): False if the job was reclaimed in the meantime, the results are kept anyway
+    """
+    job = dict(job, finished=datetime.now().isoformat(), **info)
+    try:
+        owner = _read(_job_file(queue_dir, 'claimed', job['job_id'])).get('worker')
+    except (FileNotFoundError, ValueError):
+        owner = None
+    if owner != job.get('worker'):
+        print(f"Job {job['job_id']} was reclaimed while running, its results are kept.")
+        return False
+    try:
+        os.rename(_job_file(queue_dir, 'claimed', job['job_id']), _job_file(queue_dir, state, job['job_id']))
+    except FileNotFoundError:
+        print(f"Job {job['job_id']} was reclaimed while running, its results are kept.")
+        return False
+    _write_atomic(job, _job_file(queue_dir, state, job['job_id']))
+    _remove(os.path.join(queue_dir, 'claimed', job['job_id']+'.heartbeat'))
+    return True
+
+def requeue(queue_dir, job):
+    r""" add the retry of a diverged job, with the next boundary settings of RECOVERY.
+
+    Returns:
+        job_id (str | None): None when every recovery was tried
+    """
+    # the fake solver stands in for Lumerical
+    parameters = next_recovery('lumerical' if job['solver'] == 'fake' else job['solver'], job['parameters'])
+    if parameters is None:
+        return None
+    job_id = _new_job_id()
+    _write_atomic(dict(
+        job_id = job_id,
+        solver = job['solver'],
+        device = job['device'],
+        run_name = job['run_name'],
+        parameters = parameters,
+        submitted = datetime.now().isoformat(),
+        attempts = 0,
+        recovered_from = job['job_id'],
+    ), _job_file(queue_dir, 'pending', job_id))
+    return job_id
+
+def fake_simulate(parameters):
+    r""" stand-in solver for testing queues and sweeps without a license: a lossless 1x2 splitter.
+
+    Sleeps fake_duration seconds, raises if fake_fail, diverges until fake_diverge recoveries were tried,
+    and writes Lumerical-style results.
+    """
+    time.sleep(parameters.get('fake_duration', 1.0))
+    if parameters.get('fake_fail'):
+        raise Exception('fake_fail is set.')
+    if parameters.get('fake_diverge', 0) > parameters.get('recovery', 0):
+        raise DivergenceError(dict(name=parameters['file_name'], progress=0.3, reason='fake_diverge is set'))
+
+    wavelengths = np.linspace(parameters['wavelength'] - 0.5*parameters['wav_span'],
+                              parameters['wavelength'] + 0.5*parameters['wav_span'],
+                              round(parameters['wav_span']/parameters['wav_step'])+1)
+    lam = (wavelengths*1e-6)[:, None]
+    T = 0.5*np.cos(np.pi*(wavelengths - parameters['wavelength'])/(4*parameters['wav_span']))**2
+    results = {'time(s)': parameters.get('fake_duration', 1.0)}
+    for port_name, T_port in [('o1', -np.ones_like(T)), ('o2', T), ('o3', T)]:
+        results[port_name+' T'] = {'lambda': lam, 'T': T_port}
+        results[port_name+' T_net'] = {'lambda': lam, 'T_net': np.abs(T_port)[:, None]}
+
+    write_to_json(dict_name=parameters, json_name=parameters['file_name']+'.json')
+    write_to_json(dict_name=results, json_name=parameters['file_name']+'_results.json')
+    return results
+
+def run_job(queue_dir, job, monitor = False):
+    r""" run the simulation of a job on this host, watched by the run telemetry if monitor.
+
+    Returns:
+        results: as returned by simulate_predefined_gds
+    """
+    p = dict(job['parameters'])
+    if p.get('predefined_gds') and not os.path.isabs(p['predefined_gds']):
+        p['predefined_gds'] = os.path.join(queue_dir, p['predefined_gds'])
+    os.makedirs(os.path.dirname(os.path.abspath(p['file_name'])), exist_ok=True)
+    if monitor:
+        p['flag_monitor'] = 1
+    if job['solver'] == 'fake':
+        return fake_simulate(p)
+    simulate = importlib.import_module('helper_functions.'+job['solver']+'.simulate_device').simulate_predefined_gds
+    return simulate(parameters=p)
+
+def work(queue_dir,
+         heartbeat_interval: float = 30.0,
+         timeout: float = 300.0,
+         max_attempts: int = 3,
+         max_jobs: int | None = None,
+         poll: float | None = None,
+         monitor = False):
+    r""" worker loop: reclaim the jobs of dead workers, claim a job, run it while sending heartbeats, repeat.
+
+    Start one worker per license or GPU on every host, all pointed at the same queue directory:
+        python -m helper_functions.generic.work_queue work //server/share/queue
+
+    Args:
+        queue_dir (str): queue directory, on the shared filesystem
+        heartbeat_interval (float, optional): seconds between heartbeats. Defaults to 30.
+        timeout (float, optional): heartbeat age after which a job is reclaimed (s). Defaults to 300.
+        max_attempts (int, optional): claims of a job before it fails. Defaults to 3.
+        max_jobs (int | None, optional): stop after this many jobs. Defaults to None, no limit.
+        poll (float | None, optional): wait for new jobs every poll seconds. Defaults to None, stop when the queue is empty.
+        monitor (bool, optional): follow the runs and abort diverging ones, which are re-queued with the
+            boundaries of RECOVERY. Defaults to False.
+
+    Returns:
+        job_ids (list): jobs run by this worker
+    """
+    init_queue(queue_dir)
+    worker = socket.gethostname()+':'+str(os.getpid())
+    job_ids = []
+    while max_jobs is None or len(job_ids) < max_jobs:
+        reclaim(queue_dir, timeout=timeout, max_attempts=max_attempts)
+        job = claim(queue_dir, worker)
+        if job is None:
+            if poll is None and not os.listdir(os.path.join(queue_dir, 'claimed')):
+                break
+            time.sleep(poll or heartbeat_interval)
+            continue
+
+        print(f"Worker {worker} runs job {job['job_id']} ({job['solver']}, {job['device']}/{job['run_name']}).")
+        stop = threading.Event()
+        def beat():
+            while not stop.wait(heartbeat_interval):
+                heartbeat(queue_dir, job['job_id'], worker)
+        beating = threading.Thread(target=beat, daemon=True)
+        beating.start()
+
+        start_time = datetime.now()
+        try:
+            results = run_job(queue_dir, job, monitor=monitor)
+            state, info = 'done', dict(duration=(datetime.now() - start_time).total_seconds(),
+                                       has_results=results is not None)
+        except DivergenceError as error:
+            state, info = 'failed', dict(duration=(datetime.now() - start_time).total_seconds(),
+                                         error=str(error), diverged=True, requeued_as=requeue(queue_dir, job))
+            print(f"{error} Re-queued as {info['requeued_as']}." if info['requeued_as'] else f'{error} No recovery left.')
+        except Exception:
+            state, info = 'failed', dict(duration=(datetime.now() - start_time).total_seconds(),
+                                         error=traceback.format_exc())
+        finally:
+            stop.set()
+            beating.join()
+        finish(queue_dir, job, state, **info)
+        job_ids.append(job['job_id'])
+    return job_ids
+
+def queue_status(queue_dir):
+    r""" jobs of a queue per state.
+
+    Returns:
+        status (dict): state -> list of jobs
+    """
+    status = {}
+    for state in STATES:
+        status[state] = []
+        folder = os.path.join(queue_dir, state)
+        for name in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+            if name.endswith('.json'):
+                try:
+                    status[state].append(_read(os.path.join(folder, name)))
+                except (FileNotFoundError, ValueError):
+                    pass # moved or being written
+    return status
+
+if __name__ == '__main__':
+    # python -m helper_functions.generic.work_queue work <queue_dir> [--max-jobs N] [--poll S] [--monitor]
+    # python -m helper_functions.generic.work_queue status <queue_dir>
+    sys.path.append(os.getcwd())
+    parser = argparse.ArgumentParser(description='Run the simulations of a shared-directory queue.')
+    parser.add_argument('command', choices=['work', 'status'])
+    parser.add_argument('queue_dir')
+    parser.add_argument('--heartbeat', type=float, default=30.0, help='seconds between heartbeats')
+    parser.add_argument('--timeout', type=float, default=300.0, help='heartbeat age after which a job is reclaimed (s)')
+    parser.add_argument('--max-attempts', type=int, default=3)
+    parser.add_argument('--max-jobs', type=int, default=None)
+    parser.add_argument('--poll', type=float, default=None, help='wait for new jobs instead of stopping when the queue is empty')
+    parser.add_argument('--monitor', action='store_true', help='abort diverging runs and re-queue them with stabilized boundaries')
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        for state, jobs in queue_status(args.queue_dir).items():
+            print(f'{state}: {len(jobs)}')
+            for job in jobs:
+                print(f"    {job['job_id']} {job['solver']} {job['device']}/{job['run_name']} {job.get('worker', '')}")
+    else:
+        from gds_library import pdk_universal
+        pdk_universal.activate()
+        work(args.queue_dir, heartbeat_interval=args.heartbeat, timeout=args.timeout,
+             max_attempts=args.max_attempts, max_jobs=args.max_jobs, poll=args.poll, monitor=args.monitor)
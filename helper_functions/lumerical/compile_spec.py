@@ -0,0 +1,156 @@
+import numpy as np
+
+from helper_functions.generic.materials import band_range
+from helper_functions.lumerical.materials import add_material_sampled3d
+from helper_functions.lumerical.gds_handling import import_gds_to_lumerical
+from helper_functions.generic.mode_solver import convert_mode_index
+
+# run time in round trips of light along x, the auto shutoff usually ends the run earlier
+RUN_TIME_FACTOR = 30.0
+
+def compile_project(project, spec, temperature = 300, flag_boolean = 0, pml_profile: str = 'standard', pml_layers: int | None = None,
+                    flag_band_material = 0, material_margin: float | None = None):
+    r""" set up a Lumerical FDTD project from a spec: ports at all optical ports, o1 injecting.
+
+    Args:
+        project: lumapi.FDTD session, in layout mode
+        spec (SimulationSpec): from build_spec
+        temperature (float, optional): simulation temperature (K). Defaults to 300.
+        flag_boolean (int, optional): apply the layer boolean rules on import. Defaults to 0.
+        pml_profile (str, optional): 'standard' or 'stabilized', against runs diverging in the PML. Defaults to 'standard'.
+        pml_layers (int | None, optional): PML layers. Defaults to None, 64 for the stabilized profile, else Lumerical's default.
+        flag_band_material (int, optional): sample the materials over the band of the spec only. Defaults to 0, every sample.
+        material_margin (float | None, optional): see band_range. Defaults to None.
+    """
+    # unit conversion
+    um = 1e-6
+
+    band = spec.band
+    x_min, y_min, z_min, x_max, y_max, z_max = spec.domain
+
+    # import material to database
+    wav_range = band_range(band.wav_start, band.wav_stop, material_margin) if flag_band_material else None
+    mat_wg = 'user guiding'
+    add_material_sampled3d(project=project,
+                           file=r'materials_library\\'+spec.material_type+'_'+spec.guiding_material,
+                           display_name=mat_wg,
+                           color=[1, 0, 0, 1] if spec.guiding_material == 'Si' else [0, 0, 1, 1],
+                           wav_range=wav_range)
+
+    mat_ox = 'user SiO2' # as background material
+    add_material_sampled3d(project=project,
+                           file=r'materials_library\\'+spec.material_type+'_SiO2',
+                           display_name=mat_ox,
+                           color=[0, 1, 0, 0.3],
+                           wav_range=wav_range)
+
+    import_gds_to_lumerical(project=project, gds_file=spec.gds_file, material=mat_wg, flag_boolean=flag_boolean)
+
+    # add FDTD solver
+    project.addfdtd()
+    project.set('simulation temperature', temperature)
+    project.set('dimension', '3D')
+
+    project.set('x min', x_min*um)
+    project.set('x max', x_max*um)
+    project.set('y min', y_min*um)
+    project.set('y max', y_max*um)
+    project.set('z min', z_min*um)
+    project.set('z max', z_max*um)
+
+    project.set('background material', mat_ox)
+
+    project.set('mesh type', 'custom non-uniform')
+    project.set('mesh cells per wavelength', spec.mesh.resolution)
+
+    # local mesh override regions around the features the global mesh cannot resolve
+    for idx, (layer, bounds, dl) in enumerate(spec.mesh.overrides):
+        project.addmesh()
+        project.set('name', 'mesh '+layer+' '+str(idx))
+        project.set('x min', bounds[0]*um)
+        project.set('x max', bounds[3]*um)
+        project.set('y min', bounds[1]*um)
+        project.set('y max', bounds[4]*um)
+        project.set('z min', bounds[2]*um)
+        project.set('z max', bounds[5]*um)
+        project.set('override x mesh', 1)
+        project.set('override y mesh', 1)
+        project.set('override z mesh', 0)
+        project.set('set maximum mesh step', 1)
+        project.set('dx', dl*um)
+        project.set('dy', dl*um)
+    if spec.mesh.overrides:
+        print(f'{len(spec.mesh.overrides)} mesh override regions added.')
+
+    sim_time = RUN_TIME_FACTOR*((x_max-x_min)*um*2.0/299792458) # c=299792458 m/s, speed of light
+    project.set("simulation time", sim_time)
+
+    # set boundary conditions
+    for axis in ['x', 'y', 'z']:
+        project.set(f'{axis} min bc', 'PML')
+        project.set(f'{axis} max bc', 'PML')
+
+    # optional: stabilized PML
+    if pml_profile == 'stabilized':
+        project.set('pml profile', 4) # set PML profile to 'stabilized' to prevent diverging simulation
+        project.set('pml layers', 64 if pml_layers is None else pml_layers)
+        project.set('pml kappa', 5)
+        project.set('pml alpha', 0.9)
+    elif pml_layers is not None:
+        project.set('pml layers', pml_layers)
+
+    # optionally change top cladding
+    if spec.cladding_index is not None:
+        bounds = spec.cladding_bounds
+        project.addrect()
+        project.set('name', 'new clad')
+        project.set('index', spec.cladding_index)
+        project.set('alpha', 0.3)
+        project.set('override mesh order from material database', 1)
+        project.set('mesh order', 3)
+        project.set('x min', bounds[0]*um)
+        project.set('x max', bounds[3]*um)
+        project.set('y min', bounds[1]*um)
+        project.set('y max', bounds[4]*um)
+        project.set('z min', bounds[2]*um)
+        project.set('z max', bounds[5]*um)
+
+    # configure global source and monitor
+    project.setglobalsource('wavelength start', band.wav_start*um)
+    project.setglobalsource('wavelength stop', band.wav_stop*um)
+    project.setglobalmonitor('frequency points', band.num_points)
+
+    # add ports, o1 is the input port (injection)
+    for port in sorted(spec.optical_ports, key=lambda port: port.name != 'o1'):
+        if port.axis is None:
+            continue
+        project.addport()
+        project.set('name', port.name)
+        project.set('injection axis', port.axis+'-axis')
+        project.set('x', port.center[0]*um)
+        project.set('y', port.center[1]*um)
+        if port.axis == 'x':
+            project.set('y span', port.span*um)
+        else:
+            project.set('x span', port.span*um)
+        project.set('z', port.z*um)
+        project.set('z span', port.z_span*um)
+        project.set('direction', 'Forward')
+        project.set('mode selection', 'user select')
+        project.set('selected mode numbers', np.linspace(1, spec.mode_num, num=spec.mode_num))
+        project.set('number of field profile samples', band.num_points)
+
+    # set input port mode
+    project.select('FDTD::ports')
+    project.set('source port', 'o1')
+    project.set('source mode', 'mode '+str(convert_mode_index(spec.mode_idx, 'tidy3d', 'lumerical')))
+
+    # add 2D z-normal monitor
+    project.adddftmonitor()
+    project.set('name','z normal')
+    project.set('monitor type', '2D Z-normal')
+    project.set('x min', x_min*um)
+    project.set('x max', x_max*um)
+    project.set('y min', y_min*um)
+    project.set('y max', y_max*um)
+    project.set('z', spec.monitor_z*um)
@@ -1,10 +1,10 @@
 from helper_functions.generic.gds_handling import get_layer_name_by_tuple
+from helper_functions.generic.layer_boolean import boolean_gds_file, default_boolean_rules
 import gdsfactory as gf
-import pya
 
 um = 1e-6
 
-def import_gds_to_lumerical(project, gds_file, material, cell_name: str | None=None, flag_boolean = 0):
+def import_gds_to_lumerical(project, gds_file, material, cell_name: str | None=None, flag_boolean = 0, boolean_rules: list | None=None):
     r"""Import each layer of a GDS file into Lumerical.
 
     Args:
@@ -12,7 +12,8 @@ def import_gds_to_lumerical(project, gds_file, material, cell_name: str | None=N
         gds_file (str): Path to the GDS file.
         material: Material name used for all layers.
         cell_name (str | None): Optional specific cell name to import.
-        flag_boolean (int): If set, applies boolean ops on partial etch layers.
+        flag_boolean (int): If set, applies the layer boolean rules before importing.
+        boolean_rules (list | None): Boolean rules, defaults to 'boolean_rules' of the layer stack.
 
     Returns:
         None
@@ -32,44 +33,14 @@ def import_gds_to_lumerical(project, gds_file, material, cell_name: str | None=N
 
     cell_layers = top_cell.layers
 
-    # boolean operation of partial etch layer
-    if flag_boolean:
-        if layers['SiN1'] in cell_layers and layers['SiN1p'] in cell_layers:
-            # load layout
-            layout = pya.Layout()
-            layout.read(gds_file)
-            top_cell = layout.top_cell()
-            
-            # Define layers
-            layer1_info = pya.LayerInfo(layers['SiN1'][0], layers['SiN1'][1])
-            layer2_info = pya.LayerInfo(layers['SiN1p'][0], layers['SiN1p'][1])
-            result_layer_info = pya.LayerInfo(layers['SiN1'][0], layers['SiN1'][1])
-
-            layer1 = layout.layer(layer1_info)
-            layer2 = layout.layer(layer2_info)
-
-            layer1 = pya.Region()
-            layer2 = pya.Region()
-
-            # extract regions
-            for shape in top_cell.shapes(layout.layer(layer1_info)):
-                if shape.is_polygon() or shape.is_box() or shape.is_path():
-                    layer1.insert(shape.polygon)
-
-            for shape in top_cell.shapes(layout.layer(layer2_info)):
-                if shape.is_polygon() or shape.is_box() or shape.is_path():
-                    layer2.insert(shape.polygon)
-
-            # boolean operation (difference: SiN1 - SiN1p)
-            result_region = layer1 - layer2  # Change ^ to & for AND, | for OR, - for NOT
-
-            # overwrite result layer
-            result_layer_index = layout.layer(result_layer_info)
-            top_cell.shapes(result_layer_index).clear()
-            top_cell.shapes(result_layer_index).insert(result_region)
-
-            # write modified layout back to file
-            layout.write(gds_file)
+    # boolean operations declared in the layer stack
+    # gdsimport reads from a file, so the result goes to a separate '_boolean.gds', the input is not modified
+    # without rules the input is imported as is
+    if flag_boolean and boolean_rules is None:
+        boolean_rules = default_boolean_rules()
+    if flag_boolean and boolean_rules:
+        gds_file = boolean_gds_file(gds_file, boolean_rules, layers, cell_name=cell_name)
+        cell_layers = gf.import_gds(gds_file, cellname=cell_name).layers
     
     # import each layer into Lumerical
     for layer in cell_layers:
@@ -1,4 +1,4 @@
-from helper_functions.generic.materials import read_nk
+from helper_functions.generic.materials import read_nk, resample_nk
 import numpy as np
 
 c = 299792458 # speed of light in vacuum, m/s
@@ -7,7 +7,8 @@ def add_material_sampled3d(
         project, 
         file, 
         display_name, 
-        color: list = [0, 0, 1, 0]
+        color: list = [0, 0, 1, 0],
+        wav_range: tuple | None = None
         ):
     r"""Add a sampled 3D material to the Lumerical project using n/k data.
 
@@ -16,15 +17,22 @@ def add_material_sampled3d(
         file (str): Path to the file containing n/k data
         display_name (str): Display name for the material in Lumerical
         color (list): RGBA color for material visualization in GUI
+        wav_range (tuple | None): (shortest, longest) wavelength (um) of the samples, see band_range.
+            Defaults to None, every sample of the file, fitted by Lumerical over its whole range.
     """
-    # read wavelength and refractive index data from file
-    temp = read_nk(
-        filename=file, 
-        material='', 
-        wvl_key='wavelength(m)', 
-        n_prefix='Re(index)', 
-        k_prefix='Im(index)'
-        )
+    if wav_range is None:
+        # read wavelength and refractive index data from file
+        temp = read_nk(
+            filename=file, 
+            material='', 
+            wvl_key='wavelength(m)', 
+            n_prefix='Re(index)', 
+            k_prefix='Im(index)'
+            )
+    else:
+        # samples over the band only, so that Lumerical fits a simpler model
+        wavelengths, n, k = resample_nk(filename=file, wav_range=wav_range)
+        temp = {'wvls': wavelengths*1e-6, 'n': n, 'k': k}
     # create new material
     new_mat = project.addmaterial('Sampled 3D data')
 
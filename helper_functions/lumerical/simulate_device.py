@@ -4,6 +4,9 @@ import gdsfactory as gf
 import json
 
 from helper_functions.generic.misc import write_to_json
+from helper_functions.generic.gds_handling import write_gds
+from helper_functions.generic.run_catalog import record_run
+from helper_functions.generic.parametric import parametric_component, parametric_gds
 from helper_functions.lumerical.initiate_fdtd import fdtd_from_gds
 
 def simulate_predefined_gds(parameters):
@@ -39,11 +42,20 @@ def simulate_predefined_gds(parameters):
         
         flag_run_simulation = 0,    # run simulation?
         flag_boolean = 0,           # apply boolean operation?
+        flag_mode_preview = 0,      # pick mode_num from a local eigenmode solve of the ports?
+        flag_mesh_override = 0,     # refine the mesh locally around narrow gaps and tips?
+        mesh_min_cells = 4,         # mesh cells required across a critical feature
+        flag_auto_size = 0,         # size the domain and port planes from the decay of the port modes?
+        field_threshold = 1e-2,     # field amplitude, relative to the peak, at the plane edges
         
         solver_z_min = -1,          # simulation region z min (um)
         solver_z_max = 1,           # simulation region z max (um)
         
         change_cladding = False,    # True: replace top cladding with Si3N4
+
+        catalog_db = None,          # SQLite run catalog, None: runs are not indexed
+        parametric = None,          # gdsfactory function and settings (read_spec), generated instead of reading predefined_gds
+        spec_cache = None,          # directory of the simulation specs shared by the solvers, None: kept in memory only
     )
 
     # load user settings from config.json
@@ -53,10 +65,15 @@ def simulate_predefined_gds(parameters):
 
     # update default setting with input
     p.update(parameters)
+    start_time = datetime.now()
     
     # define the output GDS file name
     p['gds_file'] = p['file_name']+'.gds'
 
+    # parametric component: the generated GDS in the layout cache stands for predefined_gds
+    if p['parametric']:
+        p['predefined_gds'] = parametric_gds(p['parametric'])
+
     # convert parameters to local variables
     for key, value in p.items():
         globals()[key] = value
@@ -65,8 +82,11 @@ def simulate_predefined_gds(parameters):
     write_to_json(dict_name=p, json_name=file_name+'.json')
 
     # copy the predefined GDS to the output location
-    device = gf.import_gds(predefined_gds, read_metadata=True)
-    device.write_gds(gds_file, with_metadata=True)
+    if parametric:
+        device = parametric_component(parametric)
+    else:
+        device = gf.import_gds(predefined_gds, read_metadata=True)
+    write_gds(device, gds_file)
 
     # check if the simulation file already exists
     if os.path.exists(file_name+'_FDTD.fsp') and flag_run_simulation:
@@ -74,17 +94,21 @@ def simulate_predefined_gds(parameters):
         while True:
             response = input("\033[1;91mDo you want to continue? (y/n):\033[0m").strip().lower()
             if response == 'y':
-                results = fdtd_from_gds(parameters=p)
-                return results
+                break
             elif response == 'n':
                 print('\033[1;91mStopping...\033[0m')
                 return
             else:
                 print("\033[1;91mPlease enter 'y' or 'n'.\033[0m")
-    else:
-        results = fdtd_from_gds(parameters=p)
-        return results
 
-     
+    results = fdtd_from_gds(parameters=p)
+
+    if results:
+        # keep the spectra next to the project file, readable without a Lumerical license
+        write_to_json(dict_name=results, json_name=file_name+'_results.json')
+
+        # index the finished run in the catalog
+        if catalog_db:
+            record_run(db_file=catalog_db, parameters=p, results=results, solver='lumerical', start_time=start_time)
 
-    
\ No newline at end of file
+    return results
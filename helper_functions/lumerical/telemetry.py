@@ -0,0 +1,81 @@
+import os
+import re
+import subprocess
+
+from helper_functions.generic.telemetry import watch
+
+# progress line of the FDTD engine log, e.g. '45% complete. Max time remaining: 2 mins. Auto Shutoff: 0.00231'
+PROGRESS = re.compile(r'(\d+(?:\.\d+)?)\s*%\s*complete.*?Auto Shutoff:\s*([0-9.]+(?:[eE][+-]?\d+)?)')
+
+def default_engine(lumapi_path):
+    r""" FDTD engine of the installation of lumapi_path, run without MPI.
+    """
+    name = 'fdtd-engine-msmpi.exe' if os.name == 'nt' else 'fdtd-engine-ompi-lcl'
+    return os.path.join(os.path.dirname(os.path.dirname(lumapi_path)), 'bin', name)
+
+def read_log(log_file):
+    r""" progress (0 to 1) and auto-shutoff energy of the last progress line of an engine log.
+
+    Returns:
+        progress (float | None)
+        energy (float | None)
+        diverged (bool): the engine reported a divergence
+    """
+    try:
+        with open(log_file, errors='replace') as f:
+            text = f.read()
+    except FileNotFoundError:
+        return None, None, False
+    matches = PROGRESS.findall(text)
+    progress, energy = (float(matches[-1][0])/100, float(matches[-1][1])) if matches else (None, None)
+    return progress, energy, 'diverg' in text.lower()
+
+def run_engine(project, fsp_file, engine,
+               threads: int = 4,
+               interval: float = 10.0,
+               growth: float = 100.0,
+               json_name: str | None = None):
+    r""" run a saved project with the FDTD engine in a subprocess, watched through its log.
+
+    project.run() blocks until sim_time is reached; the engine subprocess can be stopped as soon as
+    the auto-shutoff energy grows. The results are loaded back into the project when the run finishes.
+
+    Args:
+        project (lumapi.FDTD): session of the saved project
+        fsp_file (str): saved project
+        engine (str): FDTD engine executable, see default_engine
+        threads (int, optional): engine threads. Defaults to 4.
+        interval (float, optional): seconds between polls of the log. Defaults to 10.
+        growth (float, optional): see detect_divergence. Defaults to 100.
+        json_name (str | None, optional): save the telemetry report. Defaults to None.
+
+    Returns:
+        report (dict): from watch
+    """
+    log_file = os.path.splitext(fsp_file)[0]+'_p0.log'
+    if os.path.exists(log_file):
+        os.remove(log_file)
+    process = subprocess.Popen([engine, '-t', str(threads), fsp_file],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+
+    def poll():
+        progress, energy, diverged = read_log(log_file)
+        code = process.poll()
+        if diverged:
+            state = 'diverged'
+        elif code is None:
+            state = 'running' if progress is not None else 'queued'
+        else:
+            state = 'finished' if code == 0 else 'error'
+        return dict(state=state, progress=1.0 if state == 'finished' else progress, energy=energy)
+
+    def abort():
+        process.terminate()
+        process.wait()
+
+    report = watch(poll, abort, name=os.path.basename(fsp_file), interval=interval, growth=growth, json_name=json_name)
+    if report['state'] == 'diverged' and process.poll() is None:
+        abort()
+    if report['state'] == 'finished':
+        project.load(fsp_file)
+    return report
@@ -0,0 +1,153 @@
+import numpy as np
+import tidy3d as td
+
+from helper_functions.generic.materials import band_range
+from helper_functions.tidy3d.materials import load_pole_material, fit_band_material
+from helper_functions.tidy3d.gds_handling import import_gds_to_tidy3d
+
+# run time in round trips of light along x
+RUN_TIME_FACTOR = 16.0
+
+def band_freqs(band):
+    r""" monitor frequencies of a band (Hz), from the longest wavelength.
+    """
+    return list(np.linspace(td.C_0/band.wav_stop, td.C_0/band.wav_start, num=band.num_points))
+
+def source_time(band):
+    r""" pulse covering a band.
+    """
+    return td.GaussianPulse(freq0=td.C_0/band.wavelength, fwidth=td.C_0/band.wav_start-td.C_0/band.wav_stop)
+
+def source_num_freqs(band):
+    r""" frequencies of the mode solves of the source, one per 10 nm.
+    """
+    return round(band.wav_span/0.01+1.0)
+
+def grid_spec(mesh):
+    r""" automatic grid of a mesh policy, with its local refinement boxes.
+    """
+    override_structures = [td.MeshOverrideStructure(
+        geometry = td.Box.from_bounds(rmin=bounds[:3], rmax=bounds[3:]),
+        dl = (dl, dl, None),
+    ) for _, bounds, dl in mesh.overrides]
+    return td.GridSpec.auto(min_steps_per_wvl=mesh.resolution, override_structures=override_structures)
+
+def run_time(spec, run_time_factor: float = RUN_TIME_FACTOR):
+    x_min, _, _, x_max, _, _ = spec.domain
+    return run_time_factor*(x_max-x_min)*2.0/td.C_0
+
+def boundary_spec(boundary: str = 'absorber', pml_layers: int | None = None):
+    r""" the same absorbing boundary on all sides: 'absorber', 'pml' or 'stable_pml'.
+    """
+    kinds = dict(absorber=td.Absorber, pml=td.PML, stable_pml=td.StablePML)
+    if boundary not in kinds:
+        raise Exception(f"Unknown boundary '{boundary}', only {list(kinds)}.")
+    layers = {} if pml_layers is None else dict(num_layers=pml_layers)
+    return td.BoundarySpec.all_sides(boundary=kinds[boundary](**layers))
+
+def compile_simulation(spec, flag_flux_monitor = 0, flag_boolean = 0, flag_instance = 0, boundary: str = 'absorber', pml_layers: int | None = None,
+                       flag_band_material = 0, material_margin: float | None = None, material_cache: str | None = None):
+    r""" Tidy3D simulation of a spec: mode source at o1, mode (and flux) monitors at the output ports.
+
+    Args:
+        spec (SimulationSpec): from build_spec
+        flag_flux_monitor (int, optional): add flux monitors at the output ports. Defaults to 0.
+        flag_boolean (int, optional): apply the layer boolean rules on import. Defaults to 0.
+        flag_instance (int, optional): place repeated cells by transforms. Defaults to 0.
+        boundary (str, optional): 'absorber', 'pml' or 'stable_pml'. Defaults to 'absorber'.
+        pml_layers (int | None, optional): boundary layers. Defaults to None, Tidy3D's default.
+        flag_band_material (int, optional): fit the materials over the band of the spec only, see fit_band_material.
+            Defaults to 0, the pole fits of the materials library.
+        material_margin (float | None, optional): see band_range. Defaults to None.
+        material_cache (str | None, optional): directory of the band fits. Defaults to None.
+
+    Returns:
+        sim (td.Simulation)
+    """
+    freqs = band_freqs(spec.band)
+
+    ##### import material data to tidy3d #####
+    if flag_band_material:
+        wav_range = band_range(spec.band.wav_start, spec.band.wav_stop, material_margin)
+        mat_WG = fit_band_material(filename=r"materials_library\\"+spec.material_type+'_'+spec.guiding_material,
+                                   wav_range=wav_range, material_cache=material_cache)
+        mat_OX = fit_band_material(filename=r"materials_library\\"+spec.material_type+'_SiO2',
+                                   wav_range=wav_range, material_cache=material_cache)
+    else:
+        mat_WG = load_pole_material(filename=r"materials_library\\"+spec.material_type+'_'+spec.guiding_material+'_pole')
+        mat_OX = load_pole_material(filename=r"materials_library\\"+spec.material_type+'_SiO2_pole')
+
+    struc = []
+    if spec.cladding_index is not None:
+        bounds = spec.cladding_bounds
+        struc.append(td.Structure(
+            geometry = td.Box.from_bounds(rmin=bounds[:3], rmax=bounds[3:]),
+            medium = td.Medium(permittivity=spec.cladding_index**2),
+        ))
+    struc.extend(import_gds_to_tidy3d(gds_file=spec.gds_file, material=mat_WG, flag_boolean=flag_boolean, flag_instance=flag_instance))
+
+    # define mode source
+    o1 = spec.port('o1')
+    mode_spec = td.ModeSpec(num_modes=spec.mode_num, group_index_step=True)
+    mode_source = td.ModeSource(
+        center = o1.plane_center,
+        size = (0, o1.span, o1.z_span),
+        source_time = source_time(spec.band),
+        direction = "+",
+        mode_spec = mode_spec,
+        mode_index = spec.mode_idx,
+        num_freqs = source_num_freqs(spec.band),
+        )
+
+    # input field monitor
+    in_mnt = td.FieldMonitor(
+        center = [o1.center[0]+0.5, o1.center[1], o1.z],
+        size = mode_source.size,
+        freqs = freqs,
+        name = 'input field',
+        )
+
+    # z-normal (overhead) field monitor
+    freq_mnt = td.FieldMonitor(
+        center = (spec.center[0], spec.center[1], spec.monitor_z),
+        size = (spec.size[0], spec.size[1], 0),
+        freqs = freqs,
+        name = 'z-normal field',
+        )
+
+    monitors = [in_mnt, freq_mnt]
+
+    # add output monitors
+    for port in spec.optical_ports:
+        if port.name == 'o1' or port.axis is None:
+            continue
+        if flag_flux_monitor:
+            monitors.append(td.FluxMonitor(
+                center = port.plane_center,
+                size = port.plane_size,
+                freqs = freqs,
+                name = port.name+' flux',
+            ))
+        monitors.append(td.ModeMonitor(
+            center = port.plane_center,
+            size = port.plane_size,
+            freqs = freqs,
+            mode_spec = mode_spec,
+            name = port.name+' mode',
+        ))
+
+    # local refinement boxes around the features the global mesh cannot resolve
+    if spec.mesh.overrides:
+        print(f'{len(spec.mesh.overrides)} mesh override regions added.')
+
+    return td.Simulation(
+        size = spec.size,
+        center = spec.center,
+        grid_spec = grid_spec(spec.mesh),
+        structures = struc,
+        sources = [mode_source],
+        monitors = monitors,
+        run_time = run_time(spec),
+        boundary_spec = boundary_spec(boundary, pml_layers), # absorber or PML
+        medium = mat_OX,
+    )
@@ -0,0 +1,101 @@
+import os
+import json
+import hashlib
+import tidy3d as td
+import tidy3d.web as web
+
+from helper_functions.generic.misc import write_to_json
+
+def simulation_hash(sim):
+    r""" content hash of a tidy3d simulation, stable across sessions.
+
+    Args:
+        sim (td.Simulation): simulation to hash
+
+    Returns:
+        digest (str): sha256 hex digest of the serialized simulation
+    """
+    return hashlib.sha256(sim.json().encode('utf-8')).hexdigest()
+
+def export_simulation_artifact(sim, file_name, task_name):
+    r""" validate a simulation locally and save it as a compressed artifact.
+    No server call is made, the artifact can be submitted later with submit_artifacts.
+
+    Args:
+        sim (td.Simulation): simulation to export
+        file_name (str): output prefix, the artifact is saved to file_name+'_sim.hdf5.gz'
+        task_name (str): task name used when the artifact is submitted
+
+    Returns:
+        artifact (dict): task name, content hash and paths of the artifact files
+    """
+
+    # same checks the server runs before accepting a task
+    sim.validate_pre_upload()
+
+    artifact = dict(
+        task_name = task_name,
+        hash = simulation_hash(sim),
+        simulation_file = file_name+'_sim.hdf5.gz',
+        manifest_file = file_name+'_sim.json',
+    )
+
+    os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+    sim.to_hdf5_gz(artifact['simulation_file'])
+    write_to_json(dict_name=artifact, json_name=artifact['manifest_file'])
+
+    print(f"Simulation validated and saved to {artifact['simulation_file']} (hash {artifact['hash'][:12]}).")
+
+    return artifact
+
+def load_registry(registry_file):
+    r""" read the registry of already submitted artifacts.
+
+    Returns:
+        registry (dict): content hash -> submission record
+    """
+    if not os.path.exists(registry_file):
+        return {}
+    with open(registry_file, 'r') as f:
+        return json.load(f)
+
+def submit_artifacts(artifacts, registry_file, folder_name: str = 'default', verbose: bool = True):
+    r""" upload dry-run artifacts that have not been submitted before.
+
+    Args:
+        artifacts (list): artifact dicts returned by export_simulation_artifact, or paths to their manifest files
+        registry_file (str): JSON file recording submitted artifacts by content hash
+        folder_name (str, optional): tidy3d project folder. Defaults to 'default'.
+        verbose (bool, optional): print upload progress. Defaults to True.
+
+    Returns:
+        task_ids (dict): task name -> task id, for new and previously submitted artifacts
+    """
+    registry = load_registry(registry_file)
+    task_ids = {}
+
+    for artifact in artifacts:
+        if isinstance(artifact, str):
+            with open(artifact, 'r') as f:
+                artifact = json.load(f)
+
+        record = registry.get(artifact['hash'])
+        if record:
+            print(f"Skipping {artifact['task_name']}: already submitted as {record['task_name']}.")
+            task_ids[artifact['task_name']] = record['task_id']
+            continue
+
+        sim = td.Simulation.from_file(artifact['simulation_file'])
+        task_id = web.upload(sim, task_name=artifact['task_name'], folder_name=folder_name, verbose=verbose)
+
+        registry[artifact['hash']] = dict(
+            task_name = artifact['task_name'],
+            task_id = task_id,
+            simulation_file = artifact['simulation_file'],
+        )
+        task_ids[artifact['task_name']] = task_id
+
+        # update the registry after every upload so an interrupted submit can resume
+        write_to_json(dict_name=registry, json_name=os.path.abspath(registry_file))
+
+    return task_ids
@@ -1,17 +1,26 @@
+import numpy as np
 import gdsfactory as gf
 import gdstk
 import tidy3d as td
 from helper_functions.generic.gds_handling import get_layer_name_by_tuple
-import pya
+from helper_functions.generic.layer_boolean import boolean_gds_cell, default_boolean_rules
 
 def import_gds_to_tidy3d(gds_file, material, 
                          cell_name: str | None = None, 
                          sidewall_angle: float = 0.0,
                          reference_plane: str = 'middle',
                          dilation: float=0.0,
-                         flag_boolean = 0,):
+                         flag_boolean = 0,
+                         boolean_rules: list | None = None,
+                         flag_instance = 0,
+                         min_instances: int = 4,
+                         thickness_bias: float = 0.0,):
     
     r""" import each layer of the top cell, using specification in custom_pdk
+    If flag_boolean, the layer boolean rules (default: from the layer stack) are applied in memory first.
+    If flag_instance, cells placed at least min_instances times (e.g. grating teeth, photonic-crystal holes)
+    are extruded once and placed with transforms, one GeometryGroup per cell and layer.
+    thickness_bias is added to the thickness of every layer of the stack (um), for fabrication variability.
 
     Returns:
         structure group
@@ -30,48 +39,23 @@ def import_gds_to_tidy3d(gds_file, material,
     
     cell_layers = top_cell.layers
 
-    # boolean operation of partial etch layer
-    if flag_boolean:
-        if layers['SiN1'] in cell_layers and layers['SiN1p'] in cell_layers:
-            # Initialize the main layout and read the input GDS file
-            layout = pya.Layout()
-            layout.read(gds_file)
-
-            # Access the top cell
-            top_cell = layout.top_cell()
-            
-            # Define the layer information for the operation
-            layer1_info = pya.LayerInfo(layers['SiN1'][0], layers['SiN1'][1])
-            layer2_info = pya.LayerInfo(layers['SiN1p'][0], layers['SiN1p'][1])
-            result_layer_info = pya.LayerInfo(layers['SiN1'][0], layers['SiN1'][1])
-
-            layer1 = layout.layer(layer1_info)
-            layer2 = layout.layer(layer2_info)
-
-            # Create pya.Region objects for each layer
-            layer1 = pya.Region()
-            layer2 = pya.Region()
-
-            # Fill the regions with shapes from the corresponding layers
-            for shape in top_cell.shapes(layout.layer(layer1_info)):
-                if shape.is_polygon() or shape.is_box() or shape.is_path():
-                    layer1.insert(shape.polygon)
-
-            for shape in top_cell.shapes(layout.layer(layer2_info)):
-                if shape.is_polygon() or shape.is_box() or shape.is_path():
-                    layer2.insert(shape.polygon)
-
-            # Perform a boolean operation (e.g., XOR) between the two regions
-            result_region = layer1 - layer2  # Change ^ to & for AND, | for OR, - for NOT
-
-            # Clear the existing shapes in the result layer and insert the result of the boolean operation
-            result_layer_index = layout.layer(result_layer_info)
-            top_cell.shapes(result_layer_index).clear()
-            top_cell.shapes(result_layer_index).insert(result_region)
-
-            # Save the modified layout to GDS file
-            layout.write(gds_file)
+    # boolean operations declared in the layer stack, applied in memory; without rules the layout is read as is
+    if flag_boolean and boolean_rules is None:
+        boolean_rules = default_boolean_rules()
+    if flag_boolean and boolean_rules:
+        gds_cell = boolean_gds_cell(gds_file, boolean_rules, layers, cell_name=cell_name)
+        cell_layers = {(polygon.layer, polygon.datatype) for polygon in gds_cell.get_polygons()}
+    else:
+        library = gdstk.read_gds(gds_file)
+        gds_cell = {cell.name: cell for cell in library.cells}.get(cell_name, library.top_level()[0])
     
+    if flag_instance:
+        gds_cell, instances = split_repeated_cells(gds_cell, min_instances=min_instances)
+    else:
+        instances = {}
+
+    extrude = dict(reference_plane=reference_plane, sidewall_angle=sidewall_angle, dilation=dilation)
+
     structures = []
 
     for layer in cell_layers:
@@ -79,23 +63,116 @@ def import_gds_to_tidy3d(gds_file, material,
         layer_name = get_layer_name_by_tuple(layer)
         zmin = layer_stack.layers[layer_name].zmin
         thickness = layer_stack.layers[layer_name].thickness
-        zmax = zmin + thickness
-        
-        import_geo = td.Geometry.from_gds(
-            gdstk.read_gds(gds_file).cells[0],
-            gds_layer = layer[0],
-            gds_dtype = layer[1],
-            axis=2, # extrusion in z-axis
-            slab_bounds=(zmin, zmax),
-            reference_plane=reference_plane,
-            sidewall_angle=sidewall_angle,
-            dilation=dilation,
-            )
+        zmax = zmin + thickness + thickness_bias
         
-        structures.append(td.Structure(
-            geometry=import_geo,
-            medium=material,
-            name=cell_name + '_' + layer_name,
-        ))   
+        if gds_cell.get_polygons(layer=layer[0], datatype=layer[1]):
+            structures.append(td.Structure(
+                geometry=extrude_gds_layer(gds_cell, layer, (zmin, zmax), **extrude),
+                medium=material,
+                name=cell_name + '_' + layer_name,
+            ))
+
+        # repeated cells: one extrusion per cell, placed by transforms
+        for unit_cell, transforms in instances.values():
+            if not unit_cell.get_polygons(layer=layer[0], datatype=layer[1]):
+                continue
+            unit_geo = extrude_gds_layer(unit_cell, layer, (zmin, zmax), **extrude)
+            structures.append(td.Structure(
+                geometry=td.GeometryGroup(geometries=[
+                    td.Transformed(geometry=unit_geo, transform=affine_to_4x4(transform)) for transform in transforms
+                ]),
+                medium=material,
+                name=cell_name + '_' + unit_cell.name + '_' + layer_name,
+            ))
         
-    return structures
\ No newline at end of file
+    return structures
+
+def extrude_gds_layer(gds_cell, layer, slab_bounds,
+                      reference_plane: str = 'middle',
+                      sidewall_angle: float = 0.0,
+                      dilation: float = 0.0):
+    r""" extrude one GDS layer of a gdstk cell along z.
+    """
+    return td.Geometry.from_gds(
+        gds_cell,
+        gds_layer = layer[0],
+        gds_dtype = layer[1],
+        axis=2, # extrusion in z-axis
+        slab_bounds=slab_bounds,
+        reference_plane=reference_plane,
+        sidewall_angle=sidewall_angle,
+        dilation=dilation,
+        )
+
+def reference_transforms(reference):
+    r""" 2D affine transforms (3x3) of a gdstk reference, one per element of its repetition.
+    """
+    c = np.cos(reference.rotation)
+    s = np.sin(reference.rotation)
+    m = reference.magnification
+    r = -1.0 if reference.x_reflection else 1.0 # reflection about x-axis is applied first
+    
+    base = np.array([
+        [m*c, -m*s*r, reference.origin[0]],
+        [m*s,  m*c*r, reference.origin[1]],
+        [0.0,  0.0,   1.0],
+    ])
+    
+    if reference.repetition.size == 0:
+        return [base]
+    
+    transforms = []
+    for offset in reference.repetition.get_offsets():
+        transform = base.copy()
+        transform[:2, 2] += offset
+        transforms.append(transform)
+    return transforms
+
+def affine_to_4x4(transform):
+    r""" embed a 2D affine transform in a 3D transform that leaves z unchanged.
+    """
+    matrix = np.eye(4)
+    matrix[:2, :2] = transform[:2, :2]
+    matrix[:2, 3] = transform[:2, 2]
+    return matrix
+
+def split_repeated_cells(gds_cell, min_instances: int = 4):
+    r""" split a cell hierarchy into flat geometry and repeated cells.
+
+    Cells placed at least min_instances times in total (arrays included) are kept as
+    instances and not descended into. Everything else is flattened into a new cell.
+
+    Args:
+        gds_cell (gdstk.Cell): top cell
+        min_instances (int, optional): minimal number of placements to keep a cell instanced. Defaults to 4.
+
+    Returns:
+        flat_cell (gdstk.Cell): geometry not covered by repeated cells
+        instances (dict): cell name -> (gdstk.Cell, list of 3x3 transforms to top cell coordinates)
+    """
+    # total number of placements of each cell in the flattened layout
+    counts = {}
+    def count(cell, multiplicity):
+        for reference in cell.references:
+            num = multiplicity * max(reference.repetition.size, 1)
+            counts[reference.cell.name] = counts.get(reference.cell.name, 0) + num
+            count(reference.cell, num)
+    count(gds_cell, 1)
+
+    flat_cell = gdstk.Cell(gds_cell.name + '_flat')
+    instances = {}
+
+    def walk(cell, transform):
+        for polygon in cell.polygons + [p for path in cell.paths for p in path.to_polygons()]:
+            points = polygon.points @ transform[:2, :2].T + transform[:2, 2]
+            flat_cell.add(gdstk.Polygon(points, layer=polygon.layer, datatype=polygon.datatype))
+        for reference in cell.references:
+            child = reference.cell
+            for ref_transform in reference_transforms(reference):
+                if counts[child.name] >= min_instances:
+                    instances.setdefault(child.name, (child, []))[1].append(transform @ ref_transform)
+                else:
+                    walk(child, transform @ ref_transform)
+    walk(gds_cell, np.eye(3))
+
+    return flat_cell, instances
@@ -1,22 +1,19 @@
 from datetime import datetime
-import numpy as np
-import tidy3d as td
-import gdsfactory as gf
+import os
+import json
 import tidy3d.web as web
-import re
 
 from helper_functions.generic.misc import write_to_json
-from helper_functions.tidy3d.materials import load_pole_material
-from helper_functions.tidy3d.gds_handling import import_gds_to_tidy3d
-from helper_functions.generic.gds_handling import extend_from_ports
-
-def fdtd_from_gds(parameters):
-
-    # unit conversion: micrometer
-    um = 1
-    
-    # default simulation parameters
-    p = dict(
+from helper_functions.tidy3d.dry_run import export_simulation_artifact
+from helper_functions.tidy3d.compile_spec import compile_simulation
+from helper_functions.generic.simulation_spec import build_spec
+from helper_functions.generic.telemetry import DivergenceError
+from helper_functions.tidy3d.telemetry import watch_task
+
+def default_parameters():
+    r""" default simulation parameters of fdtd_from_gds.
+    """
+    return dict(
         temperature = 300,
         
         resolution = 6,
@@ -37,17 +34,59 @@ def fdtd_from_gds(parameters):
         extension = 10.0,
         
         flag_run_simulation = 0,
+        flag_dry_run = 0,
         flag_flux_monitor = 0,
         
         flag_boolean = 0,
+        flag_instance = 0,
+        flag_mode_preview = 0,
+        flag_mesh_override = 0,
+        mesh_min_cells = 4,
+        flag_auto_size = 0,
+        field_threshold = 1e-2,
         mode_num = 5,
         mode_idx = 1,
         
         solver_z_min = -1,
         solver_z_max = 1,
         
+        boundary = 'absorber', # 'absorber', 'pml' or 'stable_pml'
+        pml_layers = None,
+        
+        flag_band_material = 0, # fit the materials over the band only, with fewer poles
+        material_margin = None, # um on both sides, defaults to the band span
+        material_cache = None,
+        
+        flag_monitor = 0, # follow the progress and field decay, abort a diverging run
+        monitor_interval = 10.0,
+        divergence_growth = 100.0,
+        
         change_cladding = False,
+        
+        parametric = None,
+        spec_cache = None,
     )
+
+def load_parameters(parameters):
+    r""" simulation parameters with the precedence of simulate_predefined_gds: defaults, config.json, then parameters.
+
+    Args:
+        parameters (dict): simulation parameters, as for fdtd_from_gds
+
+    Returns:
+        p (dict)
+    """
+    p = default_parameters()
+    if os.path.exists('config.json'):
+        with open('config.json') as f:
+            p.update(json.load(f))
+    p.update(parameters)
+    return p
+
+def fdtd_from_gds(parameters):
+
+    # default simulation parameters
+    p = default_parameters()
     
     # update default setting with input
     p.update(parameters)
@@ -59,204 +98,16 @@ def fdtd_from_gds(parameters):
     # save parameters to a json file
     write_to_json(dict_name=p, json_name=file_name+'_fdtd.json')
 
-    ##### convert wavelength (um) to frequency (Hz)
-    freq0 = td.C_0/wavelength
-
-    wav_stop = wavelength + 0.5*wav_span
-    wav_start = wavelength - 0.5*wav_span
-    freq_start = td.C_0/wav_stop
-    freq_stop = td.C_0/wav_start
-    freqs = np.linspace(freq_start, freq_stop, num=round(wav_span/wav_step+1.0))
+    # layout work, shared with the other solvers, and the Tidy3D simulation of the spec
+    spec = build_spec(p, solver='tidy3d', spec_cache=spec_cache)
+    write_to_json(dict_name=spec.to_dict(), json_name=file_name+'_spec.json')
+    sim = compile_simulation(spec, flag_flux_monitor=flag_flux_monitor, flag_boolean=flag_boolean, flag_instance=flag_instance,
+                             boundary=boundary, pml_layers=pml_layers, flag_band_material=flag_band_material,
+                             material_margin=material_margin, material_cache=material_cache)
 
-    ##### import material data to tidy3d #####
-    if guiding_material == 'SiN':
-        mat_WG = load_pole_material(filename=r"materials_library\\"+material_type+'_SiN_pole')
-    if guiding_material == 'Si':
-        mat_WG = load_pole_material(filename=r"materials_library\\"+material_type+'_Si_pole')
-    
-    mat_OX = load_pole_material(filename=r"materials_library\\"+material_type+'_SiO2_pole')
-
-    # read gds, and extend from ports
-    if flag_extend:
-        device = gf.import_gds(gds_file, read_metadata=True)
-        device, ports = extend_from_ports(device, offset=extension)
-        device.write_gds(file_name+'_extended.gds', with_metadata=True)
-        # structures = import_gds_to_tidy3d(gds_file=file_name+'_extended.gds', material=mat_WG, cell_name='extended_cell')
-        structures = import_gds_to_tidy3d(gds_file=file_name+'_extended.gds', material=mat_WG, flag_boolean=flag_boolean)
-        
-    else:
-        device = gf.import_gds(gds_file, read_metadata=True)
-        ports = device.ports
-        device.write_gds(file_name+'.gds', with_metadata=True)
-        structures = import_gds_to_tidy3d(gds_file=file_name+'.gds', material=mat_WG, flag_boolean = flag_boolean)
-    
-    x_min = np.inf
-    x_max = -1*np.inf
-    y_min = np.inf
-    y_max = -1*np.inf
-
-    for port_name in ports:
-        x = ports[port_name].center[0]
-        y = ports[port_name].center[1]
-        w = ports[port_name].width
-        x_min = min(x_min, x)
-        x_max = max(x_max, x)
-        y_min = min(y_min, y - w)
-        y_max = max(y_max, y + w)
-    
-    if x_min == x_max: # like a 180-degree bend, U-shape
-        x_min = ports['o1'].center[0]
-        x_max = device.xmax
-    
-    solver_x_min = x_min - 1.0
-    solver_x_max = x_max + 1.0
-    solver_y_min = y_min - 1.0
-    solver_y_max = y_max + 1.0
-
-    struc = []
-    if change_cladding:
-        cladding = td.Structure(
-            geometry = td.Box.from_bounds(
-                rmin = (solver_x_min-5.0, solver_y_min-5.0, 0),
-                rmax = (solver_x_max+5.0, solver_y_max+5.0, solver_z_max+5.0)
-            ),
-            medium = td.Medium(permittivity=2.0**2)
-        )
-        struc.append(cladding)
-    
-    struc.extend(structures)
-
-    # define mode source
-    src_plane = td.Box(
-        center=(
-            ports['o1'].center[0]*um, 
-            ports['o1'].center[1]*um, 
-            0,
-        ), 
-        size=(
-            0, 
-            (ports['o1'].width+4.0)*um, 
-            2.0*um,
-        ),
-    )
-    src_time = td.GaussianPulse(freq0=freq0, fwidth=freq_stop-freq_start)
-
-    mode_spec = td.ModeSpec(num_modes=mode_num, group_index_step=True)
-
-    mode_source = td.ModeSource(
-        center = src_plane.center,
-        size = src_plane.size,
-        source_time = src_time,
-        direction = "+",
-        mode_spec = mode_spec,
-        mode_index = mode_idx,
-        num_freqs=round(wav_span/0.01+1.0),
-        )
-    
-    # input field monitor
-    in_mnt = td.FieldMonitor(
-        center=[
-            (ports['o1'].center[0]+0.5)*um, 
-            ports['o1'].center[1]*um, 
-            0,
-            ],
-        size=src_plane.size,
-        freqs=list(freqs),
-        name='input field',
-        )
-
-    # z-normal (overhead) field monitor
-    freq_mnt = td.FieldMonitor(
-        center=(
-            0.5*(solver_x_max+solver_x_min)*um, 
-            0.5*(solver_y_max+solver_y_min)*um,  
-            0.1*um,
-            ),
-        size=(
-            (solver_x_max-solver_x_min)*um, 
-            (solver_y_max-solver_y_min)*um, 
-            0
-            ),
-        freqs=list(freqs),
-        name='z-normal field',
-        )
-    
-    monitors = [in_mnt, freq_mnt]
-
-    # add output monitors
-
-    for port_name in ports:
-        if re.match(r'^o\d+$', port_name) and port_name!='o1':
-            orientation = ports[port_name].orientation
-            center = (ports[port_name].center[0] * um, ports[port_name].center[1] * um, 0)
-            
-            if orientation in [0.0, 180.0]:
-                size = (0, (ports[port_name].width + 4.0)*um,2.0*um),
-                if flag_flux_monitor:
-                    # add flux monitor
-                    flux_mnt = td.FluxMonitor(
-                        center = center,
-                        size = size,
-                        freqs = list(freqs),
-                        name = port_name+' flux',
-                    )
-                    monitors.append(flux_mnt)
-
-                # add mode monitor
-                mode_mnt = td.ModeMonitor(
-                    center=center,
-                    size=size,
-                    freqs = list(freqs),
-                    mode_spec = mode_spec,
-                    name = port_name + ' mode'
-                )
-                monitors.append(mode_mnt)
-            
-            if orientation in [90.0, 270.0]:
-                size = ((ports[port_name].width + 4.0)*um, 0, 2.0*um),
-                if flag_flux_monitor:
-                    # add flux monitor
-                    flux_mnt = td.FluxMonitor(
-                        center = center,
-                        size = size,
-                        freqs = list(freqs),
-                        name = port_name+' flux',
-                    )
-                    monitors.append(flux_mnt)
-
-                # add mode monitor
-                mode_mnt = td.ModeMonitor(
-                    center=center,
-                    size=size,
-                    freqs = list(freqs),
-                    mode_spec = mode_spec,
-                    name = port_name + ' mode'
-                )
-                monitors.append(mode_mnt)
-            
-    ##### add solver #####
-    sim_size=(
-        (solver_x_max-solver_x_min)*um,
-        (solver_y_max-solver_y_min)*um,
-        (solver_z_max-solver_z_min)*um,
-    )
-    sim_time = 16.0*(solver_x_max-solver_x_min)*um*2.0/td.C_0
-
-    sim = td.Simulation(
-        size = sim_size,
-        center = (
-            0.5*(solver_x_max+solver_x_min)*um, 
-            0.5*(solver_y_max+solver_y_min)*um, 
-            0.5*(solver_z_max+solver_z_min)*um
-            ),
-        grid_spec=td.GridSpec.auto(min_steps_per_wvl=resolution),
-        structures = struc,
-        sources=[mode_source],
-        monitors=monitors,
-        run_time=sim_time,
-        boundary_spec=td.BoundarySpec.all_sides(boundary=td.Absorber()), # absorber or PML
-        medium = mat_OX,
-    )
+    # dry run: validate and save the simulation locally, without any server call
+    if flag_dry_run:
+        return export_simulation_artifact(sim, file_name=file_name, task_name=task_name)
 
     job = web.Job(simulation=sim, task_name=task_name, verbose=True)
 
@@ -266,6 +117,21 @@ def fdtd_from_gds(parameters):
 
     # optionally run simulation
     if flag_run_simulation:
-        sim_data = job.run(path=file_name+'_results.hdf5')
+        if flag_monitor:
+            # progress, ETA and early abort of a diverging run
+            job.start()
+            report = watch_task(job.task_id, name=task_name, interval=monitor_interval, growth=divergence_growth,
+                                json_name=file_name+'_telemetry.json')
+            if report['state'] == 'diverged':
+                raise DivergenceError(report)
+            if report['state'] != 'finished':
+                raise Exception(f'Task {job.task_id} ended with an error.')
+            sim_data = job.load(path=file_name+'_results.hdf5')
+        else:
+            sim_data = job.run(path=file_name+'_results.hdf5')
+
+        # keep the billed cost next to the results, for the solver comparisons
+        write_to_json(dict_name=dict(task_id=job.task_id, estimated_cost=estimated_cost, real_cost=web.real_cost(job.task_id)),
+                      json_name=file_name+'_cost.json')
 
         return sim_data
\ No newline at end of file
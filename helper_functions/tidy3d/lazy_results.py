@@ -0,0 +1,277 @@
+from collections import OrderedDict
+import os
+import json
+import h5py
+import numpy as np
+import tidy3d as td
+
+# speed of light in um/s, Tidy3D monitors are indexed by frequency
+C_0 = 299792458.0e6
+
+class SliceCache:
+    r""" least recently used cache of decoded slices, bounded in bytes.
+
+    One cache can be shared by the readers of a whole sweep, so that the memory used by post-processing
+    stays below max_bytes whatever the number of results.
+
+    Args:
+        max_bytes (int, optional): memory budget. Defaults to 2 GB.
+    """
+    def __init__(self, max_bytes: int = 2*1024**3):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.slices = OrderedDict()
+
+    def get(self, key):
+        if key not in self.slices:
+            return None
+        self.slices.move_to_end(key)
+        return self.slices[key]
+
+    def put(self, key, value):
+        if value.nbytes > self.max_bytes:
+            return value
+        if key in self.slices:
+            self.nbytes -= self.slices.pop(key).nbytes
+        value.flags.writeable = False
+        self.slices[key] = value
+        self.nbytes += value.nbytes
+        while self.nbytes > self.max_bytes:
+            _, old = self.slices.popitem(last=False)
+            self.nbytes -= old.nbytes
+        return value
+
+    def clear(self):
+        self.slices.clear()
+        self.nbytes = 0
+
+# cache shared by all readers unless one is given
+CACHE = SliceCache()
+
+def _index_key(index):
+    r""" hashable form of a numpy index.
+    """
+    return tuple((item.start, item.stop, item.step) if isinstance(item, slice) else item for item in index)
+
+class LazyResults:
+    r""" lazy reader of a Tidy3D '_results.hdf5', without loading the monitor data.
+
+    Uncompressed, contiguous datasets (the Tidy3D default) are memory-mapped, others are read through h5py.
+    Slices are selected by dimension name, as in xarray, and decoded slices are kept in an LRU cache.
+
+    Example:
+        with LazyResults(file_name) as results:
+            E2 = results.intensity('z-normal field', f=0)
+            T = results.mode_power('o2 mode', direction='+', mode_index=0)
+
+    Args:
+        file_name (str): output base name of the run, or path to the HDF5 file
+        cache (SliceCache | None, optional): cache of decoded slices. Defaults to None, the shared cache.
+        chunk_bytes (int, optional): size of the blocks of derived quantities. Defaults to 64 MB.
+    """
+    def __init__(self, file_name, cache: SliceCache | None = None, chunk_bytes: int = 64*1024**2):
+        path = file_name if file_name.endswith('.hdf5') else file_name+'_results.hdf5'
+        self.path = os.path.abspath(path)
+        self.cache = CACHE if cache is None else cache
+        self.chunk_bytes = chunk_bytes
+        self.file = h5py.File(self.path, 'r')
+        self.arrays = {}
+
+        # monitor name -> group and data array types, from the description of the data
+        info = json.loads(self.file['JSON_STRING'][()])
+        self.monitors = {}
+        for i, data in enumerate(info['data']):
+            self.monitors[data['monitor']['name']] = dict(
+                group = f'data/{i}',
+                type = data['type'],
+                size = data['monitor']['size'],
+                components = {key: value for key, value in data.items() if isinstance(value, str) and value.endswith('DataArray')},
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.arrays.clear()
+        self.file.close()
+
+    def components(self, monitor):
+        r""" names of the data arrays of a monitor, e.g. 'Ex' ... 'Hz' or 'amps', 'n_complex'.
+        """
+        return list(self.monitors[monitor]['components'])
+
+    def dims(self, monitor, component):
+        return getattr(td, self.monitors[monitor]['components'][component])._dims
+
+    def coords(self, monitor, component):
+        r""" coordinates of a data array, by dimension name.
+        """
+        group = self.file[self.monitors[monitor]['group']+'/'+component]
+        coords = {}
+        for dim in self.dims(monitor, component):
+            values = group[dim][()]
+            coords[dim] = values.astype(str) if values.dtype.kind in 'OS' else values
+        return coords
+
+    def array(self, monitor, component):
+        r""" memory-mapped data array of a monitor, or the h5py dataset if it cannot be mapped.
+        """
+        key = (monitor, component)
+        if key not in self.arrays:
+            dataset = self.file[self.monitors[monitor]['group']+'/'+component+'/__xarray_dataarray_variable__']
+            offset = dataset.id.get_offset()
+            if dataset.chunks is None and dataset.compression is None and offset is not None:
+                self.arrays[key] = np.memmap(self.path, mode='r', dtype=dataset.dtype, offset=offset, shape=dataset.shape)
+            else:
+                self.arrays[key] = dataset
+        return self.arrays[key]
+
+    def index(self, monitor, component, **isel):
+        r""" numpy index of a selection by dimension name, e.g. f=0, x=slice(10, 20).
+        """
+        dims = self.dims(monitor, component)
+        for dim in isel:
+            if dim not in dims:
+                raise Exception(f"'{monitor}' {component} has no dimension '{dim}', only {dims}.")
+        return tuple(isel.get(dim, slice(None)) for dim in dims)
+
+    def read(self, monitor, component, **isel):
+        r""" decoded slice of a data array, through the cache.
+
+        Args:
+            monitor (str): monitor name
+            component (str): data array name
+            **isel: integer or slice per dimension name
+
+        Returns:
+            values (ndarray): read-only
+        """
+        index = self.index(monitor, component, **isel)
+        key = (self.path, monitor, component, _index_key(index))
+        values = self.cache.get(key)
+        if values is None:
+            values = self.cache.put(key, np.array(self.array(monitor, component)[index]))
+        return values
+
+    def blocks(self, monitor, component, **isel):
+        r""" split a selection in blocks of at most chunk_bytes along its first dimension.
+
+        Returns:
+            index (tuple): numpy index of the selection
+            blocks (list): (output slice, numpy index of the block)
+        """
+        data = self.array(monitor, component)
+        index = self.index(monitor, component, **isel)
+        if not isinstance(index[0], slice):
+            return index, [(slice(None), index)]
+
+        rows = range(*index[0].indices(data.shape[0]))
+        row_bytes = data.dtype.itemsize*int(np.prod(data.shape[1:]))
+        step = max(1, self.chunk_bytes//max(row_bytes, 1))
+        blocks = []
+        for start in range(0, len(rows), step):
+            block = rows[start:start+step]
+            stop = block[-1] + block.step
+            blocks.append((slice(start, start+len(block)), (slice(block[0], stop if stop >= 0 else None, block.step),) + index[1:]))
+        return index, blocks
+
+    def intensity(self, monitor, components=('Ex', 'Ey', 'Ez'), **isel):
+        r""" field intensity, sum of |component|^2, computed block by block.
+
+        Args:
+            monitor (str): field monitor name
+            components (tuple, optional): field components. Defaults to the electric field.
+            **isel: integer or slice per dimension name, e.g. f=0
+
+        Returns:
+            intensity (ndarray): shape of the selection
+        """
+        intensity = None
+        for component in components:
+            data = self.array(monitor, component)
+            index, blocks = self.blocks(monitor, component, **isel)
+            if intensity is None:
+                intensity = np.zeros(np.broadcast_to(np.empty(()), data.shape)[index].shape)
+            for out, block in blocks:
+                intensity[out] += np.abs(np.asarray(data[block]))**2
+        return intensity
+
+    def flux(self, monitor, **isel):
+        r""" power through a planar field monitor, 0.5 Re (E x H*) integrated over the plane, block by block.
+
+        Args:
+            monitor (str): field monitor name, with one zero size
+            **isel: integer or slice of the frequency, f
+
+        Returns:
+            flux (ndarray): power per frequency
+        """
+        normal = self.monitors[monitor]['size'].index(0)
+        a, b = [(1, 2), (2, 0), (0, 1)][normal]
+        E_a, E_b, H_a, H_b = ['E'+'xyz'[a], 'E'+'xyz'[b], 'H'+'xyz'[a], 'H'+'xyz'[b]]
+
+        # integration weights of the coordinates, 1 along the normal
+        coords = self.coords(monitor, E_a)
+        weights = []
+        for dim in 'xyz':
+            x = coords[dim]
+            weights.append(np.gradient(x) if x.size > 1 else np.ones(1))
+
+        index, blocks = self.blocks(monitor, E_a, **isel)
+        f_index = index[3]
+        num_f = len(np.atleast_1d(coords['f'][f_index]))
+        flux = np.zeros(num_f)
+        for _, block in blocks:
+            S = 0.5*np.real(np.asarray(self.array(monitor, E_a)[block])*np.conj(self.array(monitor, H_b)[block])
+                            - np.asarray(self.array(monitor, E_b)[block])*np.conj(self.array(monitor, H_a)[block]))
+            w = [weights[axis][block[axis]] for axis in range(3)]
+            area = w[0][:, None, None]*w[1][None, :, None]*w[2][None, None, :]
+            S = S.reshape(S.shape[:3] + (-1,))
+            flux += np.sum(S*area[..., None], axis=(0, 1, 2))
+        return flux if isinstance(f_index, slice) else flux[0]
+
+    def mode_power(self, monitor, direction: str | None = None, mode_index: int | None = None, **isel):
+        r""" power of the mode amplitudes of a mode monitor, |amps|^2.
+
+        Args:
+            monitor (str): mode monitor name, e.g. 'o2 mode'
+            direction (str | None, optional): '+' or '-'. Defaults to None, both.
+            mode_index (int | None, optional): mode, counted from 0. Defaults to None, all.
+            **isel: integer or slice of the frequency, f
+
+        Returns:
+            power (ndarray): dimensions (direction, f, mode_index) without the selected ones
+        """
+        if direction is not None:
+            isel['direction'] = list(self.coords(monitor, 'amps')['direction']).index(direction)
+        if mode_index is not None:
+            isel['mode_index'] = mode_index
+        return np.abs(self.read(monitor, 'amps', **isel))**2
+
+    def wavelengths(self, monitor, component):
+        r""" wavelengths of a data array (um), in the order of its frequencies.
+        """
+        return C_0/self.coords(monitor, component)['f']
+
+def map_results(file_names, function, cache: SliceCache | None = None):
+    r""" apply a post-processing function to the results of a sweep, one file open at a time.
+
+    Example:
+        IL = map_results(files, lambda results: results.mode_power('o2 mode', direction='+', mode_index=0))
+
+    Args:
+        file_names (list): output base names of the runs
+        function (function): LazyResults -> value
+        cache (SliceCache | None, optional): cache shared by the runs. Defaults to None, the shared cache.
+
+    Returns:
+        values (list): one value per run
+    """
+    values = []
+    for file_name in file_names:
+        with LazyResults(file_name, cache=cache) as results:
+            values.append(function(results))
+    return values
@@ -2,11 +2,11 @@ import os
 import sys
 import numpy as np
 import tidy3d as td
-from tidy3d.plugins.dispersion import FastDispersionFitter, AdvancedFastFitterParam
-import matplotlib.pyplot as plt
 
-from tidy3d.plugins.dispersion import AdvancedFitterParam
-from tidy3d.plugins.dispersion.web import run as run_fitter
+from helper_functions.generic.materials import material_key, resample_nk
+
+# media fitted over a band, by material_key, for the process
+BAND_MATERIALS = {}
 
 def fit_pole_residue_material(filename,
                               output_file,
@@ -19,6 +19,9 @@ def fit_pole_residue_material(filename,
     r""" perform dispersion fitter on n, k data.
     save fitting result to a json file.
     """
+    import matplotlib.pyplot as plt
+    from tidy3d.plugins.dispersion import FastDispersionFitter, AdvancedFastFitterParam, AdvancedFitterParam
+    from tidy3d.plugins.dispersion.web import run as run_fitter
     
     # read n, k data from file
     mat = read_from_json(filename)
@@ -62,6 +65,50 @@ def load_pole_material(filename):
     medium = td.PoleResidue.from_file(filename+'.json')
     return medium
 
+def fit_band_material(filename, wav_range,
+                      max_num_poles: int = 2,
+                      tolerance_rms: float = 1e-4,
+                      num_points: int = 21,
+                      material_cache: str | None = None):
+    r""" pole residue medium fitted to n, k over a band only, with as few poles as the tolerance allows.
+
+    A narrow band is fitted with one or two poles, where the global fit of the library needs more; every
+    pole adds auxiliary fields to the dispersive update of the solver. Fits are kept by material_key for
+    the process, and in material_cache if given, so that the runs of a sweep fit each material once.
+
+    Args:
+        filename (str): n, k json file name of the materials library, without '.json'.
+        wav_range (tuple): (shortest, longest) wavelength (um), see band_range
+        max_num_poles (int, optional): Defaults to 2.
+        tolerance_rms (float, optional): fit tolerance on n, k. Defaults to 1e-4.
+        num_points (int, optional): samples over the band, see resample_nk. Defaults to 21.
+        material_cache (str | None, optional): directory of the fits as JSON. Defaults to None, kept in memory only.
+
+    Returns:
+        medium (td.PoleResidue)
+    """
+    key = material_key(filename, wav_range, num_points=num_points, max_num_poles=max_num_poles, tolerance_rms=tolerance_rms)
+    if key in BAND_MATERIALS:
+        return BAND_MATERIALS[key]
+
+    cache_file = os.path.join(material_cache, key+'.json') if material_cache else None
+    if cache_file and os.path.exists(cache_file):
+        medium = td.PoleResidue.from_file(cache_file)
+    else:
+        from tidy3d.plugins.dispersion import FastDispersionFitter
+        wavelengths, n, k = resample_nk(filename, wav_range, num_points=num_points)
+        fitter = FastDispersionFitter(wvl_um=wavelengths, n_data=n, k_data=k, wvl_range=wav_range)
+        medium, rms_error = fitter.fit(min_num_poles=1, max_num_poles=max_num_poles, tolerance_rms=tolerance_rms)
+        print(f'{key}: {len(medium.poles)} poles, rms error {rms_error:.2e}')
+        if cache_file:
+            # written aside and renamed, for the workers sharing the cache
+            os.makedirs(material_cache, exist_ok=True)
+            medium.to_file(cache_file[:-len('.json')]+f'_{os.getpid()}.json')
+            os.replace(cache_file[:-len('.json')]+f'_{os.getpid()}.json', cache_file)
+
+    BAND_MATERIALS[key] = medium
+    return medium
+
 if __name__ == "__main__":
     
     current_directory = os.getcwd()
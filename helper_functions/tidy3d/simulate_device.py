@@ -4,6 +4,9 @@ import os
 import json
 
 from helper_functions.generic.misc import write_to_json
+from helper_functions.generic.gds_handling import write_gds
+from helper_functions.generic.run_catalog import record_run
+from helper_functions.generic.parametric import parametric_component, parametric_gds
 from helper_functions.tidy3d.initiate_fdtd import fdtd_from_gds
 
 def simulate_predefined_gds(parameters):
@@ -31,12 +34,23 @@ def simulate_predefined_gds(parameters):
         extension = 10,     # extension length (um)
         
         flag_run_simulation = 0,        # run simulation?
+        flag_dry_run = 0,               # only validate and save the simulation, no server call?
         flag_boolean = 0,               # apply boolean ops?
+        flag_instance = 0,              # keep repeated cells as instanced geometry?
+        flag_mode_preview = 0,          # pick mode_num from a local eigenmode solve of the ports?
+        flag_mesh_override = 0,         # refine the mesh locally around narrow gaps and tips?
+        mesh_min_cells = 4,             # mesh cells required across a critical feature
+        flag_auto_size = 0,             # size the domain and port planes from the decay of the port modes?
+        field_threshold = 1e-2,         # field amplitude, relative to the peak, at the plane edges
         
         solver_z_min = -1,      # simulation region z min (um)
         solver_z_max = 1,       # simulation region z max (um)
         
         change_cladding = False,        # # True: replace top cladding with Si3N4
+
+        catalog_db = None,      # SQLite run catalog, None: runs are not indexed
+        parametric = None,      # gdsfactory function and settings (read_spec), generated instead of reading predefined_gds
+        spec_cache = None,      # directory of the simulation specs shared by the solvers, None: kept in memory only
     )
 
     # load user settings from config.json
@@ -47,8 +61,13 @@ def simulate_predefined_gds(parameters):
     # update default setting with input
     p.update(parameters)
     
+    start_time = datetime.now()
     p['gds_file'] = p['file_name']+'.gds'
 
+    # parametric component: the generated GDS in the layout cache stands for predefined_gds
+    if p['parametric']:
+        p['predefined_gds'] = parametric_gds(p['parametric'])
+
     # convert settings to local variables
     for key, value in p.items():
         globals()[key] = value
@@ -56,8 +75,11 @@ def simulate_predefined_gds(parameters):
     # save parameters to a json file
     write_to_json(dict_name=p, json_name=file_name+'.json')
 
-    device = gf.import_gds(predefined_gds, read_metadata=True)
-    device.write_gds(gds_file, with_metadata=True)
+    if parametric:
+        device = parametric_component(parametric)
+    else:
+        device = gf.import_gds(predefined_gds, read_metadata=True)
+    write_gds(device, gds_file)
 
     # check if the simulation file already exists
     if os.path.exists(file_name+'_results.hdf5') and flag_run_simulation:
@@ -65,14 +87,18 @@ def simulate_predefined_gds(parameters):
         while True:
             response = input("\033[1;91mDo you want to continue? (y/n):\033[0m").strip().lower()
             if response == 'y':
-                results = fdtd_from_gds(parameters=p)
-                return results
                 break
             elif response == 'n':
                 print('\033[1;91mStopping...\033[0m')
-                break
+                return
             else:
                 print("\033[1;91mPlease enter 'y' or 'n'.\033[0m")
-    else:
-       results = fdtd_from_gds(parameters=p)
-       return results 
\ No newline at end of file
+
+    results = fdtd_from_gds(parameters=p)
+
+    # index the finished run in the catalog
+    if catalog_db and flag_run_simulation and not flag_dry_run and results is not None:
+        record_run(db_file=catalog_db, parameters=p, results=results, solver='tidy3d', start_time=start_time)
+
+    return results
+ 
\ No newline at end of file
@@ -0,0 +1,162 @@
+from dataclasses import replace
+import itertools
+import tidy3d.web as web
+
+from helper_functions.generic.misc import write_to_json
+from helper_functions.generic.materials import band_range
+from helper_functions.generic.simulation_spec import build_spec, mesh_overrides
+from helper_functions.tidy3d.compile_spec import (compile_simulation, band_freqs, source_time, source_num_freqs,
+                                                  grid_spec, run_time)
+from helper_functions.tidy3d.dry_run import export_simulation_artifact
+from helper_functions.tidy3d.initiate_fdtd import load_parameters
+
+# settings a variant can change without rebuilding the geometry
+VARIANT_KEYS = ('resolution', 'wavelength', 'wav_span', 'wav_step', 'run_time_factor')
+
+def simulation_variant(base, spec, flag_mesh_override = 0, mesh_min_cells: int = 4, **changes):
+    r""" copy of a base simulation with another mesh, band or run time, structures and planes shared.
+
+    Only the grid spec, the source pulse, the monitor frequencies and the run time are replaced.
+    The port planes and mode count stay those of the base band.
+
+    Args:
+        base (td.Simulation): compiled from spec
+        spec (SimulationSpec): spec of the base simulation
+        flag_mesh_override (int, optional): recompute the mesh overrides for the new mesh step. Defaults to 0.
+        mesh_min_cells (int, optional): mesh cells required across a critical feature. Defaults to 4.
+        **changes: resolution, wavelength, wav_span, wav_step and run_time_factor
+
+    Returns:
+        sim (td.Simulation)
+        spec (SimulationSpec): spec of the variant
+    """
+    for key in changes:
+        if key not in VARIANT_KEYS:
+            raise Exception(f"'{key}' cannot be changed without rebuilding the geometry, only {list(VARIANT_KEYS)}.")
+
+    band = replace(spec.band, **{key: changes[key] for key in ['wavelength', 'wav_span', 'wav_step'] if key in changes})
+    mesh = replace(spec.mesh, resolution=changes.get('resolution', spec.mesh.resolution))
+    if flag_mesh_override and (mesh.resolution != spec.mesh.resolution or band.wavelength != spec.band.wavelength):
+        mesh = replace(mesh, overrides=mesh_overrides(spec.gds_file, band.wavelength, mesh.resolution, spec.material_type,
+                                                      spec.guiding_material, mesh_min_cells=mesh_min_cells))
+    variant = replace(spec, band=band, mesh=mesh)
+
+    update = {}
+    if mesh != spec.mesh:
+        update['grid_spec'] = grid_spec(mesh)
+    if band != spec.band:
+        freqs = band_freqs(band)
+        update['sources'] = [source.updated_copy(source_time=source_time(band), num_freqs=source_num_freqs(band))
+                             for source in base.sources]
+        update['monitors'] = [monitor.updated_copy(freqs=freqs) for monitor in base.monitors]
+    if 'run_time_factor' in changes:
+        update['run_time'] = run_time(spec, changes['run_time_factor'])
+    return (base.updated_copy(**update) if update else base), variant
+
+def sweep_simulations(parameters, sweep):
+    r""" simulations of all combinations of mesh, band and run time settings, from one geometry build.
+
+    The layout work, the materials and the structures are done once for the base simulation,
+    every combination is a copy of it with the changed fields. Materials fitted over the band
+    (flag_band_material) cover the bands of all combinations.
+
+    Example:
+        sims = sweep_simulations(p, sweep=dict(resolution=[6, 8, 10, 12]))
+
+    Args:
+        parameters (dict): simulation parameters of the base, as for fdtd_from_gds, over the defaults and config.json
+        sweep (dict): setting name -> list of values, settings of VARIANT_KEYS
+
+    Returns:
+        variants (list): dicts with the swept settings, 'file_name', 'task_name', 'sim' and 'spec'
+    """
+    # defaults of fdtd_from_gds and config.json under the given parameters
+    p = load_parameters(parameters)
+    base_spec = build_spec(p, solver='tidy3d', spec_cache=p.get('spec_cache'))
+    names = list(sweep)
+
+    # margin of the base band reaching the material range of every band of the sweep
+    material_margin = p.get('material_margin')
+    if p.get('flag_band_material', 0):
+        ranges = []
+        for values in itertools.product(*[sweep[name] for name in names]):
+            band = replace(base_spec.band, **{name: value for name, value in zip(names, values)
+                                              if name in ['wavelength', 'wav_span', 'wav_step']})
+            ranges.append(band_range(band.wav_start, band.wav_stop, material_margin))
+        material_margin = max(base_spec.band.wav_start - min(r[0] for r in ranges),
+                              max(r[1] for r in ranges) - base_spec.band.wav_stop)
+
+    base = compile_simulation(base_spec,
+                              flag_flux_monitor = p.get('flag_flux_monitor', 0),
+                              flag_boolean = p.get('flag_boolean', 0),
+                              flag_instance = p.get('flag_instance', 0),
+                              boundary = p.get('boundary', 'absorber'),
+                              pml_layers = p.get('pml_layers'),
+                              flag_band_material = p.get('flag_band_material', 0),
+                              material_margin = material_margin,
+                              material_cache = p.get('material_cache'))
+
+    variants = []
+    for values in itertools.product(*[sweep[name] for name in names]):
+        changes = dict(zip(names, values))
+        sim, spec = simulation_variant(base, base_spec,
+                                       flag_mesh_override = p.get('flag_mesh_override', 0),
+                                       mesh_min_cells = p.get('mesh_min_cells', 4),
+                                       **changes)
+        suffix = '_'+'_'.join(f'{name}{value}' for name, value in zip(names, values))
+        variants.append(dict(dict(zip(names, values)),
+                             file_name = p['file_name']+suffix,
+                             task_name = p.get('task_name', p['file_name'])+suffix,
+                             sim = sim,
+                             spec = spec))
+    return variants
+
+def run_batch(variants, path_dir, flag_dry_run = 0, folder_name: str = 'default'):
+    r""" run, or export for a later submission, simulations as one batch.
+
+    Args:
+        variants (list): dicts with 'file_name', 'task_name' and 'sim'
+        path_dir (str): folder of the batch downloads
+        flag_dry_run (int, optional): only validate and save the simulations. Defaults to 0.
+        folder_name (str, optional): tidy3d project folder. Defaults to 'default'.
+
+    Returns:
+        outputs (list): artifact dict (dry run) or SimulationData of every variant, saved to file_name+'_results.hdf5'
+    """
+    if flag_dry_run:
+        return [export_simulation_artifact(variant['sim'], file_name=variant['file_name'], task_name=variant['task_name'])
+                for variant in variants]
+
+    batch = web.Batch(simulations={variant['task_name']: variant['sim'] for variant in variants},
+                      folder_name=folder_name, verbose=True)
+    print(f'The estimated maximum cost is {batch.estimate_cost():.3f} Flex Credits.')
+    batch_data = batch.run(path_dir=path_dir)
+    outputs = []
+    for variant in variants:
+        sim_data = batch_data[variant['task_name']]
+        sim_data.to_file(variant['file_name']+'_results.hdf5')
+        outputs.append(sim_data)
+    return outputs
+
+def run_sweep(parameters, sweep, flag_dry_run = 0, folder_name: str = 'default'):
+    r""" run, or export for a later submission, all simulations of a sweep as one batch.
+
+    Args:
+        parameters (dict): simulation parameters of the base, as for fdtd_from_gds
+        sweep (dict): setting name -> list of values
+        flag_dry_run (int, optional): only validate and save the simulations. Defaults to 0.
+        folder_name (str, optional): tidy3d project folder. Defaults to 'default'.
+
+    Returns:
+        runs (list): dicts with the swept settings and 'file_name', with 'artifact' (dry run) or 'sim_data'
+    """
+    variants = sweep_simulations(parameters, sweep)
+    runs = []
+    for variant in variants:
+        write_to_json(dict_name=variant['spec'].to_dict(), json_name=variant['file_name']+'_spec.json')
+        runs.append({key: value for key, value in variant.items() if key not in ['sim', 'spec']})
+
+    outputs = run_batch(variants, path_dir=parameters['file_name']+'_batch', flag_dry_run=flag_dry_run, folder_name=folder_name)
+    for run, output in zip(runs, outputs):
+        run['artifact' if flag_dry_run else 'sim_data'] = output
+    return runs
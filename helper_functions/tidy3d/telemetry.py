@@ -0,0 +1,41 @@
+from tidy3d.web.api.webapi import get_status, get_run_info, abort as abort_task
+from tidy3d.web.core.exceptions import WebError
+
+from helper_functions.generic.telemetry import watch
+
+def watch_task(task_id, name: str = 'task',
+               interval: float = 10.0,
+               growth: float = 100.0,
+               json_name: str | None = None):
+    r""" follow a started Tidy3D task through its progress and field decay, and abort it when the fields grow.
+
+    Args:
+        task_id (str): of a started task
+        name (str, optional): name in the printed lines. Defaults to 'task'.
+        interval (float, optional): seconds between polls. Defaults to 10.
+        growth (float, optional): see detect_divergence. Defaults to 100.
+        json_name (str | None, optional): save the telemetry report. Defaults to None.
+
+    Returns:
+        report (dict): from watch
+    """
+    def poll():
+        try:
+            status = get_status(task_id)
+        except WebError: # raised for the error states
+            return dict(state='error', progress=None, energy=None)
+        if status in ('diverge', 'diverged'):
+            return dict(state='diverged', progress=None, energy=None)
+        if status in ('success', 'completed', 'processed', 'postprocess_success'):
+            return dict(state='finished', progress=1.0, energy=None)
+        if status in ('postprocess', 'run_success'):
+            return dict(state='running', progress=1.0, energy=None)
+        if status in ('running', 'preprocess_success'):
+            perc_done, field_decay = get_run_info(task_id)
+            return dict(state='running', progress=None if perc_done is None else perc_done/100, energy=field_decay)
+        return dict(state='queued', progress=None, energy=None)
+
+    def abort():
+        abort_task(task_id)
+
+    return watch(poll, abort, name=name, interval=interval, growth=growth, json_name=json_name)
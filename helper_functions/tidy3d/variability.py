@@ -0,0 +1,96 @@
+import numpy as np
+
+from helper_functions.generic.misc import write_to_json
+from helper_functions.generic.simulation_spec import build_spec
+from helper_functions.generic.variability import variability_analysis, SIGMA
+from helper_functions.tidy3d.compile_spec import compile_simulation
+from helper_functions.tidy3d.gds_handling import import_gds_to_tidy3d
+from helper_functions.tidy3d.initiate_fdtd import load_parameters
+from helper_functions.tidy3d.sweep import run_batch
+
+def variation_simulation(base, spec, variation, flag_boolean = 0, flag_instance = 0):
+    r""" copy of a base simulation with the device re-extruded under a fabrication variation.
+
+    Only the device structures are replaced; the materials, the cladding, the sources, the monitors
+    and the grid are those of the base.
+
+    Args:
+        base (td.Simulation): compiled from spec
+        spec (SimulationSpec): spec of the base simulation
+        variation (dict): width_bias (um, total), sidewall_angle (degrees) and thickness (um), missing ones 0
+        flag_boolean (int, optional): apply the layer boolean rules on import. Defaults to 0.
+        flag_instance (int, optional): place repeated cells by transforms. Defaults to 0.
+
+    Returns:
+        sim (td.Simulation)
+    """
+    num_cladding = 0 if spec.cladding_index is None else 1
+    structures = import_gds_to_tidy3d(gds_file = spec.gds_file,
+                                      material = base.structures[-1].medium,
+                                      sidewall_angle = np.deg2rad(variation.get('sidewall_angle', 0.0)),
+                                      dilation = 0.5*variation.get('width_bias', 0.0), # per edge
+                                      thickness_bias = variation.get('thickness', 0.0),
+                                      flag_boolean = flag_boolean,
+                                      flag_instance = flag_instance)
+    return base.updated_copy(structures=list(base.structures[:num_cladding]) + list(structures))
+
+def run_variability(parameters, metrics, limits,
+                    num_samples: int = 200,
+                    sigma: dict | None = None,
+                    margins: dict | None = None,
+                    seed: int = 0,
+                    folder_name: str = 'default'):
+    r""" Monte Carlo yield of a device under width, sidewall and thickness variations, on Tidy3D.
+
+    The layout, the spec, the materials and the base simulation are built once; each sample is a copy
+    with re-extruded structures, and each stage of the analysis is submitted as one batch.
+
+    Example:
+        run_variability(p, transmission_metrics(ports=('o3', 'o4')), limits=dict(o3=(-3.5, None), o4=(-3.5, None)))
+
+    Args:
+        parameters (dict): simulation parameters, as for fdtd_from_gds, over the defaults and config.json
+        metrics (function): results -> dict of metric name -> value
+        limits (dict): metric name -> (lower, upper), None for no limit
+        num_samples (int, optional): Monte Carlo samples. Defaults to 200.
+        sigma (dict | None, optional): variation name -> standard deviation. Defaults to None, SIGMA.
+        margins (dict | None, optional): see variability_analysis. Defaults to None.
+        seed (int, optional): random seed. Defaults to 0.
+        folder_name (str, optional): tidy3d project folder. Defaults to 'default'.
+
+    Returns:
+        report (dict): from variability_analysis
+    """
+    # defaults of fdtd_from_gds and config.json under the given parameters
+    p = load_parameters(parameters)
+    spec = build_spec(p, solver='tidy3d', spec_cache=p.get('spec_cache'))
+    write_to_json(dict_name=spec.to_dict(), json_name=p['file_name']+'_spec.json')
+    base = compile_simulation(spec,
+                              flag_flux_monitor = p.get('flag_flux_monitor', 0),
+                              flag_boolean = p.get('flag_boolean', 0),
+                              flag_instance = p.get('flag_instance', 0),
+                              boundary = p.get('boundary', 'absorber'),
+                              pml_layers = p.get('pml_layers'),
+                              flag_band_material = p.get('flag_band_material', 0),
+                              material_margin = p.get('material_margin'),
+                              material_cache = p.get('material_cache'))
+
+    stage = []
+    def evaluate(variations):
+        variants = []
+        for variation in variations:
+            suffix = f'_var{len(stage)}_{len(variants)}'
+            variants.append(dict(file_name = p['file_name']+suffix,
+                                 task_name = p.get('task_name', p['file_name'])+suffix,
+                                 sim = variation_simulation(base, spec, variation,
+                                                            flag_boolean = p.get('flag_boolean', 0),
+                                                            flag_instance = p.get('flag_instance', 0))))
+        stage.append(len(variants))
+        return run_batch(variants, path_dir=p['file_name']+'_batch', folder_name=folder_name)
+
+    return variability_analysis(evaluate, metrics, limits,
+                                num_samples = num_samples,
+                                sigma = SIGMA if sigma is None else sigma,
+                                margins = margins,
+                                seed = seed,
+                                file_name = p['file_name'])
@@ -1,19 +1,21 @@
 import os
 import sys
+import importlib
 from datetime import datetime
 
 # add current working directory to system path
 current_directory = os.getcwd()
 sys.path.append(current_directory)
 
-# import simulation functions for different solvers
+# import simulation functions, the helper stack of the selected solver is imported below
 from gds_library import pdk_universal
-from helper_functions.lumerical.simulate_device import simulate_predefined_gds as lumerical_simulate_predefined_gds
-from helper_functions.tidy3d.simulate_device import simulate_predefined_gds as tidy3d_simulate_predefined_gds
+from helper_functions.generic.convergence import converge_resolution
+from helper_functions.generic.subband import simulate_broadband
 
-# select simulation solver: 'lumerical' or 'tidy3d'
+# select simulation solver: 'lumerical', 'tidy3d' or 'fdtd2d' (local 2.5D screening)
 solver = 'lumerical'
 # solver = 'tidy3d'
+# solver = 'fdtd2d'
 
 # define simulation parameters
 res = 6       # simulation resolution, number of cells per wavelength
@@ -21,6 +23,8 @@ span = 20     # wavelength span (nm)
 um = 0.001    # convert nanometer to micrometer
 mode_idx = 0  # index of the injected mode, Lumerical starts with 1, Tidy3D starts with 0
 flag_run_simulation = 1 # Run simulation?
+flag_converge = 0 # Increase the resolution until the results converge, instead of a single run?
+flag_subband = 0 # Split a wide span into sub-bands run in parallel, when estimated faster?
 
 # define file paths and simulation parameters
 # path to GDS file ready for simulation
@@ -56,8 +60,22 @@ p = dict(
     change_cladding = False,
 )
 
-# Run the simulation using the selected solver
-if solver == 'lumerical':
-    lumerical_simulate_predefined_gds(parameters=p)
-if solver == 'tidy3d':
-    tidy3d_simulate_predefined_gds(parameters=p)
+# Run the simulation using the selected solver, only its helper stack is imported
+pdk_universal.activate()
+simulate = importlib.import_module('helper_functions.'+solver+'.simulate_device').simulate_predefined_gds
+
+if flag_converge:
+    # one output folder and task per resolution, the converged resolution is cached per device and solver
+    p['file_name'] = p['file_name'].replace(f'res{res}_', 'res{res}_')
+    p['task_name'] = p['task_name'].replace(f'res{res}_', 'res{res}_')
+    converge_resolution(
+        simulate = simulate,
+        parameters = p,
+        solver = solver,
+        cache_file = os.path.join(current_directory, 'projects', 'FDTD_solvers', 'coupler', 'Data', 'convergence_cache.json'),
+    )
+elif flag_subband:
+    # one broadband run or parallel sub-bands, stitched into one result
+    simulate_broadband(solver=solver, parameters=p)
+else:
+    simulate(parameters=p)